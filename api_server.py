@@ -0,0 +1,331 @@
+"""Headless asyncio HTTP API over the chatbot's routing and handlers
+
+Endpoints (JSON in, JSON out):
+    GET  /health
+    POST /classify                  {"question": "..."}
+    POST /chat                      {"question": "...", "session_id": "...", "chat_history": [...]}
+    GET  /customer/{id}/history
+
+Handlers are blocking (LangChain, pymongo) so they run on a bounded thread
+pool; requests beyond `max_pending` are rejected with 503 and requests that
+exceed `request_timeout` get 504. The default timeout is the sum of the
+stage deadlines on the slowest /chat path (see default_request_timeout), so
+a degraded answer is still returned before the request gives up. All
+requests share the process-wide model set from model_registry.
+
+    export MONGODB_URI=... GOOGLE_API_KEY=...
+    python api_server.py --port 8080 --workers 8
+    python api_server.py --stub          # fake embeddings/LLM, no API key needed
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import logging
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+
+from chat_service import (
+    answer_question, run_customer_history, HISTORY_TURNS, RETRIEVAL_TIMEOUT, SEARCH_DB_TIMEOUT
+)
+from columnar_store import get_columnar_store
+from gateway import gateway_stats, stage_timeout
+from intent_classifier import CLASSIFY_TIMEOUT
+from speculation import size_pool, speculation_stats
+from session_memory import model_footprint, process_rss_bytes
+from tracing import trace_context
+from model_registry import model_registry, build_shared_models
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_BYTES = 1024 * 1024
+# Slack on top of the stage deadlines for Mongo lookups, JSON and scheduling
+REQUEST_HEADROOM = 5.0
+_CUSTOMER_PATH_RE = re.compile(r"^/customer/([^/]+)/history/?$")
+_REASONS = {
+    200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+    408: "Request Timeout", 413: "Payload Too Large", 500: "Internal Server Error",
+    503: "Service Unavailable", 504: "Gateway Timeout",
+}
+
+
+class HTTPError(Exception):
+    """Raised by route handlers to return a JSON error response"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class SessionHistories:
+    """Recent chat turns per session_id, bounded in sessions and turns"""
+
+    def __init__(self, max_sessions: int = 10000, turns: int = HISTORY_TURNS):
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+        self.max_sessions = max_sessions
+        self.turns = turns
+
+    def get(self, session_id):
+        with self._lock:
+            history = self._sessions.get(session_id)
+            if history is None:
+                return []
+            self._sessions.move_to_end(session_id)
+            return list(history)
+
+    def append(self, session_id, entry):
+        with self._lock:
+            history = self._sessions.setdefault(session_id, [])
+            history.append(entry)
+            del history[:-self.turns]
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+
+def default_request_timeout():
+    """Request deadline covering the slowest /chat path, or None if a stage has no deadline
+
+    That path classifies, times out in the RAG chain, then waits for the
+    speculative retrieval and retries retrieval for the degraded answer.
+    """
+    stages = [
+        stage_timeout("classify", CLASSIFY_TIMEOUT),
+        stage_timeout("search_db", SEARCH_DB_TIMEOUT),
+        stage_timeout("retrieval", RETRIEVAL_TIMEOUT),
+    ]
+    if not all(stages):
+        return None
+    return sum(stages) + RETRIEVAL_TIMEOUT + REQUEST_HEADROOM
+
+
+class ChatAPIServer:
+    """Route HTTP requests to chat_service on a bounded worker pool"""
+
+    def __init__(self, collections, registry=model_registry, max_workers: int = 8,
+                 max_pending: int = 64, request_timeout: float = None):
+        self.collections = collections
+        self.registry = registry
+        self.request_timeout = request_timeout or default_request_timeout()
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="chat-worker")
+        # One speculative retrieval per in-flight turn, so prefetches don't queue behind each other
+        size_pool(max_workers)
+        self.histories = SessionHistories()
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+
+    def _release(self, _future=None):
+        with self._pending_lock:
+            self._pending -= 1
+
+    async def run_blocking(self, func, *args):
+        """Run a blocking handler on the pool with admission control and a deadline
+
+        The pending slot is released when the worker actually finishes, so a
+        timed-out call still counts against `max_pending` until it returns.
+        """
+        with self._pending_lock:
+            if self._pending >= self.max_pending:
+                raise HTTPError(503, "Server busy, try again later")
+            self._pending += 1
+
+        try:
+            # Carry trace labels (session, intent) into the worker thread
+            context = contextvars.copy_context()
+            future = asyncio.get_running_loop().run_in_executor(self.executor, context.run, func, *args)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout=self.request_timeout)
+        except asyncio.TimeoutError:
+            raise HTTPError(504, f"Request exceeded {self.request_timeout:.0f}s timeout")
+
+    def _models(self):
+        model_set = self.registry.current()
+        if model_set is None:
+            raise HTTPError(503, "Models are not built yet")
+        return model_set
+
+    # Routes ---------------------------------------------------------------
+
+    async def health(self, body):
+        model_set = self.registry.current()
+        # Walks the model objects (cached per version); bypasses admission so health never 503s
+        footprint = await asyncio.get_running_loop().run_in_executor(
+            self.executor, model_footprint, model_set
+        ) if model_set else {}
+        rss = process_rss_bytes()
+        return {
+            "status": "ok",
+            "model_version": model_set.version if model_set else None,
+            "pending": self._pending,
+            "gateways": gateway_stats(),
+            "speculation": speculation_stats(),
+            "memory": {
+                "rss_mb": round(rss / 1024 / 1024, 1) if rss is not None else None,
+                "model_mb": {name: round(size / 1024 / 1024, 3) for name, size in footprint.items()},
+            },
+        }
+
+    async def classify(self, body):
+        question = _require_question(body)
+        model_set = self._models()
+        intent, conf = await self.run_blocking(model_set.intent_classifier.classify, question)
+        return {"question": question, "intent": intent, "confidence": conf}
+
+    async def chat(self, body):
+        question = _require_question(body)
+        model_set = self._models()
+        session_id = body.get("session_id")
+        history = body.get("chat_history")
+        if history is None and session_id:
+            history = self.histories.get(session_id)
+
+        with trace_context(session=session_id or "anonymous"):
+            response = await self.run_blocking(
+                answer_question, question, model_set, self.collections, history or []
+            )
+        if session_id:
+            self.histories.append(session_id, {"user": question, "bot": response["answer"]})
+        response["model_version"] = model_set.version
+        return response
+
+    async def customer_history(self, customer_id):
+        result = await self.run_blocking(run_customer_history, customer_id, self.collections, True)
+        if result["customer"] is None:
+            raise HTTPError(404, result["answer"])
+        return result
+
+    # HTTP plumbing --------------------------------------------------------
+
+    async def dispatch(self, method, path, body):
+        if path == "/health":
+            return await self.health(body)
+        if path in ("/classify", "/chat"):
+            if method != "POST":
+                raise HTTPError(405, f"{path} only accepts POST")
+            return await (self.classify(body) if path == "/classify" else self.chat(body))
+        match = _CUSTOMER_PATH_RE.match(path)
+        if match:
+            if method != "GET":
+                raise HTTPError(405, f"{path} only accepts GET")
+            return await self.customer_history(unquote(match.group(1)))
+        raise HTTPError(404, f"No route for {path}")
+
+    async def handle_connection(self, reader, writer):
+        status, payload = 200, None
+        try:
+            method, path, body = await asyncio.wait_for(_read_request(reader), timeout=10)
+            payload = await self.dispatch(method, path, body)
+        except HTTPError as e:
+            status, payload = e.status, {"error": e.message}
+        except asyncio.TimeoutError:
+            status, payload = 408, {"error": "Timed out reading request"}
+        except Exception as e:
+            # Details stay in the log; they may include internals
+            logger.error("API request failed: %s", e, exc_info=True)
+            status, payload = 500, {"error": "Internal server error"}
+
+        data = json.dumps(payload, default=str).encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: close\r\n\r\n".encode("ascii") + data
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8080):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        logger.info("✓ Chat API listening on http://%s:%s", host, port)
+        async with server:
+            await server.serve_forever()
+
+
+def _require_question(body):
+    question = (body or {}).get("question")
+    if not isinstance(question, str) or not question.strip():
+        raise HTTPError(400, "'question' must be a non-empty string")
+    return question.strip()
+
+
+async def _read_request(reader):
+    """Parse an HTTP/1.1 request line, headers and JSON body"""
+    request_line = (await reader.readline()).decode("latin-1").strip()
+    parts = request_line.split()
+    if len(parts) != 3:
+        raise HTTPError(400, "Malformed request line")
+    method, target, _version = parts
+
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode("latin-1")
+        if line in ("\r\n", "\n", ""):
+            break
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get("content-length") or 0)
+    except ValueError:
+        raise HTTPError(400, "Content-Length must be an integer")
+    if length < 0:
+        raise HTTPError(400, "Content-Length must not be negative")
+    if length > MAX_BODY_BYTES:
+        raise HTTPError(413, "Request body too large")
+    body = {}
+    if length:
+        try:
+            body = json.loads(await reader.readexactly(length))
+        except asyncio.IncompleteReadError:
+            raise HTTPError(400, "Body shorter than Content-Length")
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            raise HTTPError(400, "Body must be valid UTF-8 JSON")
+        if not isinstance(body, dict):
+            raise HTTPError(400, "Body must be a JSON object")
+
+    return method.upper(), target.split("?", 1)[0], body
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the headless chat API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=8, help="Handler thread pool size")
+    parser.add_argument("--max-pending", type=int, default=64, help="Reject with 503 beyond this many queued requests")
+    parser.add_argument("--timeout", type=float, default=None,
+                        help="Per-request timeout in seconds (default: sum of the stage deadlines plus headroom)")
+    parser.add_argument("--stub", action="store_true", help="Use fake embedding and LLM backends")
+    args = parser.parse_args()
+
+    from db import connect_collections
+    from logging_config import setup_logging
+
+    setup_logging()
+    collections = connect_collections()
+    get_columnar_store(collections)
+    build_shared_models(collections, stub=args.stub)
+
+    server = ChatAPIServer(
+        collections,
+        max_workers=args.workers,
+        max_pending=args.max_pending,
+        request_timeout=args.timeout
+    )
+    asyncio.run(server.serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""Bulk question answering for offline evaluation
+
+Reads questions from JSONL (one object with a "question" field per line) or
+CSV (a "question" column), classifies them in batches, runs the same intent
+handlers as the chat UI with bounded concurrency and a request-rate limit, and
+appends one JSON result per question to the output file. Re-running with the
+same output file skips questions that already have a successful result;
+failed and degraded (model unavailable) rows are retried and the newer row
+appended after them.
+
+    export MONGODB_URI=... GOOGLE_API_KEY=...
+    python batch_qa.py questions.jsonl answers.jsonl --concurrency 4 --rate 2
+    python batch_qa.py questions.csv answers.jsonl --stub
+"""
+import argparse
+import csv
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from chat_service import handle_intent
+from tracing import collect_spans
+from utils import token_counter
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """Token bucket allowing `rate` acquisitions per second (bursts up to `burst`)"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def read_questions(path):
+    """Yield {"id", "question", ...} records from a JSONL or CSV file
+
+    Records without an "id" get their 1-based position in the file.
+    """
+    if path.lower().endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            rows = csv.DictReader(f)
+            for idx, row in enumerate(rows, 1):
+                if row.get("question"):
+                    row.setdefault("id", str(idx))
+                    yield row
+        return
+
+    with open(path, encoding="utf-8") as f:
+        for idx, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if record.get("question"):
+                record["id"] = str(record.get("id", idx))
+                yield record
+
+
+def completed_ids(output_path):
+    """IDs already written to the output file (for resuming)"""
+    done = set()
+    try:
+        with open(output_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                    # Failed and degraded rows are retried on the next run
+                    if "error" not in row and not row.get("degraded"):
+                        done.add(str(row["id"]))
+                except (ValueError, KeyError):
+                    # Ignore a truncated last line from an interrupted run
+                    continue
+    except FileNotFoundError:
+        pass
+    return done
+
+
+def answer_one(record, intent, conf, model_set, collections, limiter):
+    """Run the handler for one classified question and build its result row"""
+    limiter.acquire()
+    started = time.perf_counter()
+    result = {"id": record["id"], "question": record["question"], "intent": intent, "confidence": conf}
+    with collect_spans() as spans:
+        try:
+            response = handle_intent(record["question"], intent, conf, model_set, collections)
+            result.update({
+                "answer": response["answer"],
+                "sources": response["sources"],
+                "customer_id": (response.get("customer") or {}).get("customer_id"),
+                "degraded": response.get("degraded", False),
+            })
+        except Exception as e:
+            logger.warning("Question %s failed: %s", record["id"], e)
+            result.update({"answer": None, "sources": [], "error": str(e)})
+
+    result["tokens"] = {
+        "question": token_counter.count_tokens(record["question"]),
+        "context": token_counter.count_tokens("\n".join(result["sources"])),
+        "answer": token_counter.count_tokens(result["answer"] or ""),
+    }
+    result["latency_ms"] = {stage: round(seconds * 1000, 2) for stage, seconds in spans.items()}
+    result["latency_ms"]["total"] = round((time.perf_counter() - started) * 1000, 2)
+    # Carry through any extra columns (expected answers, labels, ...)
+    result["input"] = {k: v for k, v in record.items() if k not in ("id", "question")}
+    return result
+
+
+def run_batch(input_path, output_path, model_set, collections, concurrency: int = 4,
+              rate: float = 0.0, batch_size: int = 64):
+    """Answer every not-yet-answered question; returns (answered, failed)"""
+    done = completed_ids(output_path)
+    limiter = RateLimiter(rate, burst=concurrency)
+    answered = failed = 0
+
+    def batches():
+        batch = []
+        for record in read_questions(input_path):
+            if record["id"] in done:
+                continue
+            batch.append(record)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    with open(output_path, "a", encoding="utf-8") as out, \
+            ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch-qa") as pool:
+        for batch in batches():
+            t0 = time.perf_counter()
+            classified = model_set.intent_classifier.classify_batch([r["question"] for r in batch])
+            classify_ms = round((time.perf_counter() - t0) * 1000 / len(batch), 2)
+
+            futures = [
+                pool.submit(answer_one, record, intent, conf, model_set, collections, limiter)
+                for record, (intent, conf) in zip(batch, classified)
+            ]
+            for future in as_completed(futures):
+                result = future.result()
+                result["latency_ms"]["classify_batch_per_question"] = classify_ms
+                out.write(json.dumps(result, default=str) + "\n")
+                out.flush()
+                if "error" in result:
+                    failed += 1
+                else:
+                    answered += 1
+            logger.info("✓ %s answered, %s failed so far", answered, failed)
+
+    return answered, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a file of questions offline")
+    parser.add_argument("input", help="Questions file (.jsonl or .csv)")
+    parser.add_argument("output", help="Results file (.jsonl); appended to and used for resuming")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=0.0, help="Max handler calls per second (0 = unlimited)")
+    parser.add_argument("--batch-size", type=int, default=64, help="Questions per classification batch")
+    parser.add_argument("--stub", action="store_true", help="Use fake embedding and LLM backends")
+    args = parser.parse_args()
+
+    from columnar_store import get_columnar_store
+    from db import connect_collections
+    from logging_config import setup_logging
+    from model_registry import build_shared_models
+
+    setup_logging()
+    collections = connect_collections()
+    get_columnar_store(collections)
+    model_set = build_shared_models(collections, stub=args.stub)
+
+    answered, failed = run_batch(
+        args.input, args.output, model_set, collections,
+        concurrency=args.concurrency, rate=args.rate, batch_size=args.batch_size
+    )
+    print(f"✓ Answered {answered} questions ({failed} failed) → {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+"""Performance benchmarks: synthetic data, fake model backends and the benchmark runner"""
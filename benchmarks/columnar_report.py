@@ -0,0 +1,96 @@
+"""Memory footprint and aggregation latency of the columnar transaction store
+
+Loads synthetic transactions into columnar_store.ColumnarTransactionStore in
+ingest-sized batches, then times the group-by, top-k, time-series and
+filtered-total queries the chat and dashboard use.
+
+    python -m benchmarks.columnar_report --rows 1000000
+"""
+import argparse
+import json
+import logging
+import time
+from datetime import date
+
+from benchmarks.synthetic_data import generate_records
+from columnar_store import ColumnarTransactionStore
+from tracing import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+# Export field -> stored transaction field (as upload_json_to_mongodb maps them)
+FIELDS = {
+    "Customer ID": "customer_id", "Product": "product_name", "Category": "category",
+    "Quantity_piece": "quantity", "Gross_Amount": "gross_amount", "Discount_Percentage": "discount_percentage",
+    "Total Amount": "total_amount", "GST": "gst", "Date_of_purchase": "date_of_purchase",
+    "Channel": "channel", "Store_location": "store_location",
+}
+
+QUERIES = {
+    "group_by_category": lambda s: s.group_by("category"),
+    "top5_products": lambda s: s.top_k("product_name", k=5),
+    "top10_customers_units": lambda s: s.top_k("customer_id", k=10, value="quantity"),
+    "monthly_revenue": lambda s: s.time_series("month"),
+    "total_march_electronics": lambda s: s.total(
+        filters={"category": ["Electronics"]}, date_range=(date(2024, 3, 1), date(2024, 3, 31))
+    ),
+}
+
+
+def load_synthetic(rows, batch_size=10000, seed=42):
+    """Store filled with `rows` synthetic transactions; returns (store, seconds)"""
+    store = ColumnarTransactionStore()
+    batch, elapsed = [], 0.0
+    for record in generate_records(rows, seed):
+        batch.append({field: record.get(name) for name, field in FIELDS.items()})
+        if len(batch) >= batch_size:
+            t0 = time.perf_counter()
+            store.append(batch)
+            elapsed += time.perf_counter() - t0
+            batch = []
+    t0 = time.perf_counter()
+    store.append(batch)
+    return store, elapsed + time.perf_counter() - t0
+
+
+def time_queries(store, repeats):
+    results = {}
+    for name, query in QUERIES.items():
+        histogram = LatencyHistogram(max_samples=repeats)
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            query(store)
+            histogram.observe(time.perf_counter() - t0)
+        quantiles = histogram.quantiles((0.5, 0.95))
+        results[name] = {"p50_ms": round(quantiles[0.5] * 1000, 3), "p95_ms": round(quantiles[0.95] * 1000, 3)}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Columnar store memory and aggregation latency")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--repeats", type=int, default=50)
+    parser.add_argument("--output", default=None, help="Write the JSON report here")
+    args = parser.parse_args()
+
+    store, append_seconds = load_synthetic(args.rows)
+    report = store.memory_report()
+    queries = time_queries(store, args.repeats)
+
+    print(f"rows: {report['rows']:,}  append: {append_seconds:.2f}s  "
+          f"memory: {report['bytes'] / 1e6:.1f} MB  ({report['bytes_per_row']} B/row, "
+          f"{report['mb_per_million_rows']} MB per million rows)")
+    for column, size in report["columns"].items():
+        print(f"  {column:<22} {size / 1e6:>8.2f} MB")
+    print(f"{'query':<26} {'p50 ms':>8} {'p95 ms':>8}")
+    for name, r in queries.items():
+        print(f"{name:<26} {r['p50_ms']:>8} {r['p95_ms']:>8}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"append_seconds": append_seconds, "memory": report, "queries": queries}, f, indent=2)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,131 @@
+"""Memory saved vs. recall lost for compact vector storage
+
+Builds an exact float32 flat index as the baseline, then float16, int8 and
+PCA-reduced variants (optionally combined) with and without full-precision
+rescoring from a memory-mapped file, and reports recall@k against the
+baseline, index memory, the share of memory saved and per-query latency.
+
+    python -m benchmarks.compact_report --rows 100000 --dimensions 768
+    python -m benchmarks.compact_report --vectors embeddings.npy --index-type hnsw
+
+Without --vectors, synthetic sales records are embedded with FakeEmbeddings.
+"""
+import argparse
+import json
+import logging
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.index_report import synthetic_vectors
+from tracing import LatencyHistogram
+from vector_index import IndexConfig, RescoringIndex, create_index, index_memory_bytes, save_full_precision
+
+logger = logging.getLogger(__name__)
+
+# (storage, pca fraction of the input dimensions)
+VARIANTS = [
+    ("float16", None),
+    ("int8", None),
+    ("float32", 0.5),
+    ("float32", 0.25),
+    ("float16", 0.5),
+    ("int8", 0.5),
+]
+
+
+def search_all(index, queries, k):
+    histogram = LatencyHistogram(max_samples=len(queries))
+    found = np.empty((len(queries), k), dtype=np.int64)
+    for i, query in enumerate(queries):
+        t0 = time.perf_counter()
+        _, ids = index.search(query.reshape(1, -1), k)
+        histogram.observe(time.perf_counter() - t0)
+        found[i] = ids[0]
+    return found, histogram.quantiles((0.5, 0.95))
+
+
+def evaluate(config, base, queries, k, truth, full_vectors=None):
+    """Build one compact index; measure recall@k, memory and latency (rescored if full_vectors)"""
+    t0 = time.perf_counter()
+    index = create_index(base, config)
+    index.add(base)
+    build_seconds = time.perf_counter() - t0
+    if full_vectors is not None:
+        index = RescoringIndex(index, full_vectors, config.rescore_factor)
+
+    found, quantiles = search_all(index, queries, k)
+    hits = sum(len(set(found[i]) & set(truth[i])) for i in range(len(queries)))
+    return {
+        "storage": config.storage,
+        "pca_dims": config.pca_dims,
+        "rescore_factor": config.rescore_factor if full_vectors is not None else 0,
+        "build_seconds": round(build_seconds, 3),
+        "memory_mb": round(index_memory_bytes(index) / 1024 / 1024, 2),
+        f"recall@{k}": round(hits / (len(queries) * k), 4),
+        "p50_ms": round(quantiles[0.5] * 1000, 3),
+        "p95_ms": round(quantiles[0.95] * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare compact vector storage memory and recall")
+    parser.add_argument("--rows", type=int, default=100000, help="Vectors to index (synthetic)")
+    parser.add_argument("--vectors", default=None, help=".npy file of real embeddings to use instead")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dimensions", type=int, default=768, help="Synthetic embedding size")
+    parser.add_argument("--index-type", default="flat", help="Index type for the compact variants")
+    parser.add_argument("--rescore-factor", type=int, default=4)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--output", default=None, help="Write the JSON report here")
+    args = parser.parse_args()
+
+    if args.vectors:
+        vectors = np.load(args.vectors).astype(np.float32)
+        base, queries = vectors[:-args.queries], vectors[-args.queries:]
+    else:
+        base, queries = synthetic_vectors(args.rows, args.queries, args.dimensions)
+    dimensions = base.shape[1]
+
+    baseline_index = create_index(base, IndexConfig("flat"))
+    baseline_index.add(base)
+    truth, quantiles = search_all(baseline_index, queries, args.k)
+    baseline_mb = round(index_memory_bytes(baseline_index) / 1024 / 1024, 2)
+    results = [{
+        "storage": "float32", "pca_dims": None, "rescore_factor": 0, "build_seconds": None,
+        "memory_mb": baseline_mb, f"recall@{args.k}": 1.0,
+        "p50_ms": round(quantiles[0.5] * 1000, 3), "p95_ms": round(quantiles[0.95] * 1000, 3),
+    }]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        full_vectors = save_full_precision(base, tmp)
+        for storage, fraction in VARIANTS:
+            config = IndexConfig(
+                args.index_type, storage=storage, rescore_factor=args.rescore_factor,
+                pca_dims=int(dimensions * fraction) if fraction else None,
+            )
+            results.append(evaluate(config, base, queries, args.k, truth))
+            results.append(evaluate(config, base, queries, args.k, truth, full_vectors))
+        del full_vectors
+
+    for r in results:
+        r["memory_saved"] = round(1 - r["memory_mb"] / baseline_mb, 3) if baseline_mb else None
+
+    print(f"baseline: float32 flat, {len(base):,} x {dimensions} vectors, {baseline_mb} MB "
+          f"(rescoring reads a {base.nbytes / 1024 / 1024:.1f} MB memory-mapped file)")
+    print(f"{'storage':<9} {'pca':>5} {'rescore':>8} {'recall':>7} {'MB':>8} {'saved':>6} {'p50 ms':>8} {'p95 ms':>8}")
+    for r in results:
+        print(f"{r['storage']:<9} {r['pca_dims'] or '-':>5} {r['rescore_factor'] or '-':>8} "
+              f"{r[f'recall@{args.k}']:>7} {r['memory_mb']:>8} {r['memory_saved']:>6.1%} "
+              f"{r['p50_ms']:>8} {r['p95_ms']:>8}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"vectors": len(base), "dimensions": dimensions, "queries": len(queries),
+                       "k": args.k, "index_type": args.index_type, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
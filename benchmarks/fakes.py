@@ -0,0 +1,55 @@
+"""Deterministic stand-ins for the Google embedding and chat models
+
+Both plug into the same LangChain interfaces build_rag_model uses, so FAISS,
+the retrieval chain and EmbeddingIntentClassifier run unchanged and offline.
+"""
+import hashlib
+import re
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+class FakeEmbeddings(Embeddings):
+    """Hashed bag-of-words embeddings: same text always maps to the same unit vector
+
+    Texts sharing words get similar vectors, so retrieval and intent
+    classification behave plausibly without calling an API.
+    """
+
+    def __init__(self, dimensions: int = 256, latency: float = 0.0):
+        self.dimensions = dimensions
+        self.latency = latency
+
+    def _embed(self, text: str) -> list:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for token in _TOKEN_RE.findall(text.lower()):
+            digest = hashlib.md5(token.encode("utf-8")).digest()
+            index = int.from_bytes(digest[:4], "little") % self.dimensions
+            vector[index] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector /= norm
+        return vector.tolist()
+
+    def embed_documents(self, texts):
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._embed(text)
+
+
+def fake_llm(latency: float = 0.0, responses=None):
+    """Chat model that cycles through canned responses after `latency` seconds"""
+    return FakeListChatModel(
+        responses=responses or ["Based on the transaction data, here is the answer."],
+        sleep=latency or None
+    )
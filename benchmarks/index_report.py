@@ -0,0 +1,118 @@
+"""Recall vs. latency report for the vector index types in vector_index.py
+
+Builds a flat (exact) baseline and each candidate index over the same
+vectors, then measures recall@k against the baseline, per-query latency,
+build time and index size.
+
+    python -m benchmarks.index_report --rows 100000
+    python -m benchmarks.index_report --vectors embeddings.npy --queries 500
+
+Without --vectors, synthetic sales records are embedded with FakeEmbeddings.
+"""
+import argparse
+import json
+import logging
+import time
+
+import numpy as np
+
+from tracing import LatencyHistogram
+from vector_index import IndexConfig, create_index, set_search_params, index_memory_bytes
+
+logger = logging.getLogger(__name__)
+
+CANDIDATES = [
+    IndexConfig("flat"),
+    IndexConfig("ivf_flat", nprobe=4),
+    IndexConfig("ivf_flat", nprobe=16),
+    IndexConfig("ivf_pq", nprobe=8),
+    IndexConfig("ivf_pq", nprobe=32),
+    IndexConfig("hnsw", ef_search=32),
+    IndexConfig("hnsw", ef_search=128),
+]
+
+
+def synthetic_vectors(rows, queries, dimensions, seed=42):
+    """Embed synthetic records; the last `queries` rows are held out as queries"""
+    from benchmarks.fakes import FakeEmbeddings
+    from benchmarks.synthetic_data import generate_records
+
+    texts = [" ".join(str(v) for v in record.values()) for record in generate_records(rows + queries, seed)]
+    vectors = np.asarray(FakeEmbeddings(dimensions).embed_documents(texts), dtype=np.float32)
+    return vectors[:rows], vectors[rows:]
+
+
+def evaluate(config, base, queries, k, truth=None):
+    """Build one index and measure build time, size, latency and recall@k"""
+    t0 = time.perf_counter()
+    index = create_index(base, config)
+    index.add(base)
+    build_seconds = time.perf_counter() - t0
+    set_search_params(index, nprobe=config.nprobe, ef_search=config.ef_search)
+
+    histogram = LatencyHistogram(max_samples=len(queries))
+    found = np.empty((len(queries), k), dtype=np.int64)
+    for i, query in enumerate(queries):
+        t = time.perf_counter()
+        _, ids = index.search(query.reshape(1, -1), k)
+        histogram.observe(time.perf_counter() - t)
+        found[i] = ids[0]
+
+    recall = None
+    if truth is not None:
+        hits = sum(len(set(found[i]) & set(truth[i])) for i in range(len(queries)))
+        recall = round(hits / (len(queries) * k), 4)
+
+    quantiles = histogram.quantiles()
+    return {
+        "index": type(index).__name__,
+        "config": config._asdict(),
+        "build_seconds": round(build_seconds, 3),
+        "memory_mb": round(index_memory_bytes(index) / 1024 / 1024, 2),
+        f"recall@{k}": recall,
+        "p50_ms": round(quantiles[0.5] * 1000, 3),
+        "p95_ms": round(quantiles[0.95] * 1000, 3),
+        "p99_ms": round(quantiles[0.99] * 1000, 3),
+    }, found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare vector index recall and latency")
+    parser.add_argument("--rows", type=int, default=100000, help="Vectors to index (synthetic)")
+    parser.add_argument("--vectors", default=None, help=".npy file of real embeddings to use instead")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dimensions", type=int, default=256, help="Synthetic embedding size")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--output", default=None, help="Write the JSON report here")
+    args = parser.parse_args()
+
+    if args.vectors:
+        vectors = np.load(args.vectors).astype(np.float32)
+        base, queries = vectors[:-args.queries], vectors[-args.queries:]
+    else:
+        base, queries = synthetic_vectors(args.rows, args.queries, args.dimensions)
+
+    results = []
+    baseline, truth = evaluate(CANDIDATES[0], base, queries, args.k)
+    baseline[f"recall@{args.k}"] = 1.0
+    results.append(baseline)
+    for config in CANDIDATES[1:]:
+        result, _ = evaluate(config, base, queries, args.k, truth)
+        results.append(result)
+
+    print(f"{'index':<14} {'params':<24} {'recall':>7} {'p50 ms':>8} {'p95 ms':>8} {'MB':>8} {'build s':>8}")
+    for r in results:
+        c = r["config"]
+        params = {"ivf_flat": f"nprobe={c['nprobe']}", "ivf_pq": f"nprobe={c['nprobe']} m={c['pq_m']}",
+                  "hnsw": f"M={c['hnsw_m']} ef={c['ef_search']}"}.get(c["index_type"], "-")
+        print(f"{c['index_type']:<14} {params:<24} {r[f'recall@{args.k}']:>7} {r['p50_ms']:>8} "
+              f"{r['p95_ms']:>8} {r['memory_mb']:>8} {r['build_seconds']:>8}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"vectors": len(base), "queries": len(queries), "k": args.k, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
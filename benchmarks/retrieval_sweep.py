@@ -0,0 +1,365 @@
+"""Retrieval-configuration sweep: quality vs. cost over a labelled question set
+
+Builds an index for every combination of indexed-row limit, chunking and
+index type, then evaluates each k / fetch_k against questions labelled with
+the invoice or customer ids a correct answer must retrieve. Each row
+reports hit rate, MRR, build time, index memory, query latency and prompt
+tokens; rows on the Pareto front (no other row is at least as good on every
+objective in PARETO_OBJECTIVES and better on one) are starred.
+
+    export MONGODB_URI=mongodb://localhost:27017
+    python -m benchmarks.retrieval_sweep --rows 5000 --limits 200 1000 0 \\
+        --chunking transaction 1000:200 500:50 --indexes flat hnsw --k 2 4 8
+    python -m benchmarks.retrieval_sweep --app-data --questions labelled.json --embeddings google
+
+Chunking is either "transaction" (one document per transaction, filtered and
+re-ranked by retrievers.FilteredRetriever as the app does) or "SIZE:OVERLAP"
+(transactions joined and split with RecursiveCharacterTextSplitter, plain
+similarity search). A labelled question file is a JSON list of
+{"question": ..., "expected": ["INV-...", "CUST..."]}; without one, questions
+are generated from a sample of the transactions. Apply the chosen settings
+with INDEX_DOCUMENT_LIMIT, VECTOR_INDEX_TYPE, RETRIEVAL_K and RETRIEVAL_FETCH_K.
+
+The default --embeddings fake (hashed bag of words) only measures token
+overlap, so use it to compare cost, not quality. --embeddings google uses the
+app's text-embedding-004 (GOOGLE_API_KEY); document and query vectors are
+cached under --embedding-cache, one file per corpus, so repeated sweeps over
+the same data don't re-embed it. The report names the embedding model.
+Per-transaction retrievers get the customer/product profile index, embedded
+with the same model as the transactions (PROFILE_INDEX=0 leaves it out).
+"""
+import hashlib
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from benchmarks.fakes import FakeEmbeddings
+from tracing import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+# Objective -> direction; the sweep table marks rows no other row dominates
+PARETO_OBJECTIVES = {"hit_rate": "max", "p95_ms": "min", "prompt_tokens": "min", "memory_mb": "min"}
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings memoised on disk: one .npy per embedded corpus, queries in one .json
+
+    Entries are keyed by the model name and the exact texts, so a changed
+    corpus or model is embedded afresh.
+    """
+
+    def __init__(self, inner, model_name, directory):
+        self.inner = inner
+        self.model_name = model_name
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._queries_path = os.path.join(directory, f"{self._digest([model_name])}-queries.json")
+        self._queries = {}
+        if os.path.exists(self._queries_path):
+            with open(self._queries_path, encoding="utf-8") as f:
+                self._queries = json.load(f)
+
+    def _digest(self, texts):
+        digest = hashlib.sha1(self.model_name.encode("utf-8"))
+        for text in texts:
+            digest.update(hashlib.sha1(text.encode("utf-8")).digest())
+        return digest.hexdigest()
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        path = os.path.join(self.directory, f"{self._digest(texts)}.npy")
+        if os.path.exists(path):
+            logger.info("✓ Loaded %s cached %s vectors", len(texts), self.model_name)
+            return np.load(path).tolist()
+        vectors = np.asarray(self.inner.embed_documents(texts), dtype=np.float32)
+        np.save(path, vectors)
+        return vectors.tolist()
+
+    def embed_query(self, text):
+        vector = self._queries.get(text)
+        if vector is None:
+            vector = self._queries[text] = list(self.inner.embed_query(text))
+            with open(self._queries_path, "w", encoding="utf-8") as f:
+                json.dump(self._queries, f)
+        return vector
+
+
+def create_embeddings(kind, dimensions=256, cache_dir=".embedding_cache"):
+    """(embeddings, model name) for --embeddings fake|google"""
+    if kind == "fake":
+        return FakeEmbeddings(dimensions), f"fake-hashed-bow-{dimensions}"
+    from rag_model import create_google_backends
+
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        sys.exit("GOOGLE_API_KEY is required for --embeddings google")
+    embeddings, _ = create_google_backends(api_key)
+    model_name = embeddings.model
+    return CachedEmbeddings(embeddings, model_name, cache_dir), model_name
+
+
+def parse_chunking(spec):
+    """"transaction" -> None, "SIZE:OVERLAP" -> (size, overlap)"""
+    if spec == "transaction":
+        return None
+    size, _, overlap = spec.partition(":")
+    return int(size), int(overlap or 0)
+
+
+def load_transactions(transactions_collection):
+    """Every transaction, in the order the index export reads them"""
+    from utils import iter_transactions
+
+    return list(iter_transactions(transactions_collection))
+
+
+def generate_questions(transactions, count, seed=42):
+    """Labelled questions about a random sample of transactions"""
+    rng = random.Random(seed)
+    questions = []
+    for i, txn in enumerate(rng.sample(transactions, min(count, len(transactions)))):
+        kind = i % 3
+        if kind == 0:
+            questions.append({"question": f"Show invoice {txn['invoice_number']}",
+                              "expected": [txn["invoice_number"]]})
+        elif kind == 1:
+            questions.append({"question": f"What did customer {txn['customer_id']} buy?",
+                              "expected": [txn["customer_id"]]})
+        else:
+            questions.append({
+                "question": f"{txn['customer_name']} bought {txn['product_name']} on "
+                            f"{txn['date_of_purchase']} at {txn['store_location']}",
+                "expected": [txn["invoice_number"]],
+            })
+    return questions
+
+
+def load_questions(path):
+    with open(path, encoding="utf-8") as f:
+        questions = json.load(f)
+    for item in questions:
+        if not item.get("question") or not item.get("expected"):
+            raise ValueError(f"Labelled question needs 'question' and 'expected': {item}")
+    return questions
+
+
+def corpus(transactions, limit, chunking):
+    """(texts, metadatas) indexed for one limit/chunking setting"""
+    from utils import chunk_texts, transaction_metadata, transaction_to_text
+
+    selected = transactions[:limit] if limit else transactions
+    if chunking is None:
+        return [transaction_to_text(t) for t in selected], [transaction_metadata(t) for t in selected]
+    batches = (
+        [transaction_to_text(t) for t in selected[start:start + 500]]
+        for start in range(0, len(selected), 500)
+    )
+    return list(chunk_texts(batches, *chunking)), None
+
+
+def build_retriever(vectorstore, metadatas, k, fetch_k, profile_index=None):
+    """Retriever matching how the app queries this kind of index"""
+    from metadata_index import MetadataIndex
+    from retrievers import FilteredRetriever
+
+    if metadatas is None:
+        return vectorstore.as_retriever(search_kwargs={"k": k})
+    return FilteredRetriever(vectorstore=vectorstore, metadata_index=MetadataIndex(metadatas),
+                             profile_index=profile_index, k=k, fetch_k=fetch_k)
+
+
+def evaluate(retriever, questions):
+    """Hit rate, MRR, latency and prompt tokens of one retriever over the question set"""
+    from rag_model import QA_PROMPT_TEMPLATE
+    from utils import token_counter
+
+    histogram = LatencyHistogram(max_samples=len(questions))
+    hits, reciprocal_ranks, tokens = 0, 0.0, 0
+    for item in questions:
+        t0 = time.perf_counter()
+        docs = retriever.invoke(item["question"])
+        histogram.observe(time.perf_counter() - t0)
+
+        rank = next(
+            (i for i, doc in enumerate(docs, 1) if any(e in doc.page_content for e in item["expected"])),
+            None
+        )
+        if rank:
+            hits += 1
+            reciprocal_ranks += 1 / rank
+        context = "\n\n".join(doc.page_content for doc in docs)
+        tokens += token_counter.count_tokens(QA_PROMPT_TEMPLATE.format(context=context, question=item["question"]))
+
+    quantiles = histogram.quantiles((0.5, 0.95))
+    return {
+        "hit_rate": round(hits / len(questions), 4),
+        "mrr": round(reciprocal_ranks / len(questions), 4),
+        "p50_ms": round(quantiles[0.5] * 1000, 3),
+        "p95_ms": round(quantiles[0.95] * 1000, 3),
+        "prompt_tokens": round(tokens / len(questions), 1),
+    }
+
+
+def run_sweep(transactions, questions, limits, chunkings, index_types, ks, fetch_ks, embeddings,
+              profile_index=None):
+    """Evaluate every grid point; one index build per limit/chunking/index type"""
+    from vector_index import IndexConfig, build_vectorstore, index_memory_bytes
+
+    results = []
+    for limit in limits:
+        for spec in chunkings:
+            chunking = parse_chunking(spec)
+            texts, metadatas = corpus(transactions, limit, chunking)
+            t0 = time.perf_counter()
+            vectors = embeddings.embed_documents(texts)
+            embed_seconds = time.perf_counter() - t0
+
+            built = set()
+            for index_type in index_types:
+                t0 = time.perf_counter()
+                vectorstore = build_vectorstore(texts, embeddings, IndexConfig(index_type),
+                                                metadatas=metadatas, vectors=vectors)
+                build_seconds = embed_seconds + time.perf_counter() - t0
+                if type(vectorstore.index).__name__ in built:
+                    # Small corpora fall back to a flat index - don't repeat it
+                    continue
+                built.add(type(vectorstore.index).__name__)
+                memory_mb = round(index_memory_bytes(vectorstore.index) / 1024 / 1024, 3)
+
+                # fetch_k only applies to the per-transaction (re-ranked) retriever
+                for k in ks:
+                    for fetch_k in (fetch_ks if chunking is None else [0]):
+                        row = {
+                            "limit": limit or len(transactions),
+                            "chunking": spec,
+                            "index": type(vectorstore.index).__name__,
+                            "index_type": index_type,
+                            "k": k,
+                            "fetch_k": fetch_k,
+                            "documents": len(texts),
+                            "build_seconds": round(build_seconds, 3),
+                            "memory_mb": memory_mb,
+                        }
+                        retriever = build_retriever(vectorstore, metadatas, k, fetch_k, profile_index)
+                        row.update(evaluate(retriever, questions))
+                        results.append(row)
+                        logger.info("✓ %s limit=%s %s k=%s fetch_k=%s: hit rate %s, p95 %s ms",
+                                    spec, row['limit'], index_type, k, fetch_k, row['hit_rate'], row['p95_ms'])
+    return results
+
+
+def pareto_front(results, objectives=PARETO_OBJECTIVES):
+    """Indices of the rows no other row dominates on `objectives`"""
+    def better_or_equal(a, b, key):
+        return a[key] >= b[key] if objectives[key] == "max" else a[key] <= b[key]
+
+    front = []
+    for i, row in enumerate(results):
+        dominated = any(
+            all(better_or_equal(other, row, key) for key in objectives)
+            and any(other[key] != row[key] for key in objectives)
+            for j, other in enumerate(results) if j != i
+        )
+        if not dominated:
+            front.append(i)
+    return front
+
+
+def print_table(results, embedding_model):
+    front = set(pareto_front(results))
+    print(f"Embeddings: {embedding_model}")
+    print(f"  {'limit':>7} {'chunking':<12} {'index':<16} {'k':>3} {'fetch':>5} {'hit':>6} {'mrr':>6} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'tokens':>7} {'MB':>8} {'build s':>8}")
+    order = sorted(range(len(results)), key=lambda i: (-results[i]["hit_rate"], results[i]["p95_ms"]))
+    for i in order:
+        r = results[i]
+        print(f"{'*' if i in front else ' '} {r['limit']:>7} {r['chunking']:<12} {r['index']:<16} {r['k']:>3} "
+              f"{r['fetch_k']:>5} {r['hit_rate']:>6} {r['mrr']:>6} {r['p50_ms']:>8} {r['p95_ms']:>8} "
+              f"{r['prompt_tokens']:>7} {r['memory_mb']:>8} {r['build_seconds']:>8}")
+    print(f"* Pareto-optimal on {', '.join(f'{k} ({v})' for k, v in PARETO_OBJECTIVES.items())}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep retrieval settings for quality vs. cost")
+    parser.add_argument("--rows", type=int, default=5000, help="Synthetic transactions to load")
+    parser.add_argument("--app-data", action="store_true",
+                        help="Use the app database (MONGODB_URI/DB_NAME) instead of synthetic data")
+    parser.add_argument("--questions", default=None, help="Labelled question JSON file")
+    parser.add_argument("--queries", type=int, default=100, help="Generated questions (without --questions)")
+    parser.add_argument("--limits", type=int, nargs="+", default=[200, 1000, 0],
+                        help="Indexed transaction limits (0 for all)")
+    parser.add_argument("--chunking", nargs="+", default=["transaction", "1000:200", "500:50"])
+    parser.add_argument("--indexes", nargs="+", default=["flat", "ivf_flat", "hnsw"])
+    parser.add_argument("--k", type=int, nargs="+", default=[2, 4, 8])
+    parser.add_argument("--fetch-k", type=int, nargs="+", default=[0, 20],
+                        help="Re-ranking candidates (0 disables re-ranking)")
+    parser.add_argument("--embeddings", choices=["fake", "google"], default="fake",
+                        help="Embedding model: hashed bag of words (offline) or the app's Google model")
+    parser.add_argument("--embedding-cache", default=".embedding_cache",
+                        help="Directory caching --embeddings google vectors per corpus")
+    parser.add_argument("--dimensions", type=int, default=256, help="Fake embedding size")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=None, help="Write the JSON report here")
+    args = parser.parse_args()
+
+    from profiles import get_profile_index
+
+    embeddings, embedding_model = create_embeddings(args.embeddings, args.dimensions, args.embedding_cache)
+    logger.info("Embedding with %s", embedding_model)
+    if args.app_data:
+        from db import connect_collections
+        collections = connect_collections()
+        transactions = load_transactions(collections["transactions"])
+        profile_index = get_profile_index(collections["profiles"], collections["transactions"], embeddings)
+    else:
+        from pymongo import MongoClient
+        from benchmarks.run_benchmarks import bench_collections
+        from benchmarks.synthetic_data import write_json
+        from upload import upload_json_to_mongodb
+
+        uri = os.getenv("MONGODB_URI")
+        if not uri:
+            sys.exit("MONGODB_URI must point at a MongoDB instance for benchmarking")
+        db_name = os.getenv("BENCH_DB_NAME", "rag_chatbot_bench")
+        client = MongoClient(uri, serverSelectionTimeoutMS=5000)
+        collections = bench_collections(client, db_name)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "sales.json")
+            write_json(path, args.rows, args.seed)
+            upload_json_to_mongodb(path, collections, clear_existing=True, max_documents=None)
+        transactions = load_transactions(collections["transactions"])
+        profile_index = get_profile_index(collections["profiles"], collections["transactions"], embeddings)
+        client.drop_database(db_name)
+
+    questions = load_questions(args.questions) if args.questions else \
+        generate_questions(transactions, args.queries, args.seed)
+    logger.info("Sweeping over %s transactions and %s questions", len(transactions), len(questions))
+
+    results = run_sweep(transactions, questions, args.limits, args.chunking, args.indexes,
+                        args.k, args.fetch_k, embeddings, profile_index)
+    print_table(results, embedding_model)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "embedding_model": embedding_model,
+                "transactions": len(transactions),
+                "questions": len(questions),
+                "objectives": PARETO_OBJECTIVES,
+                "pareto_front": pareto_front(results),
+                "results": results,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,215 @@
+"""End-to-end performance benchmarks against a scratch MongoDB database
+
+Measures ingest, the per-transaction export and embedding, FAISS index
+build, intent classification, retrieval and customer history lookup using
+synthetic data and the deterministic fakes in benchmarks.fakes, so no API
+key is needed. The index and retriever are built as rag_model.build_models
+builds them (vector_index.build_vectorstore with the VECTOR_INDEX_* settings,
+retrievers.FilteredRetriever with RETRIEVAL_K / RETRIEVAL_FETCH_K, profiles).
+
+    export MONGODB_URI=mongodb://localhost:27017
+    python -m benchmarks.run_benchmarks --rows 1000 100000 1000000
+    python -m benchmarks.run_benchmarks --compare results/old.json results/new.json
+
+The scratch database (BENCH_DB_NAME, default rag_chatbot_bench) is dropped
+at the start of every run.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from pymongo import MongoClient
+
+from db import create_collections
+from benchmarks.fakes import FakeEmbeddings
+from benchmarks.synthetic_data import write_json, CATEGORIES, CITIES
+from tracing import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+SAMPLE_QUESTIONS = [
+    "What are the top selling products?",
+    "Show electronics sales in Chennai",
+    "How much revenue did we make last month?",
+    "What did customer CUST000042 buy?",
+    "Show my purchase history",
+    "I need help with a broken product",
+    "Which customers bought the most?",
+    "List all products in category Clothing",
+] + [f"{category} sales in {city}" for category in CATEGORIES for city in CITIES[:2]]
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def _throughput(items, seconds):
+    return {
+        "items": items,
+        "seconds": round(seconds, 4),
+        "throughput_per_s": round(items / seconds, 2) if seconds else None,
+    }
+
+
+def _latency(name, func, inputs):
+    """Call func on every input and return throughput plus p50/p95/p99 latency"""
+    histogram = LatencyHistogram(max_samples=len(inputs))
+    started = time.perf_counter()
+    for item in inputs:
+        t0 = time.perf_counter()
+        func(item)
+        histogram.observe(time.perf_counter() - t0)
+    result = _throughput(len(inputs), time.perf_counter() - started)
+    result.update({
+        f"p{int(q * 100)}_ms": round(v * 1000, 3) for q, v in histogram.quantiles().items()
+    })
+    logger.info("✓ %s: p50=%sms p95=%sms", name, result['p50_ms'], result['p95_ms'])
+    return result
+
+
+def bench_collections(client, db_name):
+    """Fresh scratch collections with the same indexes as db.init_collections"""
+    client.drop_database(db_name)
+    return create_collections(client[db_name])
+
+
+def run_scale(rows, collections, queries=200, seed=42, dimensions=256):
+    """Run every stage at one data scale and return the stage results"""
+    from upload import upload_json_to_mongodb
+    from utils import iter_document_batches
+    from vector_index import build_vectorstore, embed_document_batches
+    from metadata_index import MetadataIndex
+    from retrievers import FilteredRetriever
+    from profiles import get_profile_index
+    from intent_classifier import EmbeddingIntentClassifier
+    from chat_service import lookup_customer_history
+
+    stages = {}
+    rng = random.Random(seed)
+    questions = [rng.choice(SAMPLE_QUESTIONS) for _ in range(queries)]
+    embeddings = FakeEmbeddings(dimensions=dimensions)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sales.json")
+        t0 = time.perf_counter()
+        write_json(path, rows, seed)
+        stages["generate"] = _throughput(rows, time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        inserted = upload_json_to_mongodb(path, collections, clear_existing=True, max_documents=None)
+        stages["ingest"] = _throughput(inserted, time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    texts, metadatas, vectors = embed_document_batches(
+        iter_document_batches(collections["transactions"], limit=0), embeddings
+    )
+    stages["export_and_embed"] = _throughput(len(texts), time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    vectorstore = build_vectorstore(texts, embeddings, metadatas=metadatas, vectors=vectors)
+    metadata_index = MetadataIndex(metadatas)
+    stages["index_build"] = _throughput(len(texts), time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    profile_index = get_profile_index(collections["profiles"], collections["transactions"], embeddings)
+    stages["profiles"] = _throughput(len(profile_index or ()), time.perf_counter() - t0)
+
+    retriever = FilteredRetriever(
+        vectorstore=vectorstore,
+        metadata_index=metadata_index,
+        profile_index=profile_index,
+        k=int(os.getenv("RETRIEVAL_K", "4")),
+        fetch_k=int(os.getenv("RETRIEVAL_FETCH_K", "20"))
+    )
+
+    classifier = EmbeddingIntentClassifier(embeddings)
+    stages["classify"] = _latency("classify", classifier.classify, questions)
+    stages["retrieval"] = _latency("retrieval", retriever.invoke, questions)
+
+    customer_ids = collections["customers"].distinct("customer_id")
+    lookups = [rng.choice(customer_ids) for _ in range(queries)]
+    stages["customer_history"] = _latency(
+        "customer_history", lambda cid: lookup_customer_history(cid, collections), lookups
+    )
+    return stages
+
+
+def compare(old_path, new_path):
+    """Print per-stage throughput and p95 changes between two result files"""
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+
+    print(f"{'scale':>9} {'stage':<18} {'throughput old→new':>28} {'p95 ms old→new':>24}")
+    for scale, new_stages in new["scales"].items():
+        old_stages = old["scales"].get(scale, {})
+        for stage, result in new_stages.items():
+            before = old_stages.get(stage, {})
+            tp = f"{before.get('throughput_per_s')}→{result.get('throughput_per_s')}"
+            p95 = f"{before.get('p95_ms', '-')}→{result.get('p95_ms', '-')}"
+            print(f"{scale:>9} {stage:<18} {tp:>28} {p95:>24}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run end-to-end performance benchmarks")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000],
+                        help="Data scales to run (e.g. 1000 100000 1000000)")
+    parser.add_argument("--queries", type=int, default=200, help="Queries per latency stage")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--dimensions", type=int, default=256, help="Fake embedding size")
+    parser.add_argument("--output", default=None, help="Result file (default: results/<commit>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Compare two result files")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    uri = os.getenv("MONGODB_URI")
+    if not uri:
+        sys.exit("MONGODB_URI must point at a MongoDB instance for benchmarking")
+    db_name = os.getenv("BENCH_DB_NAME", "rag_chatbot_bench")
+    client = MongoClient(uri, serverSelectionTimeoutMS=5000)
+
+    commit = _git_commit()
+    report = {
+        "commit": commit,
+        "generated_at": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "queries": args.queries,
+        "scales": {},
+    }
+    for rows in args.rows:
+        logger.info("Running benchmarks at %s rows...", rows)
+        collections = bench_collections(client, db_name)
+        report["scales"][str(rows)] = run_scale(rows, collections, args.queries, args.seed, args.dimensions)
+    client.drop_database(db_name)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report["scales"], indent=2))
+    print(f"✓ Results written to {output}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    main()
@@ -0,0 +1,128 @@
+"""Synthetic sales-export generator matching the fields upload_json_to_mongodb reads
+
+    python -m benchmarks.synthetic_data --rows 100000 --output sales_100k.json
+"""
+import argparse
+import json
+import random
+from datetime import datetime, timedelta
+
+CATEGORIES = {
+    "Electronics": ["Smartphone", "Laptop", "Headphones", "Smartwatch", "Tablet", "Camera"],
+    "Clothing": ["T-Shirt", "Jeans", "Jacket", "Saree", "Kurta", "Sneakers"],
+    "Home & Kitchen": ["Mixer Grinder", "Pressure Cooker", "Bedsheet", "Water Purifier"],
+    "Beauty": ["Face Wash", "Perfume", "Lipstick", "Shampoo"],
+    "Groceries": ["Basmati Rice", "Olive Oil", "Green Tea", "Almonds"],
+    "Sports": ["Cricket Bat", "Yoga Mat", "Football", "Dumbbells"],
+}
+CITIES = ["Chennai", "Bengaluru", "Mumbai", "Delhi", "Hyderabad", "Kolkata", "Pune", "Coimbatore"]
+FIRST_NAMES = ["Arun", "Priya", "Karthik", "Divya", "Rahul", "Sneha", "Vikram", "Anitha",
+               "John", "Meera", "Suresh", "Lakshmi", "Ravi", "Deepa", "Ajay", "Kavya"]
+LAST_NAMES = ["Kumar", "Sharma", "Iyer", "Reddy", "Nair", "Patel", "Singh", "Das", "Doe", "Rao"]
+PAYMENT_MODES = ["UPI", "Credit Card", "Debit Card", "Cash", "Net Banking", "Wallet"]
+CHANNELS = ["Online", "Offline"]
+LOYALTY_TIERS = ["Regular", "Silver", "Gold", "Platinum"]
+
+
+def _catalog(rng, products_per_item=5):
+    """Build a fixed product catalogue: (product_id, name, category, sku, price, cogs, margin)"""
+    catalog = []
+    for category, items in CATEGORIES.items():
+        for item in items:
+            for variant in range(products_per_item):
+                price = round(rng.uniform(5, 1500), 2)
+                cogs = round(price * rng.uniform(0.4, 0.8), 2)
+                catalog.append((
+                    f"P{len(catalog) + 1:05d}",
+                    f"{item} Model {chr(65 + variant)}",
+                    category,
+                    f"SKU-{category[:3].upper()}-{len(catalog) + 1:05d}",
+                    price,
+                    cogs,
+                    round((price - cogs) / price * 100, 2),
+                ))
+    return catalog
+
+
+def generate_records(rows: int, seed: int = 42, customers: int = None,
+                     start_date: datetime = datetime(2024, 1, 1), days: int = 365):
+    """Yield `rows` sales-export records with deterministic content for a given seed
+
+    Args:
+        rows: Number of records to generate
+        seed: Random seed; the same seed always yields the same records
+        customers: Size of the customer pool (default: rows // 10, at least 10)
+        start_date: First purchase date
+        days: Purchase dates are spread over this many days
+    """
+    rng = random.Random(seed)
+    catalog = _catalog(rng)
+    customers = customers or max(10, rows // 10)
+
+    for i in range(rows):
+        c = rng.randrange(customers)
+        first = FIRST_NAMES[c % len(FIRST_NAMES)]
+        last = LAST_NAMES[(c // len(FIRST_NAMES)) % len(LAST_NAMES)]
+        product_id, product, category, sku, price, cogs, margin = rng.choice(catalog)
+        quantity = rng.randint(1, 5)
+        gross = round(price * quantity, 2)
+        discount = rng.choice([0, 0, 5, 10, 15, 20])
+        net = round(gross * (1 - discount / 100), 2)
+        gst = round(net * 0.18, 2)
+        channel = rng.choice(CHANNELS)
+        purchased = start_date + timedelta(days=rng.randrange(days), seconds=rng.randrange(86400))
+
+        yield {
+            "Invoice Number": f"INV-{i + 1:08d}",
+            "Txn_No": f"TXN-{seed}-{i + 1:08d}",
+            "Customer ID": f"CUST{c + 1:06d}",
+            "Customer name": f"{first} {last} {c + 1}",
+            "Email": f"{first.lower()}.{last.lower()}{c + 1}@example.com",
+            "Phone": f"9{(c * 7919) % 1000000000:09d}",
+            "City": CITIES[c % len(CITIES)],
+            "Loyalty_Tier": LOYALTY_TIERS[c % len(LOYALTY_TIERS)],
+            "ID_product": product_id,
+            "Product": product,
+            "Category": category,
+            "SKUs": sku,
+            "COGS": cogs,
+            "Margin_per_piece_percent": margin,
+            "Quantity_piece": quantity,
+            "Gross_Amount": gross,
+            "Discount_Percentage": discount,
+            "Total Amount": round(net + gst, 2),
+            "GST": gst,
+            "Payment_mode": rng.choice(PAYMENT_MODES),
+            "Date_of_purchase": purchased.strftime("%Y-%m-%d"),
+            "Channel": channel,
+            "Store_location": "Online" if channel == "Online" else rng.choice(CITIES),
+            "Mode": "Delivery" if channel == "Online" else "In-store",
+        }
+
+
+def write_json(path: str, rows: int, seed: int = 42) -> int:
+    """Stream `rows` generated records to `path` as a JSON array; returns rows written"""
+    written = 0
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("[\n")
+        for record in generate_records(rows, seed):
+            if written:
+                f.write(",\n")
+            f.write(json.dumps(record))
+            written += 1
+        f.write("\n]\n")
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic sales export")
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="synthetic_sales.json")
+    args = parser.parse_args()
+    written = write_json(args.output, args.rows, args.seed)
+    print(f"✓ Wrote {written} records to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
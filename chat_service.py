@@ -0,0 +1,382 @@
+"""UI-independent intent routing and query handlers
+
+Shared by the Streamlit handlers (which add rendering on top) and the headless
+API service in api_server.py. Nothing here touches `st.*`.
+"""
+import logging
+import re
+from datetime import datetime
+
+from columnar_store import answer_aggregate, get_columnar_store
+from gateway import SingleFlight, llm_gateway, request_key, run_with_deadline
+from metadata_index import extract_filters, parse_date
+from speculation import speculate, use_speculation
+from tracing import span, traced, trace_context, langchain_callback
+from utils import TRANSACTION_PROJECTION
+
+logger = logging.getLogger(__name__)
+
+HISTORY_TURNS = 5
+
+# Default stage deadlines (seconds); override with SEARCH_DB_TIMEOUT / RETRIEVAL_TIMEOUT
+SEARCH_DB_TIMEOUT = 30.0
+RETRIEVAL_TIMEOUT = 5.0
+
+# Identical questions with identical history asked at the same time share one chain run
+_search_flight = SingleFlight("search_db")
+
+_CUSTOMER_ID_RE = re.compile(r"\b(CUST[-_]?\d+)\b", re.IGNORECASE)
+_EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+_PHONE_RE = re.compile(r"\b\d{10}\b")
+_INVOICE_RE = re.compile(r"\bINV[-_]?\d+\b", re.IGNORECASE)
+_ISO_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}")
+
+# Non-ISO dates can't be range-queried in Mongo; at most this many matches are date-filtered locally
+DEGRADED_SCAN_LIMIT = 5000
+_DATE_SAMPLE = 20
+
+DEGRADED_NOTICE = (
+    "⚠️ The AI assistant is slow or unavailable right now, so this is not a generated answer. "
+    "Here are the closest matching records:"
+)
+_SUMMARY_FIELDS = ("Invoice Number", "Customer", "Product", "Total Amount", "Purchase Date")
+
+
+def format_chat_history(chat_history, turns: int = HISTORY_TURNS):
+    """Convert stored chat entries into (question, answer) tuples for the chain"""
+    formatted_history = []
+    for item in (chat_history or [])[-turns:]:
+        if isinstance(item, dict):
+            formatted_history.append((item.get("user", ""), item.get("bot", "")))
+    return formatted_history
+
+
+@traced("search_db")
+def run_search_db(question, qa_chain, chat_history, collections=None, speculation=None):
+    """Answer a question with the RAG chain, degrading if the models fail
+
+    The chain run is bounded by SEARCH_DB_TIMEOUT (default 30s). If it times
+    out, the model circuit breaker is open or the provider errors, the top
+    retrieved documents (or, without embeddings, exact Mongo matches) are
+    returned with a notice instead. Retrieval reuses the documents of
+    `speculation` (see start_speculation) when it prefetched this question;
+    if it already condensed the question against the history, the chain gets
+    the condensed question and no history instead of condensing it again.
+
+    Returns:
+        {"answer": str, "sources": [page_content, ...], "degraded": bool}
+    """
+    history = format_chat_history(chat_history)
+
+    def invoke():
+        query, turns = question, history
+        condensed = speculation.condensed_question() if speculation is not None else None
+        if condensed:
+            # What the chain's condense step would produce from this history
+            query, turns = condensed, []
+        # Callback times the condense, retrieval and LLM steps
+        with use_speculation(speculation):
+            return qa_chain.invoke(
+                {"question": query, "chat_history": turns},
+                config={"callbacks": [langchain_callback()]}
+            )
+
+    try:
+        result = run_with_deadline(
+            "search_db",
+            _search_flight.do,
+            SEARCH_DB_TIMEOUT,
+            request_key(id(qa_chain), " ".join(question.lower().split()), history),
+            invoke
+        )
+    except Exception as e:
+        logger.warning("RAG chain unavailable, serving degraded answer: %s", e, exc_info=True)
+        return degraded_search(question, qa_chain, collections, speculation=speculation)
+    finally:
+        if speculation is not None:
+            # No-op if the retriever already used it; a coalesced follower never does
+            speculation.miss("not used by the chain")
+
+    return {
+        "answer": result.get("answer", "No data found").strip(),
+        "sources": [doc.page_content for doc in result.get("source_documents", [])],
+        "degraded": False
+    }
+
+
+def _summarize_document(page_content):
+    """One line per transaction document: invoice | customer | product | amount | date"""
+    fields = {}
+    for line in page_content.splitlines():
+        name, _, value = line.partition(":")
+        if name.strip() in _SUMMARY_FIELDS:
+            fields[name.strip()] = value.strip()
+    return " | ".join(fields[name] for name in _SUMMARY_FIELDS if name in fields) or page_content[:200]
+
+
+def _exact_id(value):
+    """Case-insensitive, anchored match for an id typed by the user"""
+    return {"$regex": f"^{re.escape(value)}$", "$options": "i"}
+
+
+def stores_iso_dates(transactions_collection):
+    """True if the newest transactions store ISO dates, so string ranges order correctly
+
+    Uploads may carry "08/05/2024"-style dates. Checked per call (only the
+    degraded path asks) so a re-upload in another format is picked up.
+    """
+    sample = transactions_collection.find(
+        {"date_of_purchase": {"$exists": True}}, {"date_of_purchase": 1, "_id": 0}
+    ).sort("_id", -1).limit(_DATE_SAMPLE)
+    return all(_ISO_DATE_RE.match(str(t.get("date_of_purchase", ""))) for t in sample)
+
+
+def exact_mongo_results(question, collections, limit: int = 5):
+    """Transactions matching identifiers and filters named in the question, newest first
+
+    Uses invoice numbers, customer ids and the product/category/store/
+    channel/date filters the columnar store knows about; returns [] if the
+    question names nothing to match exactly. Date ranges are queried in
+    Mongo when dates are stored as ISO strings, otherwise applied locally
+    with parse_date to at most DEGRADED_SCAN_LIMIT matches.
+    """
+    from utils import transaction_to_text
+
+    transactions = collections["transactions"]
+    query = {}
+    invoice = _INVOICE_RE.search(question)
+    if invoice:
+        query["invoice_number"] = _exact_id(invoice.group(0))
+    customer = _CUSTOMER_ID_RE.search(question)
+    if customer:
+        query["customer_id"] = _exact_id(customer.group(0))
+
+    store = get_columnar_store(collections, load=False)
+    filters = extract_filters(question, store.vocabulary() if store else {})
+    for field in ("product_name", "category", "store_location", "channel"):
+        if field in filters:
+            query[field] = {"$in": filters[field]}
+    date_range = filters.get("date_range")
+    if not query and not date_range:
+        return []
+
+    if date_range and stores_iso_dates(transactions):
+        start, end = date_range
+        query["date_of_purchase"] = {"$gte": start.isoformat(), "$lte": end.isoformat() + "T23:59:59"}
+        date_range = None
+
+    with span("mongo.degraded_search"):
+        if date_range is None:
+            txns = list(transactions.find(query, TRANSACTION_PROJECTION).sort("date_of_purchase", -1).limit(limit))
+        else:
+            start, end = date_range
+            dated = []
+            for txn in transactions.find(query, TRANSACTION_PROJECTION).limit(DEGRADED_SCAN_LIMIT):
+                day = parse_date(txn.get("date_of_purchase"))
+                if day and start <= day <= end:
+                    dated.append((day, txn))
+            dated.sort(key=lambda pair: pair[0], reverse=True)
+            txns = [txn for _, txn in dated[:limit]]
+    return [transaction_to_text(txn) for txn in txns]
+
+
+@traced("degraded_search")
+def degraded_search(question, qa_chain, collections=None, limit: int = 5, speculation=None):
+    """Answer without the LLM: raw top retrieved documents, else exact Mongo matches"""
+    sources = []
+    # Any prefetched documents will do, even if retrieved for the condensed question
+    docs = speculation.documents(timeout=RETRIEVAL_TIMEOUT) if speculation is not None else None
+    retriever = getattr(qa_chain, "retriever", None)
+    if docs is None and retriever is not None:
+        try:
+            docs = run_with_deadline("retrieval", retriever.invoke, RETRIEVAL_TIMEOUT, question)
+        except Exception as e:
+            logger.warning("Retrieval unavailable for degraded answer: %s", e)
+    if docs:
+        sources = [doc.page_content for doc in docs[:limit]]
+    if not sources and collections is not None:
+        try:
+            exact = speculation.exact_results(timeout=RETRIEVAL_TIMEOUT) if speculation is not None else None
+            sources = exact[:limit] if exact is not None else exact_mongo_results(question, collections, limit)
+        except Exception as e:
+            logger.warning("Exact Mongo lookup failed for degraded answer: %s", e)
+
+    if not sources:
+        answer = (
+            "⚠️ The AI assistant is temporarily unavailable and no records matched exactly. "
+            "Please include an invoice number, customer ID, category or date, or try again shortly."
+        )
+    else:
+        answer = "\n".join([DEGRADED_NOTICE, *(f"- {_summarize_document(s)}" for s in sources)])
+    return {"answer": answer, "sources": sources, "degraded": True}
+
+
+@traced("aggregate")
+def run_aggregate(question, collections):
+    """Answer top-k / total questions from the columnar store without the LLM
+
+    Returns:
+        {"answer": str, "sources": []}, or None if the question isn't an
+        aggregate the store can answer (or the store is disabled)
+    """
+    if collections is None:
+        return None
+    result = answer_aggregate(question, get_columnar_store(collections, load=False))
+    if result is not None:
+        result["degraded"] = False
+    return result
+
+
+def extract_customer_reference(question):
+    """Pull a customer ID, email or phone number out of free text, if present"""
+    for pattern in (_CUSTOMER_ID_RE, _EMAIL_RE, _PHONE_RE):
+        match = pattern.search(question or "")
+        if match:
+            return match.group(0)
+    return None
+
+
+def lookup_customer_history(search_term, collections, exact: bool = False):
+    """Find the first customer matching ID/name/email/phone and their transactions
+
+    With `exact`, only a customer whose customer_id equals `search_term` is
+    returned; otherwise the term is matched literally (case-insensitive
+    substring) against name, ID, email and phone.
+
+    Returns:
+        (customer, transactions) - customer is None if nothing matched;
+        transactions are sorted newest first
+    """
+    if exact:
+        query = {"customer_id": search_term}
+    else:
+        # Enhanced search with multiple fields; user text is never a pattern
+        pattern = {"$regex": re.escape(search_term), "$options": "i"}
+        query = {"$or": [{field: pattern} for field in ("name", "customer_id", "email", "phone")]}
+    with span("mongo.find_customer"):
+        customer = collections['customers'].find_one(query)
+    
+    if not customer:
+        return None, []
+    
+    # Get transactions
+    with span("mongo.customer_transactions"):
+        txns = list(collections['transactions'].find(
+            {"customer_id": customer["customer_id"]}
+        ).sort("date_of_purchase", -1))
+    
+    return customer, txns
+
+
+def summarize_customer_history(customer, txns):
+    """Customer profile, totals and transaction rows in JSON-friendly form"""
+    return {
+        "customer_id": customer.get("customer_id"),
+        "name": customer.get("name"),
+        "email": customer.get("email", "N/A"),
+        "loyalty_tier": customer.get("loyalty_tier", "Regular"),
+        "total_transactions": len(txns),
+        "total_spent": round(sum(t.get("total_amount", 0) for t in txns), 2),
+        "transactions": [
+            {
+                "date": txn.get("date_of_purchase", "N/A"),
+                "invoice": txn.get("invoice_number", "N/A"),
+                "product": txn.get("product_name", "N/A"),
+                "category": txn.get("category", "N/A"),
+                "quantity": txn.get("quantity", 0),
+                "amount": txn.get("total_amount", 0),
+                "status": txn.get("status", "N/A")
+            }
+            for txn in txns
+        ]
+    }
+
+
+@traced("customer_history")
+def run_customer_history(search_term, collections, exact: bool = False):
+    """Look up a customer's purchase history (see lookup_customer_history for `exact`)
+
+    Returns:
+        {"answer": str, "customer": summary dict or None}
+    """
+    customer, txns = lookup_customer_history(search_term, collections, exact=exact)
+    if not customer:
+        return {"answer": f"❌ No customer found matching '{search_term}'", "customer": None}
+
+    summary = summarize_customer_history(customer, txns)
+    if not txns:
+        answer = f"Customer {customer['name']} has no purchase history"
+    else:
+        answer = (
+            f"✅ Found {len(txns)} transactions for {customer['name']}"
+            f" (total spent ${summary['total_spent']:,.2f})"
+        )
+    return {"answer": answer, "customer": summary}
+
+
+def start_speculation(question, qa_chain, chat_history=None, collections=None):
+    """Start retrieval for `question` before it is classified
+
+    Pass the result to run_search_db / handle_intent; discard it if the
+    intent turns out not to be SEARCH_DB. None when speculation is disabled.
+    Only degraded answers use the exact Mongo lookup, so it is prefetched
+    (given `collections`) only while the model circuit breaker isn't closed.
+    """
+    exact_lookup = None
+    if collections is not None and llm_gateway.breaker.state != "closed":
+        def exact_lookup(q):
+            return exact_mongo_results(q, collections)
+    return speculate(question, qa_chain, format_chat_history(chat_history or []), exact_lookup)
+
+
+def answer_question(question, model_set, collections, chat_history=None):
+    """Classify a question and run the matching handler
+
+    Returns a dict with question, intent, confidence, answer, sources,
+    customer and timestamp. SUPPORT requests only return guidance; tickets
+    are created through the support form.
+    """
+    with trace_context(intent=None):
+        speculation = start_speculation(question, model_set.qa_chain, chat_history, collections)
+        intent, conf = model_set.intent_classifier.classify(question)
+        logger.info("Intent classified: %s (%.4f)", intent, conf)
+        return handle_intent(question, intent, conf, model_set, collections, chat_history, speculation)
+
+
+def handle_intent(question, intent, conf, model_set, collections, chat_history=None, speculation=None):
+    """Run the handler for an already-classified question (see answer_question)"""
+    if speculation is not None and intent != "SEARCH_DB":
+        speculation.discard(intent)
+    with trace_context(intent=intent):
+        response = {
+            "question": question,
+            "intent": intent,
+            "confidence": conf,
+            "answer": None,
+            "sources": [],
+            "customer": None,
+            "degraded": False,
+            "timestamp": datetime.now().isoformat()
+        }
+
+        if intent == "SEARCH_DB":
+            aggregate = run_aggregate(question, collections)
+            if aggregate is not None and speculation is not None:
+                speculation.discard("aggregate")
+            response.update(
+                aggregate
+                or run_search_db(question, model_set.qa_chain, chat_history, collections, speculation)
+            )
+        elif intent == "CUSTOMER_HISTORY":
+            reference = extract_customer_reference(question)
+            if reference:
+                response.update(run_customer_history(reference, collections))
+            else:
+                response["answer"] = "Please provide a customer ID, email or phone number to look up"
+        elif intent == "SUPPORT":
+            response["answer"] = "Please describe your issue in a support ticket and our team will respond soon"
+        else:
+            logger.warning("Unknown intent received: %s", intent)
+            response["answer"] = "Sorry, I couldn't understand your request. Please try again."
+
+        return response
@@ -0,0 +1,60 @@
+"""Persistent chat history, one document per turn
+
+Turns live in the `chat_history` collection keyed by session id, with a TTL
+index on `created_at` so abandoned conversations expire on their own. The
+UI keeps only the most recent page in session state and fetches older pages
+on demand, so neither memory nor per-rerun render cost grows with the length
+of a conversation.
+"""
+import logging
+from datetime import datetime, timezone
+
+from pymongo import ASCENDING, DESCENDING
+
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_DAYS = 30
+PAGE_SIZE = 10
+
+
+def create_chat_history_indexes(collection, ttl_days: int = DEFAULT_TTL_DAYS):
+    """Index turns by session and expire them `ttl_days` after they were written"""
+    collection.create_index([("session_id", ASCENDING), ("created_at", DESCENDING)])
+    collection.create_index("created_at", expireAfterSeconds=int(ttl_days * 86400))
+
+
+class ChatHistoryStore:
+    """Append and page through the turns of one chat session"""
+
+    def __init__(self, collection, session_id):
+        self.collection = collection
+        self.session_id = session_id
+
+    def append(self, entry):
+        """Persist one turn ({"user", "bot", "intent", "confidence", "timestamp"})"""
+        doc = {key: value for key, value in entry.items() if key != "_id"}
+        doc.update({"session_id": self.session_id, "created_at": datetime.now(timezone.utc)})
+        with span("mongo.append_chat_turn"):
+            self.collection.insert_one(doc)
+
+    def count(self):
+        return self.collection.count_documents({"session_id": self.session_id})
+
+    def page(self, page: int = 0, page_size: int = PAGE_SIZE):
+        """Turns of page `page` counting back from the newest (0 = most recent), oldest first"""
+        with span("mongo.load_chat_page"):
+            turns = list(
+                self.collection.find({"session_id": self.session_id}, {"_id": 0, "session_id": 0})
+                .sort([("created_at", DESCENDING), ("_id", DESCENDING)])
+                .skip(page * page_size)
+                .limit(page_size)
+            )
+        turns.reverse()
+        return turns
+
+    def clear(self):
+        deleted = self.collection.delete_many({"session_id": self.session_id}).deleted_count
+        logger.info("✓ Deleted %s stored turns for session %s", deleted, self.session_id)
+        return deleted
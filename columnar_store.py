@@ -0,0 +1,469 @@
+"""In-memory columnar copy of the transactions collection for fast analytics
+
+Numeric fields live in NumPy arrays (amounts, quantities, discounts, purchase
+dates as day ordinals) and categorical fields are dictionary-encoded into
+int32 codes, so group-by, top-k and time-window aggregations are single
+vectorized passes (`np.bincount` over codes) instead of Mongo round trips or
+LLM calls:
+
+    store = get_columnar_store(collections)
+    store.top_k("category", k=3, date_range=(date(2024, 3, 1), date(2024, 3, 31)))
+    store.time_series("month", value="quantity")
+    store.memory_report()        # bytes per row and MB per million rows
+
+The store is loaded once per process at startup and appended to by
+upload_json_to_mongodb. Disable with COLUMNAR_STORE=0.
+"""
+import calendar
+import logging
+import os
+import re
+import threading
+from datetime import date
+
+import numpy as np
+
+from metadata_index import extract_filters, parse_date
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+NUMERIC_COLUMNS = {
+    "total_amount": np.float64,
+    "gross_amount": np.float64,
+    "gst": np.float64,
+    "discount_percentage": np.float32,
+    "quantity": np.int32,
+}
+CATEGORICAL_COLUMNS = ("product_name", "category", "customer_id", "channel", "store_location")
+AGGREGATIONS = ("sum", "count", "mean")
+
+_NO_DATE = -1
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+_INITIAL_CAPACITY = 1024
+
+
+def columnar_store_enabled():
+    return os.getenv("COLUMNAR_STORE", "1").lower() not in ("0", "false", "no")
+
+
+class ColumnarTransactionStore:
+    """Append-only NumPy columns over transaction documents
+
+    Appends are serialised by a lock and grow the arrays geometrically;
+    queries only hold the lock long enough to grab the current row count
+    and column arrays, so they never see a half-written batch.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._capacity = 0
+        self.size = 0
+        self._numeric = {name: np.empty(0, dtype=dtype) for name, dtype in NUMERIC_COLUMNS.items()}
+        self._dates = np.empty(0, dtype=np.int32)
+        self._codes = {name: np.empty(0, dtype=np.int32) for name in CATEGORICAL_COLUMNS}
+        self._values = {name: [] for name in CATEGORICAL_COLUMNS}
+        self._lookup = {name: {} for name in CATEGORICAL_COLUMNS}
+        self._date_cache = {}
+
+    # Loading --------------------------------------------------------------
+
+    def _grow(self, needed):
+        capacity = max(_INITIAL_CAPACITY, self._capacity)
+        while capacity < needed:
+            capacity *= 2
+        if capacity == self._capacity:
+            return
+
+        def resized(array):
+            grown = np.empty(capacity, dtype=array.dtype)
+            grown[:self.size] = array[:self.size]
+            return grown
+
+        self._numeric = {name: resized(array) for name, array in self._numeric.items()}
+        self._dates = resized(self._dates)
+        self._codes = {name: resized(array) for name, array in self._codes.items()}
+        self._capacity = capacity
+
+    def _encode(self, column, value):
+        lookup = self._lookup[column]
+        code = lookup.get(value)
+        if code is None:
+            code = lookup[value] = len(self._values[column])
+            self._values[column].append(value)
+        return code
+
+    def _date_ordinal(self, value):
+        key = str(value)
+        ordinal = self._date_cache.get(key)
+        if ordinal is None:
+            parsed = parse_date(value)
+            ordinal = self._date_cache[key] = parsed.toordinal() if parsed else _NO_DATE
+        return ordinal
+
+    def append(self, transactions):
+        """Add transaction documents (as stored in Mongo) to the columns"""
+        transactions = list(transactions)
+        if not transactions:
+            return 0
+
+        count = len(transactions)
+        numeric = {
+            name: np.fromiter((txn.get(name) or 0 for txn in transactions), dtype=dtype, count=count)
+            for name, dtype in NUMERIC_COLUMNS.items()
+        }
+        with self._lock:
+            dates = np.fromiter(
+                (self._date_ordinal(txn.get("date_of_purchase")) for txn in transactions),
+                dtype=np.int32, count=count
+            )
+            codes = {
+                name: np.fromiter(
+                    (self._encode(name, str(txn.get(name) or "N/A")) for txn in transactions),
+                    dtype=np.int32, count=count
+                )
+                for name in CATEGORICAL_COLUMNS
+            }
+
+            start, end = self.size, self.size + count
+            self._grow(end)
+            for name, array in numeric.items():
+                self._numeric[name][start:end] = array
+            self._dates[start:end] = dates
+            for name, array in codes.items():
+                self._codes[name][start:end] = array
+            # Publish the new rows only once every column is written
+            self.size = end
+        return count
+
+    def clear(self):
+        """Drop every row (the collection was emptied)"""
+        with self._lock:
+            self._reset()
+
+    def load(self, transactions_collection, batch_size: int = 10000):
+        """Replace the contents with every document in `transactions_collection`"""
+        projection = {name: 1 for name in (*NUMERIC_COLUMNS, *CATEGORICAL_COLUMNS, "date_of_purchase")}
+        projection["_id"] = 0
+        self.clear()
+        with span("mongo.load_columnar"):
+            cursor = transactions_collection.find({}, projection, batch_size=batch_size)
+            batch = []
+            for txn in cursor:
+                batch.append(txn)
+                if len(batch) >= batch_size:
+                    self.append(batch)
+                    batch = []
+            self.append(batch)
+        logger.info("✓ Columnar store loaded %s transactions (%.1f MB)", self.size, self.memory_bytes() / 1e6)
+        return self
+
+    # Queries --------------------------------------------------------------
+
+    def vocabulary(self):
+        """Known values per categorical column (for metadata_index.extract_filters)"""
+        return {name: list(values) for name, values in self._values.items()}
+
+    def _snapshot(self):
+        with self._lock:
+            return self.size, self._numeric, self._dates, self._codes
+
+    def _mask(self, size, dates, codes, filters, date_range):
+        """Boolean row mask for {column: [values]} filters and an inclusive date range"""
+        mask = None
+        for column, wanted in (filters or {}).items():
+            if column not in self._lookup:
+                continue
+            wanted_codes = [self._lookup[column][v] for v in wanted if v in self._lookup[column]]
+            column_mask = np.isin(codes[column][:size], wanted_codes)
+            mask = column_mask if mask is None else mask & column_mask
+        if date_range:
+            column = dates[:size]
+            date_mask = (column >= date_range[0].toordinal()) & (column <= date_range[1].toordinal())
+            mask = date_mask if mask is None else mask & date_mask
+        return mask
+
+    def _values_for(self, value, size, numeric):
+        if value == "count":
+            return None
+        if value not in numeric:
+            raise ValueError(f"Unknown value column '{value}' (expected one of {tuple(NUMERIC_COLUMNS)})")
+        return numeric[value][:size]
+
+    def total(self, value: str = "total_amount", agg: str = "sum", filters=None, date_range=None):
+        """Scalar sum/count/mean of `value` over the matching rows"""
+        size, numeric, dates, codes = self._snapshot()
+        mask = self._mask(size, dates, codes, filters, date_range)
+        rows = size if mask is None else int(mask.sum())
+        if agg == "count" or value == "count":
+            return rows
+        values = self._values_for(value, size, numeric)
+        selected = values if mask is None else values[mask]
+        result = float(selected.sum(dtype=np.float64))
+        if agg == "mean":
+            return result / rows if rows else 0.0
+        return result
+
+    def group_by(self, key: str, value: str = "total_amount", agg: str = "sum",
+                 filters=None, date_range=None):
+        """{group label: aggregate} for every value of categorical column `key`"""
+        labels, results = self._group(key, value, agg, filters, date_range)
+        return {label: result for label, result in zip(labels, results.tolist()) if label is not None}
+
+    def _group(self, key, value, agg, filters, date_range):
+        if key not in self._codes:
+            raise ValueError(f"Unknown group column '{key}' (expected one of {CATEGORICAL_COLUMNS})")
+        if agg not in AGGREGATIONS:
+            raise ValueError(f"Unknown aggregation '{agg}' (expected one of {AGGREGATIONS})")
+
+        size, numeric, dates, codes = self._snapshot()
+        labels = self._values[key][:]
+        group_codes = codes[key][:size]
+        mask = self._mask(size, dates, codes, filters, date_range)
+        if mask is not None:
+            group_codes = group_codes[mask]
+
+        counts = np.bincount(group_codes, minlength=len(labels)).astype(np.float64)
+        if agg == "count" or value == "count":
+            results = counts
+        else:
+            values = self._values_for(value, size, numeric)
+            if mask is not None:
+                values = values[mask]
+            results = np.bincount(group_codes, weights=values, minlength=len(labels))
+            if agg == "mean":
+                results = np.divide(results, counts, out=np.zeros_like(results), where=counts > 0)
+        # Groups with no matching rows are excluded from results
+        labels = [label if n else None for label, n in zip(labels, counts)]
+        return labels, results
+
+    def top_k(self, key: str, k: int = 5, value: str = "total_amount", agg: str = "sum",
+              filters=None, date_range=None):
+        """[(label, aggregate), ...] for the k largest groups of `key`, descending"""
+        labels, results = self._group(key, value, agg, filters, date_range)
+        present = np.array([label is not None for label in labels], dtype=bool)
+        candidates = np.nonzero(present)[0]
+        if not len(candidates):
+            return []
+        k = min(k, len(candidates))
+        scores = results[candidates]
+        top = candidates[np.argpartition(-scores, k - 1)[:k]]
+        top = top[np.argsort(-results[top], kind="stable")]
+        return [(labels[i], float(results[i])) for i in top]
+
+    def time_series(self, freq: str = "month", value: str = "total_amount", agg: str = "sum",
+                    filters=None, date_range=None):
+        """[(period, aggregate), ...] in date order; freq is "day", "week" or "month" """
+        units = {"day": "D", "week": "W", "month": "M"}
+        if freq not in units:
+            raise ValueError(f"Unknown frequency '{freq}' (expected one of {tuple(units)})")
+
+        size, numeric, dates, codes = self._snapshot()
+        mask = self._mask(size, dates, codes, filters, date_range)
+        valid = dates[:size] != _NO_DATE
+        mask = valid if mask is None else mask & valid
+
+        days = (dates[:size][mask] - _EPOCH_ORDINAL).astype("datetime64[D]")
+        periods = days.astype(f"datetime64[{units[freq]}]").astype(np.int64)
+        if not len(periods):
+            return []
+        # Periods are contiguous integers, so bincount replaces a sort-based group-by
+        first = periods.min()
+        offsets = periods - first
+        counts = np.bincount(offsets).astype(np.float64)
+        if agg == "count" or value == "count":
+            results = counts
+        else:
+            values = self._values_for(value, size, numeric)[mask]
+            results = np.bincount(offsets, weights=values)
+            if agg == "mean":
+                results = np.divide(results, counts, out=np.zeros_like(results), where=counts > 0)
+        present = np.nonzero(counts)[0]
+        labels = (present + first).astype(f"datetime64[{units[freq]}]")
+        return [(str(label), float(results[i])) for label, i in zip(labels, present)]
+
+    # Memory ---------------------------------------------------------------
+
+    def memory_bytes(self):
+        """Bytes held by the used part of the columns plus the dictionaries"""
+        return sum(self.memory_report()["columns"].values())
+
+    def memory_report(self):
+        """Per-column bytes for the current rows and the projected MB per million rows"""
+        size = self.size
+        columns = {name: array[:size].nbytes for name, array in self._numeric.items()}
+        columns["date_of_purchase"] = self._dates[:size].nbytes
+        for name in CATEGORICAL_COLUMNS:
+            dictionary = sum(len(v) + 49 for v in self._values[name])  # str object overhead
+            columns[name] = self._codes[name][:size].nbytes + dictionary
+        total = sum(columns.values())
+        bytes_per_row = total / size if size else 0.0
+        return {
+            "rows": size,
+            "bytes": total,
+            "allocated_bytes": sum(a.nbytes for a in (*self._numeric.values(), self._dates, *self._codes.values())),
+            "bytes_per_row": round(bytes_per_row, 1),
+            "mb_per_million_rows": round(bytes_per_row * 1_000_000 / 1e6, 1),
+            "dictionary_sizes": {name: len(values) for name, values in self._values.items()},
+            "columns": columns,
+        }
+
+
+# Aggregate questions answered straight from the store ----------------------
+
+_TOP_RE = re.compile(
+    r"\b(?:top|best[- ]selling|most popular|highest[- ]grossing|biggest)\s*(\d+)?\s*"
+    r"(?:(?:best[- ]|most[- ])?(?:selling|sold|popular|grossing)\s+)?"
+    r"(products?|items?|categor(?:y|ies)|customers?|buyers?|stores?|locations?|cities|channels?)\b",
+    re.IGNORECASE
+)
+_TOTAL_RE = re.compile(
+    r"\b(?:total|overall|how much)\b.*\b(?:sales|revenue|sold|spent|quantity|units|orders)\b"
+    r"|\b(?:how many)\b.*\b(?:orders|transactions|units|items)\b"
+    r"|\baverage order value\b",
+    re.IGNORECASE
+)
+# Words an aggregate answer accounts for; anything else in the question
+# (payment mode, "recent", an unknown product...) is a qualifier the store
+# can't apply, so the question goes to RAG instead
+_AGGREGATE_WORDS = frozenset("""
+    a all an and any are at by can could did do does during each for from give have has how i in is
+    it list me much many my number of on or our over overall per please show so tell that the their
+    there this to total us was we were what whats what's which who with you
+    top best selling sell sold most popular highest grossing biggest largest
+    revenue sales sale spent spend spending earned earn earning made make generate generated gross
+    amount value average quantity units unit pieces count orders order transactions transaction
+    buy bought purchase purchases purchased place placed
+    products product items item categories category customers customer buyers buyer stores store
+    locations location cities city channels channel
+    today yesterday this last past previous current week weeks month months year years day days
+""".split()) | frozenset(m.lower() for m in (*calendar.month_name, *calendar.month_abbr) if m)
+_WORD_RE = re.compile(r"[a-z0-9]+(?:['&-][a-z0-9]+)*")
+_GROUP_LABELS = {
+    "product_name": "products", "category": "categories", "customer_id": "customers",
+    "store_location": "stores", "channel": "channels",
+}
+_GROUP_KEYS = {
+    "product": "product_name", "item": "product_name", "categor": "category",
+    "customer": "customer_id", "buyer": "customer_id", "store": "store_location",
+    "location": "store_location", "cit": "store_location", "channel": "channel",
+}
+
+
+def _metric(question):
+    """(value column, aggregation, label) implied by the wording of a question"""
+    text = question.lower()
+    if "average order value" in text:
+        return "total_amount", "mean", "average order value"
+    if re.search(r"\b(units|quantity|pieces|items sold)\b", text):
+        return "quantity", "sum", "units"
+    if re.search(r"\b(orders|transactions|how many)\b", text):
+        return "count", "count", "orders"
+    return "total_amount", "sum", "revenue"
+
+
+def _unapplied_terms(question, filters):
+    """Words of `question` not covered by the recognised filters or aggregate wording"""
+    text = question.lower()
+    for field, values in filters.items():
+        if field == "date_range":
+            continue
+        for value in sorted(values, key=len, reverse=True):
+            text = re.sub(r"\b" + re.escape(str(value).lower()) + r"\b", " ", text)
+    return [w for w in _WORD_RE.findall(text) if w not in _AGGREGATE_WORDS and not w.isdigit()]
+
+
+def _format(value, label):
+    if label in ("revenue", "average order value"):
+        return f"${value:,.2f}"
+    return f"{value:,.0f}"
+
+
+def answer_aggregate(question, store, today: date = None):
+    """Answer top-k / total questions from the columnar store, or None if not one
+
+    Filters (product, category, store, channel, customer, date range) are
+    recognised the same way as for filtered retrieval. Questions with any
+    other qualifier return None so they fall through to RAG rather than
+    getting an answer that silently ignores part of the question.
+    """
+    if store is None or not store.size:
+        return None
+
+    top = _TOP_RE.search(question)
+    if not top and not _TOTAL_RE.search(question):
+        return None
+
+    filters = extract_filters(question, store.vocabulary(), today)
+    unapplied = _unapplied_terms(question, filters)
+    if unapplied:
+        logger.debug("Aggregate fast path skipped, unapplied terms: %s", unapplied)
+        return None
+    date_range = filters.pop("date_range", None)
+    value, agg, label = _metric(question)
+    period = f" from {date_range[0]} to {date_range[1]}" if date_range else ""
+    scope_values = list(dict.fromkeys(v for values in filters.values() for v in values))
+    scope = f" in {', '.join(scope_values)}" if scope_values else ""
+
+    if top:
+        k = int(top.group(1) or 5)
+        noun = top.group(2).lower()
+        key = next(column for prefix, column in _GROUP_KEYS.items() if noun.startswith(prefix))
+        rows = store.top_k(key, k=k, value=value, agg=agg, filters=filters, date_range=date_range)
+        if not rows:
+            return {"answer": f"No transactions found{scope}{period}", "sources": []}
+        lines = [f"{i}. {name}: {_format(result, label)}" for i, (name, result) in enumerate(rows, 1)]
+        heading = f"Top {len(rows)} {_GROUP_LABELS[key]} by {label}{scope}{period}:"
+        return {"answer": "\n".join([heading, *lines]), "sources": []}
+
+    result = store.total(value=value, agg=agg, filters=filters, date_range=date_range)
+    answer = f"{label.capitalize()}{scope}{period}: {_format(result, label)}"
+    if agg != "count":
+        rows = store.total(value="count", filters=filters, date_range=date_range)
+        answer += f" across {rows:,} transactions"
+    return {"answer": answer, "sources": []}
+
+
+# Process-wide stores -------------------------------------------------------
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_columnar_store(collections, load: bool = True):
+    """Process-wide store for collections["transactions"] (None if disabled)
+
+    The first call loads the collection; with load=False only an already
+    loaded store is returned.
+    """
+    if not columnar_store_enabled():
+        return None
+    key = collections["transactions"].full_name
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None and load:
+            store = _stores[key] = ColumnarTransactionStore().load(collections["transactions"])
+        return store
+
+
+def publish_store(collections, store):
+    """Replace a loaded store with `store`, built from a staged upload (no-op if none is loaded)"""
+    key = collections["transactions"].full_name
+    with _stores_lock:
+        if key in _stores:
+            _stores[key] = store
+            logger.info("✓ Columnar store replaced (%s transactions)", store.size)
+
+
+def record_ingest(collections, transactions, cleared: bool = False):
+    """Keep a loaded store in step with an upload (no-op if none is loaded)"""
+    store = get_columnar_store(collections, load=False)
+    if store is None:
+        return
+    if cleared:
+        store.clear()
+    added = store.append(transactions)
+    logger.info("✓ Columnar store appended %s transactions (now %s)", added, store.size)
@@ -3,6 +3,8 @@ from pymongo import MongoClient
 from pymongo.errors import ConnectionFailure
 import os
 import logging
+from chat_store import create_chat_history_indexes
+from profiles import create_profile_indexes
 
 logger = logging.getLogger(__name__)
 
@@ -40,18 +42,15 @@ def get_mongodb_connection():
         logger.error(f"Unexpected error during MongoDB connection: {str(e)}", exc_info=True)
         raise
 
-@st.cache_resource
-def init_collections():
-    """Initialize database collections with indexes"""
-    logger.info("Initializing database collections...")
-    
-    db = get_mongodb_connection()
-    
+def create_collections(db):
+    """Return the collections dict for `db`, creating indexes"""
     collections = {
         "transactions": db["transactions"],
         "products": db["products"],
         "customers": db["customers"],
-        "support_tickets": db["support_tickets"]
+        "support_tickets": db["support_tickets"],
+        "chat_history": db["chat_history"],
+        "profiles": db["profiles"]
     }
     
     logger.info("Creating indexes for collections...")
@@ -70,9 +69,41 @@ def init_collections():
         collections["support_tickets"].create_index("ticket_number", unique=True)
         logger.debug("✓ Index created: support_tickets.ticket_number")
         
+        ttl_days = float(os.getenv("CHAT_HISTORY_TTL_DAYS", "30"))
+        create_chat_history_indexes(collections["chat_history"], ttl_days)
+        logger.debug("✓ Index created: chat_history.session_id, chat_history.created_at (TTL %s days)", ttl_days)
+        
+        create_profile_indexes(collections["profiles"])
+        logger.debug("✓ Index created: profiles.entity_type, profiles.entity_id")
+        
         logger.info("✓ All indexes created successfully")
     except Exception as e:
         logger.warning(f"Index creation warning (may already exist): {str(e)}")
     
+    return collections
+
+@st.cache_resource
+def init_collections():
+    """Initialize database collections with indexes"""
+    logger.info("Initializing database collections...")
+    
+    db = get_mongodb_connection()
+    collections = create_collections(db)
+    
     logger.info("✓ Collections initialized successfully")
     return collections
+
+def connect_collections(uri: str = None, db_name: str = None):
+    """Connect without Streamlit (API service, CLI tools) using MONGODB_URI/DB_NAME env vars"""
+    uri = uri or os.getenv("MONGODB_URI")
+    db_name = db_name or os.getenv("DB_NAME", "rag_chatbot_db")
+    
+    if not uri:
+        raise ValueError("MONGODB_URI not found in environment")
+    
+    logger.info("Connecting to MongoDB (database: %s)...", db_name)
+    client = MongoClient(uri, serverSelectionTimeoutMS=5000)
+    client.admin.command('ping')
+    logger.info("✓ Successfully connected to MongoDB")
+    
+    return create_collections(client[db_name])
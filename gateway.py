@@ -0,0 +1,398 @@
+"""Gateway in front of every LLM and embedding call
+
+All model traffic (the retrieval chain, the customer-history LLM and the
+intent classifier's embeddings) goes through a `Gateway`, which provides:
+
+    single-flight    identical requests already in flight share one call
+    fair limiting    at most `max_concurrency` calls and `tokens_per_minute`
+                     (estimated) per process; waiting calls are granted
+                     round-robin across sessions so one busy session can't
+                     starve the rest
+    metrics          queue depth, in-flight calls, coalesced calls, and wait
+                     time (recorded in the tracer as gateway.<name>.wait)
+    deadlines        each call is abandoned after `timeout` seconds
+                     (DeadlineExceeded); the slot is held until it returns
+    circuit breaker  after `failure_threshold` consecutive failures calls
+                     fail fast (CircuitOpenError) for `reset_timeout` seconds,
+                     then a single trial call decides whether to close again
+
+Callers catch ModelUnavailable (the base of both) to serve degraded answers.
+`run_with_deadline(stage, func)` bounds a whole stage (e.g. the RAG chain)
+using <STAGE>_TIMEOUT.
+
+Backends are wrapped with `wrap_embeddings` / `wrap_llm` (build_models does
+this), so LangChain sees ordinary Embeddings and chat model objects. The
+wrappers are in gateway_models and imported on first use, keeping this module
+free of LangChain for the startup path. The
+session used for fair queuing is the `session` trace label:
+
+    with trace_context(session=session_id):
+        answer_question(...)
+
+Configure with LLM_MAX_CONCURRENCY, LLM_TOKENS_PER_MINUTE, LLM_TIMEOUT,
+LLM_BREAKER_FAILURES, LLM_BREAKER_RESET and the same EMBEDDING_* variables
+(0 = unlimited).
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import contextvars
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from tracing import current_labels, record
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SESSION = "default"
+
+
+class ModelUnavailable(Exception):
+    """A model call was refused or abandoned; callers should degrade"""
+
+
+class CircuitOpenError(ModelUnavailable):
+    """The backend's circuit breaker is open"""
+
+
+class DeadlineExceeded(ModelUnavailable, TimeoutError):
+    """A call or stage ran past its deadline"""
+
+
+def stage_timeout(stage: str, default: float) -> float:
+    """Deadline for `stage` from <STAGE>_TIMEOUT (seconds, 0 = none)"""
+    value = os.getenv(f"{stage.upper()}_TIMEOUT")
+    return float(value) if value else default
+
+
+_stage_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="stage")
+
+
+def run_with_deadline(stage: str, func, default_timeout: float, *args):
+    """Run `func(*args)` and raise DeadlineExceeded if it exceeds the stage deadline
+
+    The call keeps running in the background when abandoned; trace labels
+    and span collectors are carried into the worker thread.
+    """
+    timeout = stage_timeout(stage, default_timeout)
+    if not timeout:
+        return func(*args)
+    future = _stage_pool.submit(contextvars.copy_context().run, func, *args)
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeout:
+        if future.done():
+            # TimeoutError raised by func itself (FutureTimeout aliases it)
+            raise
+        record(f"deadline_exceeded.{stage}", timeout)
+        raise DeadlineExceeded(f"{stage} exceeded its {timeout:g}s deadline")
+
+
+def estimate_tokens(texts) -> int:
+    """Cheap token estimate (~4 characters per token) used for rate limiting"""
+    return max(1, sum(len(text) for text in texts) // 4)
+
+
+class FairLimiter:
+    """Concurrency and token-rate limit with round-robin queuing across sessions"""
+
+    def __init__(self, max_concurrency: int = 4, tokens_per_minute: int = 0):
+        self.max_concurrency = max(1, max_concurrency)
+        self.tokens_per_minute = tokens_per_minute
+        self._tokens = float(tokens_per_minute)
+        self._refilled = time.monotonic()
+        self._active = 0
+        self._queues = OrderedDict()  # session -> deque of waiting tickets, in rotation order
+        self._cond = threading.Condition()
+
+    def _refill(self):
+        if not self.tokens_per_minute:
+            return
+        now = time.monotonic()
+        self._tokens = min(
+            float(self.tokens_per_minute),
+            self._tokens + (now - self._refilled) * self.tokens_per_minute / 60.0
+        )
+        self._refilled = now
+
+    def _next_ticket(self):
+        for queue in self._queues.values():
+            return queue[0]
+        return None
+
+    def acquire(self, session: str = DEFAULT_SESSION, cost: int = 1, timeout: float = None):
+        """Block until this call may run; returns seconds waited
+
+        Raises TimeoutError if not granted within `timeout`.
+        """
+        ticket = object()
+        started = time.monotonic()
+        deadline = None if timeout is None else started + timeout
+        # A single request larger than the whole budget still runs, alone
+        cost = min(cost, self.tokens_per_minute) if self.tokens_per_minute else 0
+        with self._cond:
+            self._queues.setdefault(session, deque()).append(ticket)
+            try:
+                while True:
+                    self._refill()
+                    wait = None
+                    if self._next_ticket() is ticket and self._active < self.max_concurrency:
+                        if self._tokens >= cost:
+                            break
+                        wait = (cost - self._tokens) * 60.0 / self.tokens_per_minute
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise TimeoutError(f"Waited {timeout:.1f}s for a model call slot")
+                        wait = remaining if wait is None else min(wait, remaining)
+                    self._cond.wait(wait)
+            except BaseException:
+                self._remove(session, ticket)
+                self._cond.notify_all()
+                raise
+
+            self._remove(session, ticket, rotate=True)
+            self._active += 1
+            self._tokens -= cost
+            self._cond.notify_all()
+        return time.monotonic() - started
+
+    def _remove(self, session, ticket, rotate=False):
+        queue = self._queues[session]
+        queue.remove(ticket)
+        if not queue:
+            del self._queues[session]
+        elif rotate:
+            # Session goes to the back of the rotation behind other waiting sessions
+            self._queues.move_to_end(session)
+
+    def release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            self._refill()
+            return {
+                "in_flight": self._active,
+                "queued": sum(len(q) for q in self._queues.values()),
+                "queued_sessions": len(self._queues),
+                "tokens_available": round(self._tokens) if self.tokens_per_minute else None,
+            }
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Share one execution among concurrent callers with the same key"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key: str, func, timeout: float = None):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            logger.debug("Coalesced %s call onto in-flight request", self.name)
+            if not flight.done.wait(timeout):
+                raise DeadlineExceeded(f"Timed out waiting for in-flight {self.name} call")
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = func()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+
+class CircuitBreaker:
+    """Closed -> open after consecutive failures -> half-open trial after a cool-down"""
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Raise CircuitOpenError unless a call may go to the backend now"""
+        if not self.failure_threshold:
+            return
+        with self._lock:
+            if self.state == "closed":
+                return
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._trial_running = False
+            if self.state == "half_open" and not self._trial_running:
+                self._trial_running = True
+                return
+            retry_in = max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+        raise CircuitOpenError(f"{self.name} circuit open after repeated failures (retry in {retry_in:.0f}s)")
+
+    def abort_trial(self):
+        """The allowed call never reached the backend; let another one try"""
+        with self._lock:
+            self._trial_running = False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                logger.info("✓ %s circuit closed", self.name)
+            self.state = "closed"
+            self.failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.state == "half_open" or (
+                self.failure_threshold and self.failures >= self.failure_threshold and self.state == "closed"
+            ):
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                logger.warning("%s circuit opened after %s consecutive failures", self.name, self.failures)
+
+
+class Gateway:
+    """Single-flight, fair limiter, deadline and circuit breaker for one backend"""
+
+    def __init__(self, name: str, max_concurrency: int = 4, tokens_per_minute: int = 0,
+                 timeout: float = 0, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.limiter = FairLimiter(max_concurrency, tokens_per_minute)
+        self.flights = SingleFlight(name)
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+        self.timeout = timeout
+        self.max_queued = 0
+        self.failures = 0
+        self._pool = ThreadPoolExecutor(max_workers=self.limiter.max_concurrency, thread_name_prefix=f"{name}-call")
+
+    @classmethod
+    def from_env(cls, name: str, default_concurrency: int = 4, default_timeout: float = 30.0):
+        prefix = name.upper()
+        return cls(
+            name,
+            max_concurrency=int(os.getenv(f"{prefix}_MAX_CONCURRENCY", default_concurrency)),
+            tokens_per_minute=int(os.getenv(f"{prefix}_TOKENS_PER_MINUTE", "0")),
+            timeout=float(os.getenv(f"{prefix}_TIMEOUT", default_timeout)),
+            failure_threshold=int(os.getenv(f"{prefix}_BREAKER_FAILURES", "5")),
+            reset_timeout=float(os.getenv(f"{prefix}_BREAKER_RESET", "30")),
+        )
+
+    def call(self, key: str, func, cost: int = 1, session: str = None, timeout: float = None):
+        """Run `func()` through the gateway; concurrent calls with the same key share it
+
+        Raises CircuitOpenError without calling the backend while the breaker
+        is open, and DeadlineExceeded if the call takes longer than the
+        gateway timeout.
+        """
+        session = session or current_labels().get("session") or DEFAULT_SESSION
+        timeout = timeout if timeout is not None else (self.timeout or None)
+
+        def limited():
+            self.breaker.allow()
+            self.max_queued = max(self.max_queued, self.limiter.stats()["queued"] + 1)
+            try:
+                waited = self.limiter.acquire(session, cost, timeout)
+            except TimeoutError as e:
+                self.breaker.abort_trial()
+                raise DeadlineExceeded(str(e))
+            record(f"gateway.{self.name}.wait", waited)
+            try:
+                future = self._pool.submit(contextvars.copy_context().run, func)
+            except BaseException:
+                self.limiter.release()
+                raise
+            # An abandoned call keeps its slot until the provider actually returns
+            future.add_done_callback(lambda _: self.limiter.release())
+            try:
+                result = future.result(timeout=timeout)
+            except FutureTimeout:
+                self.failures += 1
+                self.breaker.record_failure()
+                if future.done():
+                    raise
+                record(f"deadline_exceeded.{self.name}", timeout)
+                raise DeadlineExceeded(f"{self.name} call exceeded its {timeout:g}s deadline")
+            except Exception:
+                self.failures += 1
+                self.breaker.record_failure()
+                raise
+            self.breaker.record_success()
+            return result
+
+        # Followers wait for the leader's queueing plus its call
+        return self.flights.do(key, limited, 2 * timeout if timeout else None)
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "calls": self.flights.calls,
+            "coalesced": self.flights.coalesced,
+            "failures": self.failures,
+            "breaker": self.breaker.state,
+            "max_queued": self.max_queued,
+            **self.limiter.stats(),
+        }
+
+
+llm_gateway = Gateway.from_env("llm", default_concurrency=4, default_timeout=20.0)
+embedding_gateway = Gateway.from_env("embedding", default_concurrency=8, default_timeout=30.0)
+
+
+def gateway_stats():
+    """Current metrics for every gateway (admin panel, /health)"""
+    return [llm_gateway.stats(), embedding_gateway.stats()]
+
+
+def request_key(*parts) -> str:
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(json.dumps(part, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def wrap_embeddings(embeddings):
+    # LangChain wrappers live apart so importing the gateway doesn't load langchain_core
+    from gateway_models import GatewayEmbeddings
+
+    return embeddings if isinstance(embeddings, GatewayEmbeddings) else GatewayEmbeddings(embeddings)
+
+
+def wrap_llm(llm):
+    from gateway_models import GatewayChatModel
+
+    return llm if isinstance(llm, GatewayChatModel) else GatewayChatModel(inner=llm)
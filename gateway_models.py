@@ -0,0 +1,54 @@
+"""LangChain Embeddings and chat model wrappers that route calls through a Gateway
+
+Imported lazily by gateway.wrap_embeddings / wrap_llm so that importing the
+gateway (UI, API, intent classifier) doesn't pull in langchain_core.
+"""
+from typing import Any, List, Optional
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from gateway import Gateway, embedding_gateway, estimate_tokens, llm_gateway, request_key
+
+
+class GatewayEmbeddings(Embeddings):
+    """Embeddings wrapper routing every call through a Gateway"""
+
+    def __init__(self, inner, gateway: Gateway = None):
+        self.inner = inner
+        self.gateway = gateway or embedding_gateway
+
+    def embed_documents(self, texts, **kwargs):
+        texts = list(texts)
+        return self.gateway.call(
+            request_key("documents", texts, kwargs),
+            lambda: self.inner.embed_documents(texts, **kwargs),
+            cost=estimate_tokens(texts)
+        )
+
+    def embed_query(self, text):
+        return self.gateway.call(
+            request_key("query", text), lambda: self.inner.embed_query(text), cost=estimate_tokens([text])
+        )
+
+
+class GatewayChatModel(BaseChatModel):
+    """Chat model wrapper routing every generation through a Gateway"""
+
+    inner: Any
+    gateway: Any = None
+
+    @property
+    def _llm_type(self) -> str:
+        return f"gateway-{getattr(self.inner, '_llm_type', 'chat')}"
+
+    def _generate(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> ChatResult:
+        gateway = self.gateway or llm_gateway
+        payload = [(m.type, m.content) for m in messages]
+        message = gateway.call(
+            request_key("chat", payload, stop, kwargs),
+            lambda: self.inner.invoke(messages, stop=stop, **kwargs),
+            cost=estimate_tokens([str(m.content) for m in messages])
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
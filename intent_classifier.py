@@ -1,5 +1,50 @@
+import re
+import inspect
+import logging
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+from gateway import run_with_deadline
+from tracing import traced
+
+logger = logging.getLogger(__name__)
+
+# Default deadline (seconds) of the question embedding; override with CLASSIFY_TIMEOUT
+CLASSIFY_TIMEOUT = 5.0
+
+_SUPPORT_RE = re.compile(
+    r"\b(problem|issue|broken|defect\w*|refund|complain\w*|support|help|not working|wrong|damaged|ticket)\b",
+    re.IGNORECASE
+)
+_HISTORY_RE = re.compile(
+    r"\b(my (orders?|purchases?|transactions?|invoices?|receipts?)|purchase history|order history|"
+    r"what did (i|customer)\b|CUST[-_]?\d+|[\w.+-]+@[\w-]+\.[\w.-]+)",
+    re.IGNORECASE
+)
+
+def accepts_task_type(embeddings):
+    """True if embed_documents takes `task_type` through every wrapper (gateway, cache, ...)
+
+    Checked up front: a TypeError from a wrapped call would count as a
+    backend failure in the gateway's circuit breaker.
+    """
+    model = embeddings
+    while model is not None:
+        try:
+            parameters = inspect.signature(model.embed_documents).parameters.values()
+        except (AttributeError, TypeError, ValueError):
+            return False
+        if not any(p.name == "task_type" or p.kind is p.VAR_KEYWORD for p in parameters):
+            return False
+        model = getattr(model, "inner", None)
+    return True
+
+
+def keyword_intent(question):
+    """Rule-based intent used when the embedding backend is unavailable"""
+    if _SUPPORT_RE.search(question or ""):
+        return "SUPPORT"
+    if _HISTORY_RE.search(question or ""):
+        return "CUSTOMER_HISTORY"
+    return "SEARCH_DB"
 
 class EmbeddingIntentClassifier:
     """Classify user intents using embeddings and cosine similarity"""
@@ -96,7 +141,7 @@ class EmbeddingIntentClassifier:
             ]
         }
         
-        print("\n🧠 Pre-computing intent template embeddings...")
+        logger.info("🧠 Pre-computing intent template embeddings...")
         self.intent_embeddings = {}
         
         try:
@@ -104,20 +149,25 @@ class EmbeddingIntentClassifier:
                 # Embed all templates for this intent
                 embeddings = self.embeddings_model.embed_documents(templates)
                 # Average the embeddings to get intent representation
-                self.intent_embeddings[intent] = np.mean(embeddings, axis=0)
+                self.intent_embeddings[intent] = np.mean(embeddings, axis=0, dtype=np.float32)
             
-            print(f"✅ Intent templates loaded: {list(self.intent_templates.keys())}")
+            logger.info("✅ Intent templates loaded: %s", list(self.intent_templates))
         
         except Exception as e:
-            print(f"Error initializing intent classifier: {str(e)}")
+            logger.error("Error initializing intent classifier: %s", e)
             raise
 
+    @traced("classify")
     def classify(self, question):
         """Classify question intent and return intent and confidence"""
         
+        from sklearn.metrics.pairwise import cosine_similarity
+        
         try:
-            # Get embedding for the question
-            question_embedding = self.embeddings_model.embed_query(question)
+            # Get embedding for the question (bounded by CLASSIFY_TIMEOUT)
+            question_embedding = run_with_deadline(
+                "classify", self.embeddings_model.embed_query, CLASSIFY_TIMEOUT, question
+            )
             
             # Calculate cosine similarity with each intent
             similarities = {}
@@ -135,6 +185,40 @@ class EmbeddingIntentClassifier:
             return best_intent, best_score
         
         except Exception as e:
-            print(f"Error during intent classification: {str(e)}")
-            # Return default intent on error
-            return "SEARCH_DB", 0.5
+            # Confidence 0.0 marks a keyword fallback rather than a model decision
+            intent = keyword_intent(question)
+            logger.warning("Intent classification unavailable (%s); keyword fallback chose %s", e, intent)
+            return intent, 0.0
+
+    @traced("classify_batch")
+    def classify_batch(self, questions):
+        """Classify many questions with one embedding call; returns [(intent, confidence), ...]"""
+        
+        from sklearn.metrics.pairwise import cosine_similarity
+        
+        if not questions:
+            return []
+        
+        try:
+            # Embed as queries so results match classify(), where the backend takes a task type
+            if accepts_task_type(self.embeddings_model):
+                question_embeddings = self.embeddings_model.embed_documents(
+                    list(questions), task_type="RETRIEVAL_QUERY"
+                )
+            else:
+                question_embeddings = self.embeddings_model.embed_documents(list(questions))
+            
+            intents = list(self.intent_embeddings.keys())
+            similarities = cosine_similarity(
+                question_embeddings,
+                [self.intent_embeddings[intent] for intent in intents]
+            )
+            best = similarities.argmax(axis=1)
+            return [
+                (intents[idx], float(similarities[row, idx]))
+                for row, idx in enumerate(best)
+            ]
+        
+        except Exception as e:
+            logger.warning("Batch intent classification unavailable (%s); using keyword fallback", e)
+            return [(keyword_intent(question), 0.0) for question in questions]
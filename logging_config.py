@@ -0,0 +1,95 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+
+LOG_FILE = "chatbot.log"
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s'
+
+_lock = threading.Lock()
+_listener = None
+
+
+def _parse_module_levels(spec: str) -> dict:
+    """Parse "module=LEVEL,other=LEVEL" into a {logger_name: level} dict"""
+    levels = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, level = item.partition("=")
+        if name and level:
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging(level: str = None, module_levels: dict = None,
+                  log_file: str = LOG_FILE, max_bytes: int = 10 * 1024 * 1024,
+                  backup_count: int = 5):
+    """Route all logging through a queue to a rotating file and the console
+
+    Log calls only enqueue the record; formatting and file I/O happen on the
+    QueueListener thread. Safe to call on every Streamlit rerun.
+
+    Args:
+        level: Root level (default: LOG_LEVEL env var or INFO)
+        module_levels: Per-logger overrides, e.g. {"rag_model": "DEBUG"}
+            (default: LOG_LEVELS env var, "rag_model=DEBUG,upload=WARNING")
+        log_file: Path of the rotating log file
+        max_bytes: Rotate the log file once it reaches this size
+        backup_count: Number of rotated files to keep
+    """
+    global _listener
+
+    with _lock:
+        if _listener is not None:
+            return _listener
+
+        level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+        if module_levels is None:
+            module_levels = _parse_module_levels(os.getenv("LOG_LEVELS", ""))
+
+        formatter = logging.Formatter(LOG_FORMAT)
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+        )
+        file_handler.setFormatter(formatter)
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(formatter)
+
+        log_queue = queue.SimpleQueue()
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(logging.handlers.QueueHandler(log_queue))
+        root.setLevel(level)
+
+        for name, module_level in module_levels.items():
+            logging.getLogger(name).setLevel(module_level)
+
+        _listener = logging.handlers.QueueListener(
+            log_queue, file_handler, stream_handler, respect_handler_level=True
+        )
+        _listener.start()
+        atexit.register(_listener.stop)
+
+        logging.getLogger(__name__).info(
+            "✓ Logging configured (level=%s, overrides=%s, file=%s)", level, module_levels, log_file
+        )
+        return _listener
+
+
+def tail_log(path: str = LOG_FILE, lines: int = 100, block_size: int = 8192) -> str:
+    """Return the last `lines` lines of a log file by reading backwards from the end
+
+    Cost depends on the number of lines requested, not on the file size.
+    """
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b""
+        while position > 0 and data.count(b"\n") <= lines:
+            read_size = min(block_size, position)
+            position -= read_size
+            f.seek(position)
+            data = f.read(read_size) + data
+    return b"\n".join(data.splitlines()[-lines:]).decode("utf-8", errors="replace")
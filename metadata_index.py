@@ -0,0 +1,203 @@
+"""Structured filters for retrieval: extraction from questions and a local metadata index
+
+`extract_filters` turns "electronics sales in Chennai last month" into
+{"category": ["Electronics"], "store_location": ["Chennai"],
+ "date_range": (date(…), date(…))} using the values actually present in the
+index as its vocabulary. `MetadataIndex` maps those filters to the vector
+positions (FAISS ids) of matching transactions via per-value posting lists
+and a date column, without touching the vector index.
+"""
+import calendar
+import logging
+import re
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CATEGORICAL_FIELDS = ("category", "store_location", "channel", "customer_id")
+_NO_DATE = -1
+
+_MONTHS = {name.lower(): idx for idx, name in enumerate(calendar.month_name) if name}
+_MONTHS.update({name.lower(): idx for idx, name in enumerate(calendar.month_abbr) if name})
+_MONTH_RE = re.compile(r"\b(" + "|".join(sorted(_MONTHS, key=len, reverse=True)) + r")\b(?:\s+(\d{4}))?", re.IGNORECASE)
+_LAST_N_RE = re.compile(r"\b(?:last|past)\s+(\d+)\s+(day|week|month)s?\b", re.IGNORECASE)
+_YEAR_RE = re.compile(r"\b(?:in|during|for)\s+(20\d{2})\b", re.IGNORECASE)
+_CUSTOMER_ID_RE = re.compile(r"\bCUST[-_]?\d+\b", re.IGNORECASE)
+
+
+def parse_date(value):
+    """Parse a stored purchase date ("2024-05-08", ISO datetime, "08/05/2024") or None"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    text = str(value or "").strip()
+    if not text:
+        return None
+    try:
+        return date.fromisoformat(text[:10])
+    except ValueError:
+        pass
+    for fmt in ("%d/%m/%Y", "%d-%m-%Y", "%m/%d/%Y", "%d %b %Y", "%d %B %Y"):
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def _month_range(year, month):
+    return date(year, month, 1), date(year, month, calendar.monthrange(year, month)[1])
+
+
+def extract_date_range(question, today: date = None):
+    """Find a relative or named date range in the question: (start, end) inclusive, or None"""
+    today = today or date.today()
+    text = question.lower()
+
+    if "yesterday" in text:
+        day = today - timedelta(days=1)
+        return day, day
+    if "today" in text:
+        return today, today
+    if "last month" in text or "previous month" in text:
+        first = today.replace(day=1) - timedelta(days=1)
+        return _month_range(first.year, first.month)
+    if "this month" in text:
+        return today.replace(day=1), today
+    if "last week" in text:
+        start = today - timedelta(days=today.weekday() + 7)
+        return start, start + timedelta(days=6)
+    if "this week" in text:
+        return today - timedelta(days=today.weekday()), today
+    if "last year" in text:
+        return date(today.year - 1, 1, 1), date(today.year - 1, 12, 31)
+    if "this year" in text:
+        return date(today.year, 1, 1), today
+
+    match = _LAST_N_RE.search(question)
+    if match:
+        n, unit = int(match.group(1)), match.group(2).lower()
+        days = {"day": 1, "week": 7, "month": 30}[unit] * n
+        return today - timedelta(days=days), today
+
+    match = _MONTH_RE.search(question)
+    # "may" is too ambiguous on its own without a year
+    if match and (match.group(2) or match.group(1).lower() != "may"):
+        month = _MONTHS[match.group(1).lower()]
+        year = int(match.group(2)) if match.group(2) else (
+            today.year if month <= today.month else today.year - 1
+        )
+        return _month_range(year, month)
+
+    match = _YEAR_RE.search(question)
+    if match:
+        year = int(match.group(1))
+        return date(year, 1, 1), date(year, 12, 31)
+
+    return None
+
+
+def extract_filters(question, vocabulary, today: date = None):
+    """Structured filters mentioned in a question
+
+    Args:
+        question: User question
+        vocabulary: {field: iterable of known values}, e.g. MetadataIndex.vocabulary();
+            product_name is only matched when the vocabulary has it (columnar store)
+        today: Reference date for relative ranges
+
+    Returns:
+        {field: [values], "date_range": (start, end)} with only the filters found
+    """
+    filters = {}
+    lowered = question.lower()
+    for field in ("category", "store_location", "channel", "product_name"):
+        matches = [
+            value for value in vocabulary.get(field, ())
+            if value and value != "N/A"
+            and re.search(r"\b" + re.escape(value.lower()) + r"\b", lowered)
+        ]
+        # "Smartphone Model A Pro" also contains "Smartphone Model A" - keep the longest
+        matches = [m for m in matches if not any(m != o and m.lower() in o.lower() for o in matches)]
+        if matches:
+            filters[field] = matches
+
+    customer_ids = [m.upper() for m in _CUSTOMER_ID_RE.findall(question)]
+    known = set(vocabulary.get("customer_id", ()))
+    customer_ids = [cid for cid in customer_ids if cid in known]
+    if customer_ids:
+        filters["customer_id"] = customer_ids
+
+    date_range = extract_date_range(question, today)
+    if date_range:
+        filters["date_range"] = date_range
+    return filters
+
+
+class MetadataIndex:
+    """Posting lists per categorical value plus a date column, keyed by vector position"""
+
+    def __init__(self, metadatas=()):
+        self._postings = {field: {} for field in CATEGORICAL_FIELDS}
+        self._dates = np.empty(0, dtype=np.int32)
+        self.size = 0
+        self.add(metadatas)
+
+    def add(self, metadatas):
+        """Append metadata for vectors added to the index in the same order"""
+        metadatas = list(metadatas)
+        if not metadatas:
+            return
+        dates = np.full(len(metadatas), _NO_DATE, dtype=np.int32)
+        postings = {field: {} for field in CATEGORICAL_FIELDS}
+        for offset, meta in enumerate(metadatas):
+            position = self.size + offset
+            for field in CATEGORICAL_FIELDS:
+                value = meta.get(field)
+                if value is not None:
+                    postings[field].setdefault(value, []).append(position)
+            parsed = parse_date(meta.get("date_of_purchase"))
+            if parsed:
+                dates[offset] = parsed.toordinal()
+
+        for field, values in postings.items():
+            for value, positions in values.items():
+                new = np.asarray(positions, dtype=np.int64)
+                existing = self._postings[field].get(value)
+                self._postings[field][value] = new if existing is None else np.concatenate([existing, new])
+        self._dates = np.concatenate([self._dates, dates])
+        self.size += len(metadatas)
+
+    def vocabulary(self):
+        """Known values per categorical field (for extract_filters)"""
+        return {field: list(values) for field, values in self._postings.items()}
+
+    def candidate_ids(self, filters):
+        """Sorted vector positions matching every filter (values within a field are OR-ed)
+
+        Returns None when `filters` contains nothing this index can filter on.
+        """
+        result = None
+        for field in CATEGORICAL_FIELDS:
+            values = filters.get(field)
+            if not values:
+                continue
+            lists = [self._postings[field].get(value) for value in values]
+            lists = [ids for ids in lists if ids is not None]
+            ids = np.unique(np.concatenate(lists)) if lists else np.empty(0, dtype=np.int64)
+            result = ids if result is None else np.intersect1d(result, ids, assume_unique=True)
+
+        date_range = filters.get("date_range")
+        if date_range:
+            start, end = date_range[0].toordinal(), date_range[1].toordinal()
+            if result is None:
+                ids = np.nonzero((self._dates >= start) & (self._dates <= end))[0].astype(np.int64)
+            else:
+                selected = self._dates[result]
+                ids = result[(selected >= start) & (selected <= end)]
+            result = ids
+
+        return result
@@ -0,0 +1,125 @@
+import os
+import threading
+import logging
+from datetime import datetime
+from typing import NamedTuple, Any
+
+logger = logging.getLogger(__name__)
+
+
+class ModelSet(NamedTuple):
+    """Immutable bundle of models built for one version of the transaction data"""
+    version: str
+    qa_chain: Any
+    llm: Any
+    intent_classifier: Any
+    built_at: datetime
+
+
+def release_models(model_set):
+    """Free what a replaced set holds beyond memory (e.g. sharded search threads)
+
+    Sessions still attached to it keep working; its retriever just stops
+    using background threads.
+    """
+    close = getattr(getattr(model_set.qa_chain, "retriever", None), "close", None)
+    if close is None:
+        return
+    try:
+        close()
+    except Exception as e:
+        logger.warning("Could not release model set %s: %s", model_set.version, e)
+
+
+def compute_data_version(transactions_collection) -> str:
+    """Derive a data version from the transaction count and newest _id
+
+    Transactions are insert-only, so any upload changes either the count or
+    the newest ObjectId; a cleared-and-reloaded collection gets new ids.
+    """
+    count = transactions_collection.count_documents({})
+    newest = list(transactions_collection.find({}, {"_id": 1}).sort("_id", -1).limit(1))
+    newest_id = str(newest[0]["_id"]) if newest else "empty"
+    return f"{count}-{newest_id}"
+
+
+class ModelRegistry:
+    """Process-wide holder of the current ModelSet shared by every session
+
+    Readers never take a lock: `current()` returns whatever ModelSet reference
+    was last published, and sessions keep using the set they attached to until
+    they pick up a newer one. Builds are serialised so that two sessions
+    uploading the same data only embed it once.
+    """
+
+    def __init__(self):
+        self._current = None
+        self._build_lock = threading.Lock()
+
+    def current(self):
+        """Return the most recently published ModelSet, or None"""
+        return self._current
+
+    def publish(self, model_set: ModelSet):
+        """Atomically swap in a new ModelSet and release the one it replaces"""
+        previous = self._current
+        self._current = model_set
+        logger.info(
+            "✓ Published model set %s (replaced: %s)",
+            model_set.version, previous.version if previous else "none"
+        )
+        if previous is not None and previous is not model_set:
+            release_models(previous)
+        return model_set
+
+    def get_or_build(self, version: str, builder) -> ModelSet:
+        """Return the ModelSet for `version`, building it with `builder()` if needed
+
+        `builder` must return `(qa_chain, llm, intent_classifier)` like
+        `build_rag_model`. Sessions already attached to an older set keep
+        serving from it while the build runs.
+        """
+        existing = self._current
+        if existing is not None and existing.version == version:
+            logger.info("✓ Reusing shared model set %s", version)
+            return existing
+
+        with self._build_lock:
+            # Another session may have finished the same build while we waited
+            existing = self._current
+            if existing is not None and existing.version == version:
+                logger.info("✓ Reusing shared model set %s (built concurrently)", version)
+                return existing
+
+            logger.info("Building shared model set %s...", version)
+            qa_chain, llm, intent_classifier = builder()
+            model_set = ModelSet(
+                version=version,
+                qa_chain=qa_chain,
+                llm=llm,
+                intent_classifier=intent_classifier,
+                built_at=datetime.now()
+            )
+            return self.publish(model_set)
+
+
+model_registry = ModelRegistry()
+
+
+def build_shared_models(collections, stub: bool = False):
+    """Build (or reuse) the shared model set for the current data version"""
+    from rag_model import build_models, create_google_backends
+
+    if stub:
+        from benchmarks.fakes import FakeEmbeddings, fake_llm
+        embeddings, llm = FakeEmbeddings(), fake_llm()
+    else:
+        api_key = os.getenv("GOOGLE_API_KEY")
+        if not api_key:
+            raise ValueError("GOOGLE_API_KEY not found in environment (use --stub for fake backends)")
+        embeddings, llm = create_google_backends(api_key)
+
+    version = compute_data_version(collections["transactions"])
+    return model_registry.get_or_build(
+        version, lambda: build_models(collections["transactions"], embeddings, llm)
+    )
@@ -0,0 +1,381 @@
+"""Per-customer and per-product profile documents with their own vector index
+
+One compact profile per customer and per product summarises totals, top
+categories and products, stores, first/last purchase and purchase
+frequency, so aggregate-level questions ("Which products does CUST000042
+buy most?", "Who are our biggest customers?") get one compact summary in
+the prompt alongside the matching transactions:
+
+    refresh_profiles(collections, customer_ids, product_ids)   # after an upload
+    index = get_profile_index(collections["profiles"], collections["transactions"], embeddings)
+    index.search("Which products does CUST000042 buy most?", k=4)
+
+Profiles are stored in the `profiles` collection and recomputed only for
+entities that received new transactions; the process-wide index re-embeds
+only profiles whose text changed, or every profile when the embedding model
+changes. Disable with PROFILE_INDEX=0.
+"""
+import logging
+import os
+import re
+import threading
+from collections import Counter
+from datetime import datetime
+
+from pymongo import ReplaceOne
+
+from metadata_index import parse_date
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+ENTITY_FIELDS = {"customer": "customer_id", "product": "product_id"}
+PROFILE_PROJECTION = {field: 1 for field in (
+    "customer_id", "customer_name", "product_id", "product_name", "category",
+    "quantity", "total_amount", "date_of_purchase", "store_location",
+)}
+TOP_N = 3
+_LOOKUP_BATCH = 500
+
+_CUSTOMER_ID_RE = re.compile(r"\bCUST[-_]?\d+\b", re.IGNORECASE)
+_PROFILE_QUESTION_RE = re.compile(
+    r"\b(?:biggest|largest|top|best|most|least|favou?rites?|frequent(?:ly)?|loyal|usually|often|"
+    r"typically|regulars?|profile|overall|lifetime)\b",
+    re.IGNORECASE
+)
+# Superlatives about single transactions ("most recent order", "most expensive item")
+_TRANSACTION_SUPERLATIVE_RE = re.compile(
+    r"\b(?:most|least)\s+(?:recent(?:ly)?|latest|expensive|costly|cheap|current|last)\b"
+    r"|\b(?:latest|last|recent|cheapest|priciest)\b",
+    re.IGNORECASE
+)
+_RANKING_RE = re.compile(r"\b(?:biggest|largest|top|best|most valuable|highest)\b", re.IGNORECASE)
+_CUSTOMER_NOUN_RE = re.compile(r"\b(?:customers?|buyers?|clients?|shoppers?|spenders?)\b", re.IGNORECASE)
+_PRODUCT_NOUN_RE = re.compile(r"\b(?:products?|items?|sellers?)\b", re.IGNORECASE)
+
+
+def profile_index_enabled():
+    return os.getenv("PROFILE_INDEX", "1") != "0"
+
+
+def is_profile_question(question):
+    """True for questions about a customer's or product's overall behaviour rather than single transactions"""
+    question = question or ""
+    if _TRANSACTION_SUPERLATIVE_RE.search(question):
+        return False
+    return bool(_PROFILE_QUESTION_RE.search(question)) and bool(
+        _CUSTOMER_ID_RE.search(question) or _CUSTOMER_NOUN_RE.search(question) or _PRODUCT_NOUN_RE.search(question)
+    )
+
+
+# Building profiles ----------------------------------------------------------
+
+class _Tally:
+    """Running aggregates for one customer or product"""
+
+    def __init__(self):
+        self.name = None
+        self.category = None
+        self.transactions = 0
+        self.units = 0
+        self.total = 0.0
+        self.first = None
+        self.last = None
+        self.categories = Counter()
+        self.products = Counter()
+        self.customers = Counter()
+        self.stores = Counter()
+
+    def add(self, txn, entity_type):
+        amount = float(txn.get("total_amount") or 0)
+        quantity = int(txn.get("quantity") or 0)
+        self.transactions += 1
+        self.units += quantity
+        self.total += amount
+        purchased = parse_date(txn.get("date_of_purchase"))
+        if purchased:
+            self.first = min(self.first or purchased, purchased)
+            self.last = max(self.last or purchased, purchased)
+        self.stores[txn.get("store_location") or "N/A"] += 1
+        if entity_type == "customer":
+            self.name = self.name or txn.get("customer_name")
+            self.categories[txn.get("category") or "N/A"] += amount
+            self.products[txn.get("product_name") or "Unknown"] += quantity
+        else:
+            self.name = self.name or txn.get("product_name")
+            self.category = self.category or txn.get("category")
+            self.customers[f"{txn.get('customer_name', 'Unknown')} ({txn.get('customer_id', 'N/A')})"] += amount
+
+
+def _frequency(tally):
+    if not tally.first:
+        return None
+    span_days = (tally.last - tally.first).days + 1
+    return round(tally.transactions / max(span_days / 30.0, 1.0), 2), span_days
+
+
+def _profile(entity_type, entity_id, tally):
+    """Profile document (metrics plus the text that gets embedded)"""
+    frequency = _frequency(tally)
+    profile = {
+        "entity_type": entity_type,
+        "entity_id": entity_id,
+        "name": tally.name or "Unknown",
+        "transactions": tally.transactions,
+        "units": tally.units,
+        "total_amount": round(tally.total, 2),
+        "first_purchase": tally.first.isoformat() if tally.first else None,
+        "last_purchase": tally.last.isoformat() if tally.last else None,
+        "purchases_per_month": frequency[0] if frequency else None,
+        "top_stores": tally.stores.most_common(TOP_N),
+    }
+    average = tally.total / tally.transactions if tally.transactions else 0.0
+
+    if entity_type == "customer":
+        profile["top_categories"] = [(c, round(v, 2)) for c, v in tally.categories.most_common(TOP_N)]
+        profile["top_products"] = tally.products.most_common(TOP_N)
+        lines = [
+            f"Customer Profile: {profile['name']} (ID: {entity_id})",
+            f"Transactions: {tally.transactions} | Units: {tally.units} | "
+            f"Total Spent: ${tally.total:,.2f} | Average Order: ${average:,.2f}",
+            "Top Categories: " + ", ".join(f"{c} (${v:,.2f})" for c, v in profile["top_categories"]),
+            "Most Purchased Products: " + ", ".join(f"{p} ({n} units)" for p, n in profile["top_products"]),
+        ]
+    else:
+        profile["category"] = tally.category or "N/A"
+        profile["customers"] = len(tally.customers)
+        profile["top_customers"] = [(c, round(v, 2)) for c, v in tally.customers.most_common(TOP_N)]
+        lines = [
+            f"Product Profile: {profile['name']} (ID: {entity_id})",
+            f"Category: {profile['category']}",
+            f"Transactions: {tally.transactions} | Units Sold: {tally.units} | "
+            f"Revenue: ${tally.total:,.2f} | Average Order: ${average:,.2f} | Customers: {len(tally.customers)}",
+            "Top Customers: " + ", ".join(f"{c} (${v:,.2f})" for c, v in profile["top_customers"]),
+        ]
+    lines.append("Stores: " + ", ".join(f"{s} ({n})" for s, n in profile["top_stores"]))
+    lines.append(f"First Purchase: {profile['first_purchase'] or 'N/A'} | "
+                 f"Last Purchase: {profile['last_purchase'] or 'N/A'}")
+    if frequency:
+        lines.append(f"Frequency: {frequency[0]} purchases per month over {frequency[1]} days")
+    profile["text"] = "\n".join(lines)
+    return profile
+
+
+def build_profiles(transactions, entity_types=tuple(ENTITY_FIELDS), entity_ids=None):
+    """Profiles for every entity in a stream of transactions
+
+    Args:
+        transactions: Iterable of transaction documents (PROFILE_PROJECTION fields)
+        entity_types: Which of "customer" / "product" to build
+        entity_ids: Optional {entity_type: set of ids}; other entities are skipped
+    """
+    tallies = {entity_type: {} for entity_type in entity_types}
+    for txn in transactions:
+        for entity_type in entity_types:
+            entity_id = txn.get(ENTITY_FIELDS[entity_type])
+            if not entity_id or (entity_ids is not None and entity_id not in entity_ids.get(entity_type, ())):
+                continue
+            tallies[entity_type].setdefault(entity_id, _Tally()).add(txn, entity_type)
+    return [
+        _profile(entity_type, entity_id, tally)
+        for entity_type, by_id in tallies.items()
+        for entity_id, tally in by_id.items()
+    ]
+
+
+def create_profile_indexes(collection):
+    collection.create_index([("entity_type", 1), ("entity_id", 1)], unique=True)
+
+
+def _save(profiles_collection, profiles):
+    if not profiles:
+        return
+    now = datetime.now()
+    with span("mongo.save_profiles"):
+        profiles_collection.bulk_write([
+            ReplaceOne(
+                {"entity_type": p["entity_type"], "entity_id": p["entity_id"]},
+                {**p, "updated_at": now},
+                upsert=True
+            )
+            for p in profiles
+        ], ordered=False)
+
+
+def rebuild_profiles(collections):
+    """Recompute every profile from the transactions collection"""
+    with span("profiles.rebuild"):
+        profiles = build_profiles(collections["transactions"].find({}, dict(PROFILE_PROJECTION)))
+    collections["profiles"].delete_many({})
+    _save(collections["profiles"], profiles)
+    logger.info("✓ Built %s customer/product profiles", len(profiles))
+    return profiles
+
+
+def refresh_profiles(collections, customer_ids=(), product_ids=(), cleared: bool = False):
+    """Recompute the profiles of entities that received new transactions
+
+    Only those entities' transactions are read back. With `cleared`, the
+    transactions were replaced, so every other profile is dropped.
+    Returns the refreshed profiles.
+    """
+    if not profile_index_enabled():
+        return []
+    profiles_collection = collections["profiles"]
+    if cleared:
+        profiles_collection.delete_many({})
+
+    refreshed = []
+    for entity_type, ids in (("customer", customer_ids), ("product", product_ids)):
+        ids = sorted(set(ids))
+        field = ENTITY_FIELDS[entity_type]
+        for start in range(0, len(ids), _LOOKUP_BATCH):
+            batch = ids[start:start + _LOOKUP_BATCH]
+            with span("profiles.refresh"):
+                cursor = collections["transactions"].find({field: {"$in": batch}}, dict(PROFILE_PROJECTION))
+                refreshed.extend(build_profiles(cursor, (entity_type,), {entity_type: set(batch)}))
+    _save(profiles_collection, refreshed)
+    logger.info("✓ Refreshed %s profiles", len(refreshed))
+
+    index = _indexes.get(profiles_collection.full_name)
+    if index is not None:
+        index.sync(refreshed, replace_all=cleared)
+    return refreshed
+
+
+# Vector index over profiles -------------------------------------------------
+
+class ProfileIndex:
+    """Flat FAISS index of profile texts, updated in place as profiles change"""
+
+    def __init__(self, embeddings):
+        from vector_index import embedding_model_id
+
+        self.embeddings = embeddings
+        self.model_id = embedding_model_id(embeddings)
+        self.vectorstore = None
+        self.profiles = {}
+        self._lock = threading.Lock()
+
+    def use_embeddings(self, embeddings):
+        """Embed with `embeddings` from now on; drops every vector if the model changed"""
+        from vector_index import embedding_model_id
+
+        model_id = embedding_model_id(embeddings)
+        with self._lock:
+            self.embeddings = embeddings
+            if model_id != self.model_id:
+                if self.profiles:
+                    logger.info("Embedding model changed from %s to %s - re-embedding %d profiles",
+                                self.model_id, model_id, len(self.profiles))
+                self.model_id = model_id
+                self.vectorstore = None
+                self.profiles = {}
+            elif self.vectorstore is not None:
+                self.vectorstore.embedding_function = embeddings
+
+    @staticmethod
+    def _doc_id(profile):
+        return f"{profile['entity_type']}:{profile['entity_id']}"
+
+    def __len__(self):
+        return len(self.profiles)
+
+    def sync(self, profiles, replace_all: bool = False):
+        """Re-embed profiles whose text changed; with `replace_all`, drop the rest
+
+        Returns the number of profiles embedded.
+        """
+        from langchain_community.vectorstores import FAISS
+
+        incoming = {self._doc_id(p): p for p in profiles}
+        with self._lock:
+            changed = [doc_id for doc_id, p in incoming.items()
+                       if self.profiles.get(doc_id, {}).get("text") != p["text"]]
+            stale = [doc_id for doc_id in self.profiles if doc_id not in incoming] if replace_all else []
+            if self.vectorstore is not None:
+                existing = [doc_id for doc_id in changed + stale if doc_id in self.profiles]
+                if existing:
+                    self.vectorstore.delete(existing)
+            for doc_id in stale:
+                del self.profiles[doc_id]
+            if not changed:
+                return 0
+
+            texts = [incoming[doc_id]["text"] for doc_id in changed]
+            metadatas = [{"entity_type": incoming[doc_id]["entity_type"],
+                          "entity_id": incoming[doc_id]["entity_id"]} for doc_id in changed]
+            with span("index.embed_profiles"):
+                if self.vectorstore is None:
+                    self.vectorstore = FAISS.from_texts(texts, self.embeddings, metadatas=metadatas, ids=changed)
+                else:
+                    self.vectorstore.add_texts(texts, metadatas=metadatas, ids=changed)
+            for doc_id in changed:
+                self.profiles[doc_id] = incoming[doc_id]
+        logger.info("✓ Embedded %s profiles (%s indexed)", len(changed), len(self.profiles))
+        return len(changed)
+
+    def _document(self, doc_id):
+        return self.vectorstore.docstore.search(doc_id)
+
+    def _ranked(self, entity_type, k):
+        """Profiles of `entity_type` with the highest total amount"""
+        ranked = sorted(
+            (p for p in self.profiles.values() if p["entity_type"] == entity_type),
+            key=lambda p: p["total_amount"], reverse=True
+        )
+        return [self._document(self._doc_id(p)) for p in ranked[:k]]
+
+    def search(self, question, k: int = 4):
+        """Profile documents for `question`
+
+        Customers named by ID or products named in full are looked up
+        directly, "biggest customers"/"top products" questions rank profiles
+        by total amount, and anything else is a similarity search.
+        """
+        with self._lock:
+            if self.vectorstore is None:
+                return []
+            lowered = question.lower()
+            named = [f"customer:{m.upper()}" for m in _CUSTOMER_ID_RE.findall(question)]
+            named += [doc_id for doc_id, p in self.profiles.items()
+                      if p["entity_type"] == "product" and p["name"].lower() in lowered]
+            named = [doc_id for doc_id in dict.fromkeys(named) if doc_id in self.profiles]
+            if named:
+                return [self._document(doc_id) for doc_id in named[:k]]
+
+            if _RANKING_RE.search(question):
+                if _CUSTOMER_NOUN_RE.search(question):
+                    return self._ranked("customer", k)
+                if _PRODUCT_NOUN_RE.search(question):
+                    return self._ranked("product", k)
+
+            with span("retrieval.profile_search"):
+                return self.vectorstore.similarity_search(question, k=k)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_profile_index(profiles_collection, transactions_collection, embeddings):
+    """Process-wide profile index for this database, synced with the stored profiles
+
+    Profiles are built from the transactions the first time the collection
+    is empty; later calls only re-embed profiles that changed since, unless
+    `embeddings` is a different model than the index was built with.
+    Returns None if disabled.
+    """
+    if not profile_index_enabled():
+        return None
+    with _indexes_lock:
+        index = _indexes.get(profiles_collection.full_name)
+        if index is None:
+            index = _indexes[profiles_collection.full_name] = ProfileIndex(embeddings)
+        index.use_embeddings(embeddings)
+
+    profiles = list(profiles_collection.find({}, {"_id": 0, "updated_at": 0}))
+    if not profiles:
+        profiles = rebuild_profiles({"profiles": profiles_collection, "transactions": transactions_collection})
+    index.sync(profiles, replace_all=True)
+    return index
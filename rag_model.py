@@ -1,46 +1,10 @@
+import os
 import streamlit as st
-from langchain_google_genai import GoogleGenerativeAIEmbeddings, ChatGoogleGenerativeAI
-from langchain_community.vectorstores import FAISS
-from langchain.chains import ConversationalRetrievalChain
-from langchain_core.prompts import PromptTemplate
-from utils import mongodb_to_searchable_text
+from utils import iter_document_batches
+from tracing import span
 from intent_classifier import EmbeddingIntentClassifier
 
-def build_rag_model(api_key, transactions_collection):
-    """Build RAG model with embeddings and retrieval chain"""
-    
-    try:
-        with st.spinner("🔄 Building embeddings..."):
-            # Convert MongoDB transactions to searchable text
-            chunks = mongodb_to_searchable_text(transactions_collection)
-            
-            if not chunks:
-                raise ValueError("No chunks generated from transactions")
-            
-            # Initialize embeddings
-            embeddings = GoogleGenerativeAIEmbeddings(
-                model="models/text-embedding-004",
-                google_api_key=api_key
-            )
-            
-            # Build FAISS vector store
-            vectorstore = FAISS.from_texts(chunks, embeddings)
-            retriever = vectorstore.as_retriever(
-                search_kwargs={"k": 5}  # Retrieve top 5 documents
-            )
-            
-            # Initialize LLM
-            llm = ChatGoogleGenerativeAI(
-                model="gemini-2.5-flash",
-                temperature=0.3,
-                max_output_tokens=1500,
-                google_api_key=api_key
-            )
-            
-            # Define QA prompt
-            qa_prompt = PromptTemplate(
-                input_variables=["context", "question"],
-                template="""You are a helpful e-commerce customer service assistant. 
+QA_PROMPT_TEMPLATE = """You are a helpful e-commerce customer service assistant. 
 Use the provided transaction data to answer questions accurately.
 
 Context (Transaction Data):
@@ -56,19 +20,132 @@ Instructions:
 - Include specific transaction details when relevant
 
 Answer:"""
-            )
-            
-            # Build conversational retrieval chain
-            qa_chain = ConversationalRetrievalChain.from_llm(
-                llm=llm,
-                retriever=retriever,
-                return_source_documents=True,
-                combine_docs_chain_kwargs={"prompt": qa_prompt},
-                verbose=False
-            )
-            
-            # Initialize intent classifier
-            intent_classifier = EmbeddingIntentClassifier(embeddings)
+
+def create_google_backends(api_key):
+    """Create the Gemini embedding model and chat LLM"""
+    
+    # Heavy dependencies are imported here rather than at module load so the
+    # upload screen renders without them (see startup.start_warmup)
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings, ChatGoogleGenerativeAI
+    
+    embeddings = GoogleGenerativeAIEmbeddings(
+        model="models/text-embedding-004",
+        google_api_key=api_key
+    )
+    
+    llm = ChatGoogleGenerativeAI(
+        model="gemini-2.5-flash",
+        temperature=0.3,
+        max_output_tokens=1500,
+        google_api_key=api_key
+    )
+    
+    return embeddings, llm
+
+def build_qa_chain(retriever, llm):
+    """Build the conversational retrieval chain over `retriever`"""
+    from langchain.chains import ConversationalRetrievalChain
+    from langchain_core.prompts import PromptTemplate
+    
+    # Define QA prompt
+    qa_prompt = PromptTemplate(
+        input_variables=["context", "question"],
+        template=QA_PROMPT_TEMPLATE
+    )
+    
+    # Build conversational retrieval chain
+    return ConversationalRetrievalChain.from_llm(
+        llm=llm,
+        retriever=retriever,
+        return_source_documents=True,
+        combine_docs_chain_kwargs={"prompt": qa_prompt},
+        verbose=False
+    )
+
+def build_models(transactions_collection, embeddings, llm, index_config=None,
+                 limit: int = None, workers: int = None):
+    """Build (qa_chain, llm, intent_classifier) from any embedding/LLM backends
+    
+    UI-independent so the API service and benchmarks can build with stub
+    backends; build_rag_model wraps it for Streamlit. `index_config` picks the
+    FAISS index type (default: vector_index.IndexConfig.from_env(), flat).
+    `limit` (INDEX_DOCUMENT_LIMIT, default 200, 0 for all) caps the indexed
+    transactions and `workers` (INDEX_EXPORT_WORKERS) reads `_id` ranges in
+    parallel. RETRIEVAL_K / RETRIEVAL_FETCH_K set the documents passed to
+    the prompt and the candidates re-ranked (see benchmarks.retrieval_sweep).
+    """
+    from vector_index import build_vectorstore, embed_document_batches
+    from metadata_index import MetadataIndex
+    from retrievers import FilteredRetriever, ShardedRetriever
+    from shard_index import ShardedIndex
+    from profiles import get_profile_index
+    from gateway import wrap_embeddings, wrap_llm
+    
+    # Every model call goes through the gateway (dedup, fair rate limiting)
+    embeddings, llm = wrap_embeddings(embeddings), wrap_llm(llm)
+    
+    if limit is None:
+        limit = int(os.getenv("INDEX_DOCUMENT_LIMIT", "200"))
+    if workers is None:
+        workers = int(os.getenv("INDEX_EXPORT_WORKERS", "1"))
+    k = int(os.getenv("RETRIEVAL_K", "4"))
+    fetch_k = int(os.getenv("RETRIEVAL_FETCH_K", "20"))
+    
+    batches = iter_document_batches(transactions_collection, limit=limit, workers=workers)
+    
+    # Customer/product profiles live in their own index, re-embedded only where they changed
+    with span("index.profiles"):
+        profile_index = get_profile_index(
+            transactions_collection.database["profiles"], transactions_collection, embeddings
+        )
+    
+    if os.getenv("VECTOR_SHARD_KEY"):
+        # Partitioned index: only shards whose transactions changed are re-embedded
+        texts, metadatas = [], []
+        for batch_texts, batch_metadatas in batches:
+            texts.extend(batch_texts)
+            metadatas.extend(batch_metadatas)
+        if not texts:
+            raise ValueError("No documents generated from transactions")
+        
+        sharded_index = ShardedIndex.from_env(embeddings, index_config)
+        sharded_index.sync(texts, metadatas)
+        retriever = ShardedRetriever(
+            sharded_index=sharded_index, profile_index=profile_index, k=k, fetch_k=fetch_k
+        )
+    else:
+        # One document per transaction so each vector carries filterable metadata;
+        # batches are embedded as they stream out of Mongo
+        with span("index.export_and_embed"):
+            texts, metadatas, vectors = embed_document_batches(batches, embeddings)
+        
+        if not texts:
+            raise ValueError("No documents generated from transactions")
+        
+        # Build FAISS vector store on the configured index type
+        vectorstore = build_vectorstore(texts, embeddings, index_config, metadatas=metadatas, vectors=vectors)
+        retriever = FilteredRetriever(
+            vectorstore=vectorstore,
+            metadata_index=MetadataIndex(metadatas),
+            profile_index=profile_index,
+            k=k,  # Documents passed to the prompt
+            fetch_k=fetch_k  # Candidates re-ranked locally (lexical + MMR) down to k
+        )
+    
+    qa_chain = build_qa_chain(retriever, llm)
+    
+    # Initialize intent classifier
+    intent_classifier = EmbeddingIntentClassifier(embeddings)
+    
+    return qa_chain, llm, intent_classifier
+
+def build_rag_model(api_key, transactions_collection):
+    """Build RAG model with embeddings and retrieval chain"""
+    
+    try:
+        with st.spinner("🔄 Building embeddings..."):
+            embeddings, llm = create_google_backends(api_key)
+            qa_chain, llm, intent_classifier = build_models(transactions_collection, embeddings, llm)
             
             st.success("✅ Models loaded successfully")
             
@@ -77,6 +154,3 @@ Answer:"""
     except Exception as e:
         st.error(f"Error building RAG model: {str(e)}")
         raise
-
-
-
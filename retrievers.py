@@ -0,0 +1,263 @@
+"""Retrievers used by the QA chain in place of the plain FAISS retriever"""
+import logging
+import re
+from typing import Any, List
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from metadata_index import extract_filters
+from profiles import is_profile_question
+from speculation import prefetched_documents
+from tracing import span
+from vector_index import selector_search_params
+
+logger = logging.getLogger(__name__)
+
+# Candidate sets up to this size are scored exactly from reconstructed vectors
+EXACT_SCORING_LIMIT = 4096
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_][a-z0-9]+)*")
+_STOPWORDS = frozenset(
+    "a an and are at by did do for from how i in is it me my of on or show the to was what "
+    "when where which who with".split()
+)
+
+
+def _documents_for_ids(vectorstore, ids):
+    docs = []
+    for faiss_id in ids:
+        if faiss_id < 0:
+            continue
+        doc = vectorstore.docstore.search(vectorstore.index_to_docstore_id[int(faiss_id)])
+        if isinstance(doc, Document):
+            docs.append(doc)
+    return docs
+
+
+def _query_terms(text):
+    return {t for t in _TOKEN_RE.findall(text.lower()) if t not in _STOPWORDS and len(t) > 1}
+
+
+def lexical_scores(query, docs):
+    """Fraction of the query's content terms that appear in each document"""
+    terms = _query_terms(query)
+    if not terms:
+        return np.zeros(len(docs), dtype=np.float32)
+    return np.array(
+        [len(terms & set(_TOKEN_RE.findall(doc.page_content.lower()))) / len(terms) for doc in docs],
+        dtype=np.float32
+    )
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def mmr_select(query_vector, vectors, relevance, k, lambda_mult=0.6):
+    """Maximal marginal relevance: indices of k candidates balancing relevance and novelty
+
+    `relevance` is the per-candidate score to maximise; novelty is the cosine
+    distance to the candidates already picked, so near-duplicate
+    transactions don't fill the context.
+    """
+    vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+    similarity = vectors @ vectors.T
+    selected = [int(np.argmax(relevance))]
+    redundancy = similarity[selected[0]].copy()
+    while len(selected) < min(k, len(vectors)):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[selected] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        redundancy = np.maximum(redundancy, similarity[best])
+    return selected
+
+
+def rerank(query, query_vector, docs, vectors, k, lambda_mult=0.6, lexical_weight=0.3):
+    """Re-score over-fetched candidates locally and keep the best k diverse ones
+
+    Relevance blends cosine similarity to the query with lexical overlap
+    (exact invoice numbers, product names and ids that embeddings blur);
+    MMR then picks the final documents.
+    """
+    if len(docs) <= 1:
+        return docs[:k]
+    query_vector = _normalize(np.asarray(query_vector, dtype=np.float32))
+    cosine = _normalize(np.asarray(vectors, dtype=np.float32)) @ query_vector
+    relevance = (1 - lexical_weight) * cosine + lexical_weight * lexical_scores(query, docs)
+    return [docs[i] for i in mmr_select(query_vector, vectors, relevance, k, lambda_mult)]
+
+
+def search_candidates(vectorstore, query_vector, candidate_ids, k):
+    """Top-k over a subset of vector positions, without scanning the whole index
+
+    Small candidate sets are scored exactly from reconstructed vectors; larger
+    ones go through a FAISS IDSelector so only selected ids are compared.
+    Returns (ids, distances).
+    """
+    import faiss
+
+    index = vectorstore.index
+    query = np.asarray(query_vector, dtype=np.float32).reshape(1, -1)
+    k = min(k, len(candidate_ids))
+
+    if len(candidate_ids) <= EXACT_SCORING_LIMIT:
+        try:
+            vectors = index.reconstruct_batch(candidate_ids)
+            distances = ((vectors - query) ** 2).sum(axis=1)
+            order = np.argsort(distances)[:k]
+            return candidate_ids[order], distances[order]
+        except RuntimeError:
+            # e.g. IVF without a direct map - fall through to the selector
+            pass
+
+    selector = faiss.IDSelectorBatch(candidate_ids)
+    params = selector_search_params(index, selector, k)
+    distances, ids = index.search(query, k, params=params)
+    return ids[0], distances[0]
+
+
+def _profile_documents(profile_index, query, k):
+    """Customer/product profiles for aggregate-level questions ([] for other questions)"""
+    if profile_index is None or not is_profile_question(query):
+        return []
+    with span("retrieval.profiles"):
+        return profile_index.search(query, k)
+
+
+def merge_profiles(profiles, docs, k):
+    """Up to half of the k slots (at least one) for profiles, the rest for transaction hits
+
+    Unused slots on either side go to the other, so the prompt still gets k
+    documents when one source comes up short.
+    """
+    if not profiles:
+        return docs[:k]
+    n = max(1, k // 2)
+    merged = profiles[:n] + docs[:k - min(n, len(profiles))]
+    return merged + profiles[n:k - len(merged) + n]
+
+
+class FilteredRetriever(BaseRetriever):
+    """Similarity search restricted to transactions matching filters found in the question
+
+    Filters (category, store, channel, customer, date range) are extracted
+    against the metadata index vocabulary; matching vector positions are
+    pre-selected there and only those are searched. Questions without
+    filters, or whose filters match nothing, search the whole index.
+
+    `fetch_k` candidates are over-fetched and re-ranked locally (lexical
+    overlap plus MMR over the indexed vectors) down to `k` documents for
+    the prompt; set `fetch_k` <= `k` to disable re-ranking.
+
+    Questions about overall behaviour ("biggest customers", "what does
+    CUST000042 buy most") also get matching profiles from `profile_index`
+    (profiles.ProfileIndex) when one is given, ahead of the transaction hits.
+    """
+
+    vectorstore: Any
+    metadata_index: Any
+    profile_index: Any = None
+    k: int = 4
+    fetch_k: int = 20
+    lambda_mult: float = 0.6
+    lexical_weight: float = 0.3
+
+    def _search(self, query_vector, candidate_ids, fetch_k):
+        if candidate_ids is not None:
+            with span("retrieval.filtered_search"):
+                return search_candidates(self.vectorstore, query_vector, candidate_ids, fetch_k)[0]
+        query = np.asarray(query_vector, dtype=np.float32).reshape(1, -1)
+        _, ids = self.vectorstore.index.search(query, min(fetch_k, self.vectorstore.index.ntotal))
+        return ids[0]
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        prefetched = prefetched_documents(query)
+        if prefetched is not None:
+            return prefetched
+        profiles = _profile_documents(self.profile_index, query, self.k)
+        return merge_profiles(profiles, self._transaction_documents(query), self.k)
+
+    def _transaction_documents(self, query):
+        candidate_ids = None
+        filters = extract_filters(query, self.metadata_index.vocabulary())
+        if filters:
+            with span("retrieval.filter"):
+                candidate_ids = self.metadata_index.candidate_ids(filters)
+            logger.info(
+                "Retrieval filters %s matched %s documents",
+                filters, 0 if candidate_ids is None else len(candidate_ids)
+            )
+            if candidate_ids is not None and not len(candidate_ids):
+                candidate_ids = None
+
+        query_vector = self.vectorstore.embedding_function.embed_query(query)
+        ids = [int(i) for i in self._search(query_vector, candidate_ids, max(self.k, self.fetch_k)) if i >= 0]
+        if len(ids) <= self.k:
+            return _documents_for_ids(self.vectorstore, ids)
+
+        with span("retrieval.rerank"):
+            try:
+                vectors = self.vectorstore.index.reconstruct_batch(np.asarray(ids, dtype=np.int64))
+            except RuntimeError:
+                # Index can't reconstruct vectors - keep the similarity order
+                return _documents_for_ids(self.vectorstore, ids[:self.k])
+            docs = _documents_for_ids(self.vectorstore, ids)
+            if len(docs) != len(ids):
+                return docs[:self.k]
+            return rerank(query, query_vector, docs, vectors, self.k, self.lambda_mult, self.lexical_weight)
+
+
+class ShardedRetriever(BaseRetriever):
+    """FilteredRetriever over a shard_index.ShardedIndex
+
+    Filters found in the question choose which shards are searched (date
+    range, partition field) and pre-select documents within them; the
+    merged candidates are re-ranked the same way.
+    """
+
+    sharded_index: Any
+    profile_index: Any = None
+    k: int = 4
+    fetch_k: int = 20
+    lambda_mult: float = 0.6
+    lexical_weight: float = 0.3
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        prefetched = prefetched_documents(query)
+        if prefetched is not None:
+            return prefetched
+        profiles = _profile_documents(self.profile_index, query, self.k)
+        return merge_profiles(profiles, self._transaction_documents(query), self.k)
+
+    def close(self):
+        """Shut down the shard search pool (see model_registry.release_models)"""
+        self.sharded_index.close()
+
+    def _transaction_documents(self, query):
+        filters = extract_filters(query, self.sharded_index.vocabulary())
+        if filters:
+            logger.info("Retrieval filters %s", filters)
+        query_vector = self.sharded_index.embeddings.embed_query(query)
+
+        with span("retrieval.shard_search"):
+            hits = self.sharded_index.search(query_vector, filters, max(self.k, self.fetch_k))
+        if not hits and filters:
+            # Filters matched nothing - search every shard unfiltered
+            with span("retrieval.shard_search"):
+                hits = self.sharded_index.search(query_vector, None, max(self.k, self.fetch_k))
+
+        docs = [doc for _, doc, _ in hits]
+        if len(docs) <= self.k or any(vector is None for _, _, vector in hits):
+            return docs[:self.k]
+        with span("retrieval.rerank"):
+            vectors = np.vstack([vector for _, _, vector in hits])
+            return rerank(query, query_vector, docs, vectors, self.k, self.lambda_mult, self.lexical_weight)
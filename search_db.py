@@ -1,37 +1,35 @@
 import streamlit as st
+from chat_service import run_aggregate, run_search_db
+from tracing import span
 
-def handle_search_db(question, qa_chain, chat_history):
-    """Handle database search using RAG chain for both products and customers"""
+def handle_search_db(question, qa_chain, chat_history, collections=None, speculation=None):
+    """Handle database search using RAG chain for both products and customers
+    
+    Aggregate questions ("top 5 products last month", "total sales in
+    Chennai") are answered from the columnar store when it is loaded.
+    `speculation` holds documents retrieved while the intent was classified.
+    """
     
     try:
-        # Prepare chat history in the required format
-        formatted_history = []
-        for item in chat_history[-5:]:  # Use last 5 exchanges for context
-            if isinstance(item, dict):
-                formatted_history.append((item.get("user", ""), item.get("bot", "")))
-        
-        # Invoke RAG chain
-        result = qa_chain.invoke({
-            "question": question,
-            "chat_history": formatted_history
-        })
-        
-        # Extract answer
-        answer = result.get("answer", "No data found").strip()
+        result = run_aggregate(question, collections)
+        if result is None:
+            result = run_search_db(question, qa_chain, chat_history, collections, speculation)
+        elif speculation is not None:
+            speculation.discard("aggregate")
         
         # Display source documents
-        source_docs = result.get("source_documents", [])
+        source_docs = result["sources"]
         if source_docs:
-            with st.expander("📚 Source Documents", expanded=False):
-                for i, doc in enumerate(source_docs, 1):
-                    content = doc.page_content[:400]
+            with span("render.sources"), st.expander("📚 Source Documents", expanded=False):
+                for i, page_content in enumerate(source_docs, 1):
+                    content = page_content[:400]
                     st.write(f"**Document {i}:**")
                     st.text(content)
-                    if len(doc.page_content) > 400:
+                    if len(page_content) > 400:
                         st.caption("... (truncated)")
                     st.divider()
         
-        return answer
+        return result["answer"]
     
     except Exception as e:
         error_msg = f"Error during search: {str(e)}"
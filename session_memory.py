@@ -0,0 +1,382 @@
+"""Retained-memory accounting per session and per model object
+
+Every Streamlit session holds its chat history and a reference to the
+ModelSet it attached to. The current set is shared by all sessions, but a
+session that has not run since a newer set was published still pins the
+old one (its FAISS index, docstore, metadata index and classifier
+centroids). `SessionTracker` keeps a handle on each session's state and
+periodically measures:
+
+    sessions    chat history size and the stale model set it pins
+    models      per-component size of each live model set
+    shared      process-wide caches registered with register_shared()
+
+Sizes come from a deep size estimator (numpy buffers counted once, FAISS
+indexes via vector_index.resident_index_bytes, memory maps not counted),
+so they are estimates of retained memory, not RSS. Set MEMORY_TRACEMALLOC
+to a frame count to also report the top allocation sites.
+
+With SESSION_MEMORY_BUDGET_MB set, sessions idle for SESSION_IDLE_SECONDS
+are evicted, largest first, until the estimate is back under the budget;
+the session's `evict(state)` callback drops its heavy objects, which are
+reloaded on its next run. SESSION_MEMORY_CHECK_SECONDS throttles checks.
+
+The tracker itself only holds sessions that ran recently: a session not
+seen for SESSION_FORGET_SECONDS (default 4x SESSION_IDLE_SECONDS) is
+dropped on the next check whether or not a budget is set, so closed tabs
+don't keep their history or an old model set alive through it.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import types
+import weakref
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+MAX_OBJECTS = 1_000_000
+MODEL_FOOTPRINT_TTL = 300
+
+# Clients, connections and locks are not retained data - don't walk into them
+_SKIP_MODULES = (
+    "pymongo", "google", "grpc", "httpx", "requests", "urllib3", "ssl", "socket",
+    "threading", "_thread", "concurrent", "logging", "streamlit", "tiktoken",
+)
+_SKIP_TYPES = (
+    type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType,
+    types.CodeType, types.FrameType, weakref.ref,
+)
+
+
+def _is_faiss_index(obj):
+    return type(obj).__module__.startswith("faiss") and hasattr(obj, "ntotal")
+
+
+def estimate_size(obj, seen=None, max_objects: int = MAX_OBJECTS) -> int:
+    """Deep size estimate of `obj` in bytes, skipping ids already in `seen`
+
+    Pass the same `seen` set across calls to count shared objects once.
+    Stops after `max_objects` objects (the result is then a lower bound).
+    """
+    from vector_index import resident_index_bytes
+
+    seen = set() if seen is None else seen
+    total, visited = 0, 0
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if o is None or id(o) in seen or isinstance(o, _SKIP_TYPES):
+            continue
+        seen.add(id(o))
+        visited += 1
+        if visited > max_objects:
+            logger.debug("Size estimate stopped after %s objects", max_objects)
+            break
+        if type(o).__module__.startswith(_SKIP_MODULES):
+            continue
+        if _is_faiss_index(o):
+            total += resident_index_bytes(o)
+            continue
+        try:
+            total += sys.getsizeof(o)
+        except TypeError:
+            continue
+        if isinstance(o, np.ndarray):
+            # getsizeof covers owned buffers; views count their base once
+            if isinstance(o.base, np.ndarray):
+                stack.append(o.base)
+        elif isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            stack.extend(o)
+        elif not isinstance(o, (str, bytes, int, float, bool)):
+            if hasattr(o, "__dict__"):
+                stack.append(o.__dict__)
+            for slot in getattr(type(o), "__slots__", ()):
+                stack.append(getattr(o, slot, None))
+    return total
+
+
+def _model_components(model_set):
+    """(name, object) pairs of a ModelSet, most specific first"""
+    retriever = getattr(model_set.qa_chain, "retriever", None)
+    vectorstore = getattr(retriever, "vectorstore", None)
+    return [
+        ("vector_index", getattr(vectorstore, "index", None)),
+        ("docstore", getattr(vectorstore, "docstore", None)),
+        ("metadata_index", getattr(retriever, "metadata_index", None)),
+        ("sharded_index", getattr(retriever, "sharded_index", None)),
+        ("profile_index", getattr(retriever, "profile_index", None)),
+        ("intent_classifier", model_set.intent_classifier),
+        # Whatever the chain holds beyond the parts above
+        ("qa_chain", model_set.qa_chain),
+    ]
+
+
+_footprints = {}
+_footprints_lock = threading.Lock()
+
+
+def model_footprint(model_set) -> dict:
+    """{component: bytes} for one ModelSet, cached per version for MODEL_FOOTPRINT_TTL"""
+    with _footprints_lock:
+        cached = _footprints.get(model_set.version)
+        if cached and cached[0] == id(model_set) and time.monotonic() - cached[1] < MODEL_FOOTPRINT_TTL:
+            return cached[2]
+
+    seen = set()
+    footprint = {}
+    for name, component in _model_components(model_set):
+        if component is not None:
+            footprint[name] = estimate_size(component, seen)
+    with _footprints_lock:
+        # Keyed by id, not the set itself, so the cache never keeps an evicted set alive
+        _footprints[model_set.version] = (id(model_set), time.monotonic(), footprint)
+    return footprint
+
+
+def _unshared_bytes(model_set, other):
+    """Bytes of `model_set` components that `other` doesn't also hold (e.g. the profile index)"""
+    footprint = model_footprint(model_set)
+    shared = {id(c) for _, c in _model_components(other)} if other is not None else set()
+    return sum(
+        footprint.get(name, 0) for name, component in _model_components(model_set)
+        if component is not None and id(component) not in shared
+    )
+
+
+def process_rss_bytes():
+    """Resident set size of this process, or None where /proc is unavailable"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def start_tracemalloc():
+    """Start tracemalloc when MEMORY_TRACEMALLOC is set (its value is the frame depth)"""
+    frames = os.getenv("MEMORY_TRACEMALLOC")
+    if frames and not tracemalloc.is_tracing():
+        tracemalloc.start(int(frames) if frames.isdigit() else 1)
+        logger.info("✓ tracemalloc started (%s frames)", tracemalloc.get_traceback_limit())
+
+
+def tracemalloc_top(limit: int = 10) -> list:
+    """Largest allocation sites by retained size, [] when tracemalloc is off"""
+    if not tracemalloc.is_tracing():
+        return []
+    snapshot = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    ])
+    return [
+        {"site": str(stat.traceback[0]), "mb": round(stat.size / MB, 3), "blocks": stat.count}
+        for stat in snapshot.statistics("lineno")[:limit]
+    ]
+
+
+def _budget_mb():
+    return float(os.getenv("SESSION_MEMORY_BUDGET_MB", "0"))
+
+
+class _Session:
+    def __init__(self, state, evict):
+        self.state = state
+        self.evict = evict
+        self.last_seen = time.monotonic()
+        self.evictions = 0
+        self.evicted = False
+
+
+class SessionTracker:
+    """Measures retained memory per session and evicts idle sessions over budget
+
+    `state` is any mapping-like object that stays valid between the
+    session's runs (Streamlit's per-session state); it must support `in`,
+    item access and assignment from another thread.
+    """
+
+    def __init__(self, idle_seconds: float = None, check_interval: float = None,
+                 forget_seconds: float = None):
+        self.idle_seconds = idle_seconds if idle_seconds is not None else \
+            float(os.getenv("SESSION_IDLE_SECONDS", "900"))
+        self.forget_seconds = forget_seconds if forget_seconds is not None else \
+            float(os.getenv("SESSION_FORGET_SECONDS", str(4 * self.idle_seconds)))
+        self.check_interval = check_interval if check_interval is not None else \
+            float(os.getenv("SESSION_MEMORY_CHECK_SECONDS", "60"))
+        self._sessions = {}
+        self._shared = {}
+        self._lock = threading.Lock()
+        self._last_check = 0.0
+
+    def touch(self, session_id, state, evict):
+        """Record that a session ran; `evict(state)` drops its heavy objects"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                self._sessions[session_id] = _Session(state, evict)
+            else:
+                session.state, session.evict = state, evict
+                session.last_seen = time.monotonic()
+                session.evicted = False
+
+    def forget(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def prune(self) -> int:
+        """Drop sessions not seen for `forget_seconds`; returns how many were dropped"""
+        cutoff = time.monotonic() - self.forget_seconds
+        with self._lock:
+            stale = [sid for sid, s in self._sessions.items() if s.last_seen < cutoff]
+            for session_id in stale:
+                del self._sessions[session_id]
+        if stale:
+            logger.info("✓ Forgot %s sessions idle for over %ss", len(stale), round(self.forget_seconds))
+        return len(stale)
+
+    def register_shared(self, name, getter):
+        """Include a process-wide object (returned by `getter()`, may be None) in reports"""
+        self._shared[name] = getter
+
+    def _session_row(self, session_id, session, current, now):
+        state = session.state
+        history = state["chat_history"] if "chat_history" in state else []
+        model_set = state["model_set"] if "model_set" in state else None
+        return {
+            "session": session_id,
+            "idle_s": round(now - session.last_seen),
+            "turns": len(history),
+            "history_mb": round(estimate_size(history) / MB, 3),
+            "model_version": model_set.version if model_set is not None else None,
+            "stale_model": model_set is not None and model_set is not current,
+            "evictions": session.evictions,
+            "_model_set": model_set,
+        }
+
+    def measure(self) -> dict:
+        """Per-session, per-model and shared retained memory (MB), largest sessions first"""
+        from model_registry import model_registry
+
+        current = model_registry.current()
+        now = time.monotonic()
+        with self._lock:
+            sessions = list(self._sessions.items())
+        rows = [self._session_row(session_id, s, current, now) for session_id, s in sessions]
+
+        model_sets = {id(current): current} if current is not None else {}
+        for row in rows:
+            model_set = row.pop("_model_set")
+            if model_set is not None:
+                model_sets.setdefault(id(model_set), model_set)
+            pinned = _unshared_bytes(model_set, current) if row["stale_model"] else 0
+            row["pinned_model_mb"] = round(pinned / MB, 3)
+            row["retained_mb"] = round(row["history_mb"] + row["pinned_model_mb"], 3)
+        rows.sort(key=lambda r: r["retained_mb"], reverse=True)
+
+        models, counted = [], set()
+        for model_set in model_sets.values():
+            footprint = model_footprint(model_set)
+            for component, obj in _model_components(model_set):
+                # Components shared between sets are listed under the first one
+                if component not in footprint or id(obj) in counted:
+                    continue
+                counted.add(id(obj))
+                size = footprint[component]
+                models.append({
+                    "version": model_set.version,
+                    "current": model_set is current,
+                    "component": component,
+                    "mb": round(size / MB, 3),
+                })
+
+        with _footprints_lock:
+            live = {model_set.version for model_set in model_sets.values()}
+            for version in set(_footprints) - live:
+                del _footprints[version]
+
+        shared = []
+        for name, getter in list(self._shared.items()):
+            try:
+                obj = getter()
+            except Exception as e:
+                logger.debug("Shared object %s unavailable: %s", name, e)
+                continue
+            if obj is not None:
+                shared.append({"name": name, "mb": round(estimate_size(obj) / MB, 3)})
+
+        rss = process_rss_bytes()
+        return {
+            "retained_mb": round(
+                sum(r["history_mb"] for r in rows) + sum(m["mb"] for m in models) + sum(s["mb"] for s in shared), 3
+            ),
+            "budget_mb": _budget_mb() or None,
+            "rss_mb": round(rss / MB, 1) if rss is not None else None,
+            "sessions": rows,
+            "models": models,
+            "shared": shared,
+            "allocations": tracemalloc_top(),
+        }
+
+    def enforce_budget(self, force: bool = False):
+        """Forget long-gone sessions, then measure, log and evict idle sessions while over budget
+
+        Runs at most every `check_interval` seconds unless `force`. Returns
+        the report, or None when skipped.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._last_check < self.check_interval:
+                return None
+            self._last_check = now
+
+        self.prune()
+        report = self.measure()
+        budget = report["budget_mb"]
+        logger.info(
+            "Session memory: %s sessions, %.1f MB retained (budget %s, RSS %s MB)",
+            len(report["sessions"]), report["retained_mb"],
+            f"{budget:.0f} MB" if budget else "off", report["rss_mb"]
+        )
+        for row in report["sessions"][:5]:
+            logger.debug("  session %s: %s", row["session"], row)
+        for row in report["allocations"][:5]:
+            logger.debug("  allocated %.3f MB at %s", row["mb"], row["site"])
+
+        if not budget or report["retained_mb"] <= budget:
+            return report
+        logger.warning("Session memory over budget: %.1f MB > %.0f MB", report["retained_mb"], budget)
+
+        for row in report["sessions"]:
+            if row["idle_s"] < self.idle_seconds or not row["retained_mb"]:
+                continue
+            with self._lock:
+                session = self._sessions.get(row["session"])
+            if session is None or session.evicted:
+                continue
+            try:
+                session.evict(session.state)
+            except Exception as e:
+                logger.warning("Could not evict session %s: %s", row["session"], e)
+                continue
+            session.evicted = True
+            session.evictions += 1
+            logger.info(
+                "✓ Evicted idle session %s (%.1f MB, idle %ss)", row["session"], row["retained_mb"], row["idle_s"]
+            )
+            report = self.measure()
+            if report["retained_mb"] <= budget:
+                break
+        return report
+
+
+session_tracker = SessionTracker()
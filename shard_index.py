@@ -0,0 +1,401 @@
+"""Vector index partitioned into independently built and persisted shards
+
+Transactions are grouped by a partition key - the purchase month
+("month") or a metadata field such as "store_location" - and each group
+gets its own FAISS vector store saved under `directory`:
+
+    vector_shards/
+        manifest.json                  key, per-shard counts/date bounds/fingerprints
+        2024-03-1f2e3d4c5b/            FAISS.save_local output for one shard
+        ...
+
+Rebuilding after an upload only re-embeds shards whose transactions
+changed (compared by content fingerprint); the rest are reused from disk.
+The manifest records the embedding model and the index build settings;
+if either differs from the current ones every shard is rebuilt, since
+stored vectors from another model or index layout can't be searched.
+Replaced shard directories are retired rather than deleted: a model set
+built earlier may still load them lazily, so they are only removed by a
+sync at least VECTOR_SHARD_RETIRE_SECONDS (default 3600) later.
+Searches fan out over the relevant shards on a thread pool and merge the
+per-shard top-k. Questions scoped to a date range or to the partition
+field only touch matching shards, and shards can be unloaded from memory
+(explicitly or beyond `max_loaded`) and are reloaded from disk on demand.
+
+Enable with VECTOR_SHARD_KEY=month (or store_location, category, channel);
+VECTOR_SHARD_DIR, VECTOR_SHARD_WORKERS and VECTOR_SHARD_MAX_LOADED tune it.
+close() shuts the search pool down once the index has been replaced.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from metadata_index import CATEGORICAL_FIELDS, MetadataIndex, parse_date
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+PARTITION_KEYS = ("month", "store_location", "category", "channel")
+MANIFEST_FILE = "manifest.json"
+_UNKNOWN = "unknown"
+
+
+def partition_value(metadata, partition_key):
+    """Shard key of one document: "YYYY-MM" for month, else the metadata value"""
+    if partition_key == "month":
+        parsed = parse_date(metadata.get("date_of_purchase"))
+        return f"{parsed.year:04d}-{parsed.month:02d}" if parsed else _UNKNOWN
+    return str(metadata.get(partition_key) or _UNKNOWN)
+
+
+def _fingerprint(texts):
+    digest = hashlib.sha1()
+    for text in sorted(texts):
+        digest.update(text.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _slug(value):
+    return re.sub(r"[^A-Za-z0-9_-]+", "_", value).strip("_") or "shard"
+
+
+class _Shard:
+    """One loaded shard: its vector store and metadata index"""
+
+    def __init__(self, vectorstore, metadata_index):
+        self.vectorstore = vectorstore
+        self.metadata_index = metadata_index
+
+
+class ShardedIndex:
+    """Partitioned FAISS vector stores with on-disk persistence and fan-out search"""
+
+    def __init__(self, directory, partition_key: str = "month", embeddings=None,
+                 index_config=None, max_workers: int = 4, max_loaded: int = 0,
+                 retire_seconds: float = 3600):
+        if partition_key not in PARTITION_KEYS:
+            raise ValueError(f"Unknown partition key '{partition_key}' (expected one of {PARTITION_KEYS})")
+        self.directory = directory
+        self.partition_key = partition_key
+        self.embeddings = embeddings
+        self.index_config = index_config
+        self.max_loaded = max_loaded
+        self.retire_seconds = retire_seconds
+        self.signature = self._signature()
+        self.manifest = self._empty_manifest()
+        self._loaded = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="shard-search")
+        self._closed = False
+        self._read_manifest()
+
+    @classmethod
+    def from_env(cls, embeddings, index_config=None):
+        return cls(
+            os.getenv("VECTOR_SHARD_DIR", "vector_shards"),
+            partition_key=os.getenv("VECTOR_SHARD_KEY", "month"),
+            embeddings=embeddings,
+            index_config=index_config,
+            max_workers=int(os.getenv("VECTOR_SHARD_WORKERS", "4")),
+            max_loaded=int(os.getenv("VECTOR_SHARD_MAX_LOADED", "0")),
+            retire_seconds=float(os.getenv("VECTOR_SHARD_RETIRE_SECONDS", "3600")),
+        )
+
+    def _signature(self):
+        from vector_index import build_signature, embedding_model_id
+
+        return {
+            "embedding_model": embedding_model_id(self.embeddings) if self.embeddings is not None else None,
+            "index_config": build_signature(self.index_config),
+        }
+
+    def _empty_manifest(self, retired=()):
+        return {"partition_key": self.partition_key, "signature": self.signature,
+                "shards": {}, "retired": list(retired)}
+
+    def close(self):
+        """Release the search pool (the index was replaced); later searches run inline"""
+        if self._closed:
+            return
+        self._closed = True
+        self._pool.shutdown(wait=False)
+        logger.info("Closed sharded index over %s", self.directory)
+
+    # Manifest -------------------------------------------------------------
+
+    def _read_manifest(self):
+        path = os.path.join(self.directory, MANIFEST_FILE)
+        try:
+            with open(path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return
+        retired = manifest.get("retired", [])
+        if manifest.get("partition_key") != self.partition_key:
+            reason = "partitioned by %s, not %s" % (manifest.get("partition_key"), self.partition_key)
+        elif manifest.get("signature") != self.signature:
+            reason = "built with %s, now %s" % (manifest.get("signature"), self.signature)
+        else:
+            manifest["retired"] = retired
+            self.manifest = manifest
+            return
+        logger.warning("Shard directory %s was %s - rebuilding every shard", self.directory, reason)
+        # Older model sets may still read the old shards; retire them rather than delete
+        now = time.time()
+        retired = retired + [{"path": info["path"], "retired_at": now}
+                             for info in manifest.get("shards", {}).values()]
+        self.manifest = self._empty_manifest(retired)
+
+    def _write_manifest(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, MANIFEST_FILE)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp, path)
+
+    @property
+    def shard_keys(self):
+        return sorted(self.manifest["shards"])
+
+    def vocabulary(self):
+        """Known metadata values across every shard, loaded or not"""
+        vocabulary = {field: set() for field in CATEGORICAL_FIELDS}
+        for info in self.manifest["shards"].values():
+            for field, values in info.get("vocabulary", {}).items():
+                vocabulary.setdefault(field, set()).update(values)
+        return {field: sorted(values) for field, values in vocabulary.items()}
+
+    # Building -------------------------------------------------------------
+
+    def sync(self, texts, metadatas):
+        """Make the shards match these documents, re-embedding only changed shards
+
+        Returns the number of shards rebuilt.
+        """
+        from vector_index import build_vectorstore
+
+        groups = {}
+        for text, metadata in zip(texts, metadatas):
+            group = groups.setdefault(partition_value(metadata, self.partition_key), ([], []))
+            group[0].append(text)
+            group[1].append(metadata)
+
+        shards = self.manifest["shards"]
+        rebuilt = 0
+        for key, (shard_texts, shard_metadatas) in sorted(groups.items()):
+            fingerprint = _fingerprint(shard_texts)
+            existing = shards.get(key)
+            if existing and existing["fingerprint"] == fingerprint and \
+                    os.path.isdir(os.path.join(self.directory, existing["path"])):
+                continue
+
+            with span("index.build_shard"):
+                # Shards are saved with save_local, so compact storage skips memory-mapped rescoring
+                vectorstore = build_vectorstore(
+                    shard_texts, self.embeddings, self.index_config, metadatas=shard_metadatas, rescore=False
+                )
+                path = f"{_slug(key)}-{fingerprint[:10]}"
+                self._unretire(path)
+                vectorstore.save_local(os.path.join(self.directory, path))
+
+            metadata_index = MetadataIndex(shard_metadatas)
+            dates = [parse_date(m.get("date_of_purchase")) for m in shard_metadatas]
+            dates = [d for d in dates if d]
+            shards[key] = {
+                "path": path,
+                "fingerprint": fingerprint,
+                "count": len(shard_texts),
+                "min_date": min(dates).isoformat() if dates else None,
+                "max_date": max(dates).isoformat() if dates else None,
+                "vocabulary": metadata_index.vocabulary(),
+            }
+            with self._lock:
+                self._loaded[key] = _Shard(vectorstore, metadata_index)
+                self._loaded.move_to_end(key)
+            if existing and existing["path"] != path:
+                self._retire(existing["path"])
+            rebuilt += 1
+            logger.info("✓ Built shard %s (%s documents)", key, len(shard_texts))
+
+        for key in set(shards) - set(groups):
+            logger.info("Removing shard %s (no longer has documents)", key)
+            self.unload(key)
+            self._retire(shards.pop(key)["path"])
+
+        self._purge_retired()
+        self._write_manifest()
+        self._evict()
+        logger.info("✓ %s shards ready, %s rebuilt, %s reused", len(shards), rebuilt, len(shards) - rebuilt)
+        return rebuilt
+
+    def _retire(self, path):
+        """Mark a replaced shard directory for deletion once older model sets are done with it"""
+        self.manifest["retired"].append({"path": path, "retired_at": time.time()})
+
+    def _unretire(self, path):
+        self.manifest["retired"] = [r for r in self.manifest["retired"] if r["path"] != path]
+
+    def _purge_retired(self):
+        """Delete directories retired more than `retire_seconds` ago"""
+        cutoff = time.time() - self.retire_seconds
+        live = {info["path"] for info in self.manifest["shards"].values()}
+        kept = []
+        for retired in self.manifest["retired"]:
+            if retired["path"] in live:
+                continue
+            if retired["retired_at"] <= cutoff:
+                self._remove_files(retired["path"])
+                logger.info("Removed retired shard directory %s", retired['path'])
+            else:
+                kept.append(retired)
+        self.manifest["retired"] = kept
+
+    def _remove_files(self, path):
+        shutil.rmtree(os.path.join(self.directory, path), ignore_errors=True)
+
+    # Loading --------------------------------------------------------------
+
+    def _shard(self, key):
+        """Loaded shard for `key`, reading it from disk if it was unloaded"""
+        with self._lock:
+            shard = self._loaded.get(key)
+            if shard is not None:
+                self._loaded.move_to_end(key)
+                return shard
+
+        from langchain_community.vectorstores import FAISS
+
+        info = self.manifest["shards"][key]
+        with span("index.load_shard"):
+            # Shards are written by sync() above, so the pickled docstore is trusted
+            vectorstore = FAISS.load_local(
+                os.path.join(self.directory, info["path"]),
+                self.embeddings,
+                allow_dangerous_deserialization=True
+            )
+        metadatas = [
+            vectorstore.docstore.search(vectorstore.index_to_docstore_id[i]).metadata
+            for i in range(vectorstore.index.ntotal)
+        ]
+        shard = _Shard(vectorstore, MetadataIndex(metadatas))
+        with self._lock:
+            shard = self._loaded.setdefault(key, shard)
+            self._loaded.move_to_end(key)
+        logger.info("✓ Loaded shard %s from disk", key)
+        self._evict()
+        return shard
+
+    def unload(self, key):
+        """Drop a shard from memory (it stays on disk)"""
+        with self._lock:
+            return self._loaded.pop(key, None) is not None
+
+    def _evict(self):
+        if not self.max_loaded:
+            return
+        with self._lock:
+            while len(self._loaded) > self.max_loaded:
+                key, _ = self._loaded.popitem(last=False)
+                logger.info("Unloaded least recently used shard %s", key)
+
+    def loaded_keys(self):
+        with self._lock:
+            return list(self._loaded)
+
+    # Searching ------------------------------------------------------------
+
+    def select_shards(self, filters):
+        """Shard keys that can contain documents matching `filters`"""
+        keys = self.shard_keys
+        values = filters.get(self.partition_key)
+        if values:
+            keys = [key for key in keys if key in values]
+
+        date_range = filters.get("date_range")
+        if date_range:
+            start, end = date_range[0].isoformat(), date_range[1].isoformat()
+            keys = [
+                key for key in keys
+                if self.manifest["shards"][key]["min_date"] is None
+                or (self.manifest["shards"][key]["min_date"] <= end
+                    and self.manifest["shards"][key]["max_date"] >= start)
+            ]
+        return keys
+
+    def _search_shard(self, key, query_vector, filters, fetch_k):
+        from retrievers import search_candidates
+
+        shard = self._shard(key)
+        vectorstore = shard.vectorstore
+        candidate_ids = shard.metadata_index.candidate_ids(filters) if filters else None
+        if candidate_ids is not None:
+            if not len(candidate_ids):
+                return []
+            ids, distances = search_candidates(vectorstore, query_vector, candidate_ids, fetch_k)
+        else:
+            query = np.asarray(query_vector, dtype=np.float32).reshape(1, -1)
+            distances, ids = vectorstore.index.search(query, min(fetch_k, vectorstore.index.ntotal))
+            ids, distances = ids[0], distances[0]
+
+        ids = np.asarray([i for i in ids if i >= 0], dtype=np.int64)
+        distances = np.asarray(distances[:len(ids)], dtype=np.float32)
+        if not len(ids):
+            return []
+        try:
+            vectors = vectorstore.index.reconstruct_batch(ids)
+        except RuntimeError:
+            vectors = [None] * len(ids)
+        return [
+            (float(distance), vectorstore.docstore.search(vectorstore.index_to_docstore_id[int(i)]), vector)
+            for i, distance, vector in zip(ids, distances, vectors)
+        ]
+
+    def _fan_out(self, keys, query_vector, filters, fetch_k):
+        """Per-shard hits (or the exception raised) in `keys` order"""
+        def run(key):
+            try:
+                return self._search_shard(key, query_vector, filters, fetch_k)
+            except Exception as e:
+                return e
+
+        if not self._closed:
+            try:
+                return list(self._pool.map(run, keys))
+            except RuntimeError:
+                # Pool shut down because the index was replaced mid-turn
+                pass
+        return [run(key) for key in keys]
+
+    def search(self, query_vector, filters=None, fetch_k: int = 20):
+        """Merged top-`fetch_k` over the relevant shards: [(distance, document, vector), ...]
+
+        `vector` is None for shards whose index can't reconstruct vectors.
+        """
+        filters = filters or {}
+        keys = self.select_shards(filters)
+        if not keys:
+            return []
+        started = time.perf_counter()
+        hits = []
+        for key, result in zip(keys, self._fan_out(keys, query_vector, filters, fetch_k)):
+            if isinstance(result, Exception):
+                logger.warning("Search on shard %s failed: %s", key, result)
+            else:
+                hits.extend(result)
+        hits.sort(key=lambda hit: hit[0])
+        logger.debug(
+            "Searched %s/%s shards in %.1f ms",
+            len(keys), len(self.manifest["shards"]), (time.perf_counter() - started) * 1000
+        )
+        return hits[:fetch_k]
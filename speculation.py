@@ -0,0 +1,264 @@
+"""Speculative retrieval started while a question is still being classified
+
+Most questions end up on SEARCH_DB, so retrieval is started on a thread
+pool as soon as the question arrives, in parallel with intent
+classification. If the intent is SEARCH_DB the retriever picks up the
+prefetched documents instead of searching again, so a turn costs
+max(classify, retrieve) rather than their sum; any other intent cancels or
+discards the speculative work. If the prefetch is still queued behind other
+turns when the retriever needs it, it is cancelled and retrieval runs
+inline, so speculation never makes a turn slower than not speculating.
+
+With chat history the chain retrieves the condensed question, so the
+speculative task first condenses the question with the chain's own question
+generator and retrieves that; run_search_db then hands the condensed
+question to the chain with an empty history, so the condense LLM call is
+made once. If the intent is not SEARCH_DB that call is wasted; set
+SPECULATIVE_CONDENSE=0 to skip speculation for turns with history instead
+(counted as "skipped"). When the model circuit breaker is not closed the
+exact Mongo lookup used by degraded answers is prefetched as well.
+Disable with SPECULATIVE_EXECUTION=0. The pool has
+SPECULATION_WORKERS threads (default 4); servers call size_pool() with
+their own concurrency so every in-flight turn gets a speculation thread.
+Hit rates are in speculation_stats().
+"""
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from tracing import record, span
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_workers = int(os.getenv("SPECULATION_WORKERS", "4"))
+_pool_lock = threading.Lock()
+_active = contextvars.ContextVar("speculation", default=None)
+
+_stats = {"started": 0, "condensed": 0, "exact_prefetched": 0,
+          "hits": 0, "misses": 0, "queued": 0, "discarded": 0, "skipped": 0}
+_stats_lock = threading.Lock()
+
+
+def size_pool(concurrency: int):
+    """Grow the pool to one thread per concurrently handled turn (never shrinks)
+
+    SPECULATION_WORKERS, when set, fixes the size instead.
+    """
+    global _pool, _pool_workers
+    if os.getenv("SPECULATION_WORKERS"):
+        return
+    with _pool_lock:
+        if concurrency <= _pool_workers:
+            return
+        _pool_workers = concurrency
+        old, _pool = _pool, None
+    if old is not None:
+        # Already-submitted work still runs; new work goes to the larger pool
+        old.shutdown(wait=False)
+    logger.info("Speculation pool sized to %s workers", concurrency)
+
+
+def _executor():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=_pool_workers, thread_name_prefix="speculate")
+        return _pool
+
+
+def speculation_enabled():
+    return os.getenv("SPECULATIVE_EXECUTION", "1") != "0"
+
+
+def condense_enabled():
+    return os.getenv("SPECULATIVE_CONDENSE", "1") != "0"
+
+
+def _count(outcome):
+    with _stats_lock:
+        _stats[outcome] += 1
+
+
+def speculation_stats():
+    """Counts of speculative turns and their outcomes, with the hit rate"""
+    with _stats_lock:
+        stats = dict(_stats)
+    settled = stats["hits"] + stats["misses"] + stats["queued"] + stats["discarded"]
+    stats["hit_rate"] = round(stats["hits"] / settled, 4) if settled else None
+    return stats
+
+
+def _timed(stage, func, *args):
+    with span(stage):
+        return func(*args)
+
+
+def _retrieve(retriever, question, condense=None):
+    """(query, documents): `question`, condensed first when `condense` is given"""
+    if condense is not None:
+        with span("speculation.condense"):
+            question = condense(question)
+    return question, retriever.invoke(question)
+
+
+def _condenser(qa_chain, chat_history):
+    """condense(question) with the chain's question generator and history, or None"""
+    generator = getattr(qa_chain, "question_generator", None)
+    if generator is None or not condense_enabled():
+        return None
+    get_chat_history = getattr(qa_chain, "get_chat_history", None)
+    if get_chat_history is None:
+        from langchain.chains.conversational_retrieval.base import _get_chat_history as get_chat_history
+    history = get_chat_history(chat_history)
+
+    def condense(question):
+        # Same prompt as ConversationalRetrievalChain's condense step
+        return generator.invoke({"question": question, "chat_history": history})[generator.output_key]
+
+    return condense
+
+
+class Speculation:
+    """Retrieval candidates for one question, computed during classification
+
+    With `condense` the condensed question is retrieved (see
+    condensed_question); `exact_lookup(question)` is prefetched when given.
+    """
+
+    def __init__(self, question, retriever, condense=None, exact_lookup=None):
+        self.question = question
+        self.condensed = condense is not None
+        self._settled = False
+        self._lock = threading.Lock()
+        self.retrieval = self._submit("speculation.retrieval", _retrieve, retriever, question, condense)
+        self.exact = self._submit("speculation.exact_lookup", exact_lookup, question) if exact_lookup else None
+        _count("started")
+        if self.condensed:
+            _count("condensed")
+        if self.exact is not None:
+            _count("exact_prefetched")
+
+    @staticmethod
+    def _submit(stage, func, *args):
+        return _executor().submit(contextvars.copy_context().run, _timed, stage, func, *args)
+
+    def _settle(self, outcome):
+        """Record the turn's outcome once (hits/misses/queued/discarded)"""
+        with self._lock:
+            if self._settled:
+                return
+            self._settled = True
+        _count(outcome)
+
+    def discard(self, reason="intent"):
+        """Cancel work that hasn't started and drop what has"""
+        for future in (self.retrieval, self.exact):
+            if future is not None:
+                future.cancel()
+        logger.debug("Discarded speculative retrieval (%s)", reason)
+        self._settle("discarded")
+
+    def miss(self, reason):
+        self.retrieval.cancel()
+        logger.debug("Speculative retrieval not used (%s)", reason)
+        self._settle("misses")
+
+    def documents(self, query=None, timeout=None):
+        """Prefetched documents if they were retrieved for `query` (None: any query), else None
+
+        Returns None without waiting if the prefetch never started (the pool
+        is busy with other turns); the caller then retrieves inline.
+        """
+        if query is not None and not self.condensed and query != self.question:
+            self.miss("different query")
+            return None
+        if self.retrieval.cancel():
+            logger.debug("Speculative retrieval still queued, retrieving inline")
+            self._settle("queued")
+            return None
+        started = time.perf_counter()
+        try:
+            retrieved_query, docs = self.retrieval.result(timeout=timeout)
+        except Exception as e:
+            self.miss(f"retrieval failed: {e}")
+            return None
+        record("speculation.wait", time.perf_counter() - started)
+        if query is not None and query != retrieved_query:
+            self.miss("different query")
+            return None
+        self._settle("hits")
+        return docs
+
+    def condensed_question(self, timeout=None):
+        """The question condensed against the chat history, or None if not condensed
+
+        None too if the task is still queued (it is cancelled) or failed;
+        the chain then condenses the question itself.
+        """
+        if not self.condensed:
+            return None
+        if self.retrieval.cancel():
+            logger.debug("Speculative condense still queued, condensing inline")
+            self._settle("queued")
+            return None
+        try:
+            return self.retrieval.result(timeout=timeout)[0]
+        except Exception as e:
+            self.miss(f"condense failed: {e}")
+            return None
+
+    def exact_results(self, timeout=None):
+        """Prefetched exact Mongo matches, or None if not prefetched or failed"""
+        if self.exact is None:
+            return None
+        try:
+            return self.exact.result(timeout=timeout)
+        except Exception as e:
+            logger.warning("Speculative exact lookup failed: %s", e)
+            return None
+
+
+def speculate(question, qa_chain, chat_history=None, exact_lookup=None):
+    """Start speculative retrieval for `question`, or None when disabled or not applicable
+
+    With `chat_history` ((question, answer) tuples) the condensed question
+    is retrieved; `exact_lookup(question)` is prefetched too when given.
+    """
+    if not speculation_enabled():
+        return None
+    retriever = getattr(qa_chain, "retriever", None)
+    if retriever is None:
+        return None
+    condense = None
+    if chat_history:
+        condense = _condenser(qa_chain, chat_history)
+        if condense is None:
+            _count("skipped")
+            return None
+    return Speculation(question, retriever, condense, exact_lookup)
+
+
+@contextmanager
+def use_speculation(speculation):
+    """Context in which retrievers serve prefetched documents (see prefetched_documents)"""
+    if speculation is None:
+        yield None
+        return
+    token = _active.set(speculation)
+    try:
+        yield speculation
+    finally:
+        _active.reset(token)
+
+
+def prefetched_documents(query):
+    """Documents speculatively retrieved for `query` in the current context, or None"""
+    speculation = _active.get()
+    if speculation is None:
+        return None
+    return speculation.documents(query)
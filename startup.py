@@ -0,0 +1,161 @@
+"""Cold-start timing and background warm-up of heavy dependencies
+
+Run `python startup.py` to measure cold import times of the app modules and
+their heavy dependencies, each in a fresh interpreter:
+
+    python startup.py --output startup_report.json
+"""
+import argparse
+import importlib
+import json
+import logging
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+PROCESS_START = time.perf_counter()
+
+# Imported lazily by rag_model/utils/intent_classifier/gateway; warmed up in the background
+HEAVY_MODULES = [
+    "langchain_google_genai",
+    "langchain_community.vectorstores",
+    "langchain.chains",
+    "langchain_core.prompts",
+    "langchain_text_splitters",
+    "sklearn.metrics.pairwise",
+    "tiktoken",
+    "gateway_models",
+]
+
+APP_MODULES = [
+    "db",
+    "upload",
+    "utils",
+    "rag_model",
+    "intent_classifier",
+    "search_db",
+    "customer_history",
+    "support",
+    "streamlit_app",
+]
+
+REPORT_FILE = "startup_report.json"
+
+_lock = threading.Lock()
+_marks = {}
+_warmup = {}
+_warmup_thread = None
+
+
+def mark(stage: str):
+    """Record seconds since process start for `stage` (first occurrence only)"""
+    with _lock:
+        if stage in _marks:
+            return False
+        _marks[stage] = time.perf_counter() - PROCESS_START
+    logger.info("⏱️ Startup mark '%s': %.1f ms", stage, _marks[stage] * 1000)
+    return True
+
+
+def get_report() -> dict:
+    """Return startup marks and warm-up timings collected so far"""
+    with _lock:
+        return {
+            "generated_at": datetime.now().isoformat(),
+            "marks_ms": {k: round(v * 1000, 1) for k, v in _marks.items()},
+            "warmup_ms": {k: round(v * 1000, 1) for k, v in _warmup.items()},
+        }
+
+
+def write_report(path: str = REPORT_FILE) -> dict:
+    """Write the in-process startup report to a JSON file"""
+    report = get_report()
+    try:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        logger.info("✓ Startup report written to %s", path)
+    except OSError as e:
+        logger.warning("Could not write startup report: %s", e)
+    return report
+
+
+def _warm_up():
+    """Import heavy modules and load encoders off the render thread"""
+    started = time.perf_counter()
+    for module in HEAVY_MODULES:
+        t0 = time.perf_counter()
+        try:
+            importlib.import_module(module)
+        except Exception as e:
+            logger.warning("Warm-up import failed for %s: %s", module, e)
+            continue
+        with _lock:
+            _warmup[module] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    from utils import token_counter
+    token_counter.encoding
+    with _lock:
+        _warmup["tiktoken_encoding"] = time.perf_counter() - t0
+        _warmup["total"] = time.perf_counter() - started
+    logger.info("✓ Background warm-up finished in %.1f ms", _warmup['total'] * 1000)
+
+
+def start_warmup():
+    """Start the background warm-up thread once per process"""
+    global _warmup_thread
+    with _lock:
+        if _warmup_thread is not None:
+            return _warmup_thread
+        _warmup_thread = threading.Thread(target=_warm_up, name="startup-warmup", daemon=True)
+        _warmup_thread.start()
+    logger.info("Background warm-up started")
+    return _warmup_thread
+
+
+def measure_cold_imports(modules) -> dict:
+    """Measure each module's import time in a fresh interpreter (milliseconds)"""
+    snippet = (
+        "import time, importlib; t = time.perf_counter(); "
+        "importlib.import_module({!r}); print(time.perf_counter() - t)"
+    )
+    results = {}
+    for module in modules:
+        proc = subprocess.run(
+            [sys.executable, "-c", snippet.format(module)],
+            capture_output=True,
+            text=True
+        )
+        if proc.returncode != 0:
+            results[module] = None
+            logger.warning("Import of %s failed: %s", module, proc.stderr.strip().splitlines()[-1:])
+            continue
+        results[module] = round(float(proc.stdout.strip().splitlines()[-1]) * 1000, 1)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold-start import times")
+    parser.add_argument("--output", default=None, help="Write the JSON report to this path")
+    args = parser.parse_args()
+
+    report = {
+        "generated_at": datetime.now().isoformat(),
+        "python": sys.version.split()[0],
+        "app_modules_ms": measure_cold_imports(APP_MODULES),
+        "heavy_modules_ms": measure_cold_imports(HEAVY_MODULES),
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -1,46 +1,139 @@
+import startup
 import streamlit as st
 import os
+import time
+import uuid
 import logging
 from datetime import datetime
 from db import init_collections
-from upload import upload_json_to_mongodb
+from upload import upload_json_to_mongodb, upload_limit
 from rag_model import build_rag_model
+from model_registry import model_registry, compute_data_version
 from search_db import handle_search_db
 from customer_history import handle_customer_history
 from support import handle_support_request
 from utils import token_counter
+from logging_config import setup_logging, tail_log, LOG_FILE
+from tracing import span, set_trace_label, tracer, export_metrics, METRICS_FILE
+from columnar_store import get_columnar_store
+from gateway import gateway_stats
+from speculation import speculation_stats
+from chat_service import start_speculation
+from session_memory import session_tracker, start_tracemalloc
+from chat_store import ChatHistoryStore, PAGE_SIZE
 
-# Configure comprehensive logging
-logging.basicConfig(
-    level=logging.DEBUG,  # Changed to DEBUG for maximum detail
-    format='%(asctime)s - %(name)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s',
-    handlers=[
-        logging.FileHandler('chatbot.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+startup.mark("imports_complete")
+
+# Queue-based logging with rotation; levels come from LOG_LEVEL / LOG_LEVELS
+setup_logging()
 logger = logging.getLogger(__name__)
+start_tracemalloc()
 
 st.set_page_config(page_title="E-commerce Chatbot", layout="wide")
 
 def log_session_state():
     """Log current session state for debugging"""
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
     logger.debug("="*60)
     logger.debug("SESSION STATE SNAPSHOT:")
     for key, value in st.session_state.items():
         if key == "chat_history":
-            logger.debug(f"  {key}: {len(value)} messages")
-        elif key in ["qa_chain", "llm", "intent_classifier"]:
-            logger.debug(f"  {key}: <object initialized>")
+            logger.debug("  %s: %s messages", key, len(value))
+        elif key == "model_set":
+            logger.debug("  %s: <shared model set %s>", key, value.version)
         else:
-            logger.debug(f"  {key}: {value}")
+            logger.debug("  %s: %s", key, value)
     logger.debug("="*60)
 
+def admin_panel_enabled():
+    """Latency admin panel is opt-in via ADMIN_PANEL env var or secret"""
+    if os.getenv("ADMIN_PANEL"):
+        return True
+    try:
+        return bool(st.secrets.get("ADMIN_PANEL", False))
+    except FileNotFoundError:
+        return False
+
+def render_admin_panel():
+    """Show per-stage latency percentiles in the sidebar"""
+    with st.sidebar.expander("📈 Stage Latency (admin)", expanded=False):
+        rows = tracer.summary()
+        if not rows:
+            st.caption("No turns traced yet")
+            return
+        st.dataframe(rows, use_container_width=True)
+        st.caption(f"Exported to {METRICS_FILE} after every turn")
+        st.write("**Model gateway**")
+        st.dataframe(gateway_stats(), use_container_width=True)
+        st.write("**Speculative retrieval**")
+        st.json(speculation_stats())
+        st.caption(
+            "Turns with chat history condense the question speculatively (\"condensed\"); "
+            "that LLM call is wasted when the intent isn't SEARCH_DB. \"skipped\" counts turns "
+            "with history not speculated (SPECULATIVE_CONDENSE=0)."
+        )
+        if st.button("Reset metrics"):
+            tracer.reset()
+            st.rerun()
+
+def render_memory_panel():
+    """Retained memory per session, model component and shared cache"""
+    with st.sidebar.expander("🧠 Session Memory (admin)", expanded=False):
+        report = session_tracker.measure()
+        budget = f"{report['budget_mb']:.0f} MB" if report["budget_mb"] else "off"
+        st.caption(f"Retained ≈ {report['retained_mb']:.1f} MB · RSS {report['rss_mb']} MB · budget {budget}")
+        st.write("**Sessions**")
+        st.dataframe(report["sessions"], use_container_width=True)
+        st.write("**Model objects**")
+        st.dataframe(report["models"] + report["shared"], use_container_width=True)
+        if report["allocations"]:
+            st.write("**Top allocation sites (tracemalloc)**")
+            st.dataframe(report["allocations"], use_container_width=True)
+        if st.button("Evict idle sessions now"):
+            session_tracker.enforce_budget(force=True)
+            st.rerun()
+
+def session_state_handle():
+    """This session's own state object, which stays valid between its runs"""
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+    ctx = get_script_run_ctx()
+    return ctx.session_state if ctx is not None else None
+
+def evict_session_state(state):
+    """Drop an idle session's heavy objects (called by session_tracker)
+
+    History is reloaded from the chat store and the current model set is
+    re-attached on the session's next run.
+    """
+    state["chat_history"] = []
+    if "history_total" in state:
+        del state["history_total"]
+    current = model_registry.current()
+    if current is not None and "model_set" in state and state["model_set"] is not current:
+        del state["model_set"]
+
+def render_sales_snapshot(store):
+    """Headline metrics computed from the in-memory columnar store"""
+    if store is None or not store.size:
+        return
+    with st.sidebar.expander("📊 Sales Snapshot", expanded=False):
+        st.metric("Revenue", f"${store.total():,.2f}")
+        st.metric("Transactions", f"{store.size:,}")
+        st.write("**Top categories**")
+        st.dataframe(
+            [{"category": name, "revenue": round(value, 2)} for name, value in store.top_k("category", k=5)],
+            use_container_width=True
+        )
+        report = store.memory_report()
+        st.caption(f"Columnar cache: {report['bytes'] / 1e6:.1f} MB ({report['mb_per_million_rows']} MB per million rows)")
+
 def main():
     st.title("🛍️ E-commerce Sales & Support Chatbot")
     logger.info("="*80)
     logger.info("APPLICATION STARTED")
-    logger.info(f"Timestamp: {datetime.now().isoformat()}")
+    logger.info("Timestamp: %s", datetime.now().isoformat())
     logger.info("="*80)
     
     # Initialize session state
@@ -48,7 +141,7 @@ def main():
         st.session_state.chat_history = []
         logger.info("✓ Initialized new chat history")
     else:
-        logger.info(f"✓ Chat history exists with {len(st.session_state.chat_history)} messages")
+        logger.info("✓ Chat history exists with %s messages", len(st.session_state.chat_history))
     
     if "models_ready" not in st.session_state:
         st.session_state.models_ready = False
@@ -56,6 +149,9 @@ def main():
     
     log_session_state()
     
+    # Load langchain/sklearn/tiktoken in the background while the first screen renders
+    startup.start_warmup()
+    
     # Database connection
     try:
         logger.info("Attempting to initialize database collections...")
@@ -69,25 +165,75 @@ def main():
             transaction_count = collections['transactions'].count_documents({})
             ticket_count = collections['support_tickets'].count_documents({})
             
-            logger.info(f"Database Status:")
-            logger.info(f"  - Customers: {customer_count}")
-            logger.info(f"  - Products: {product_count}")
-            logger.info(f"  - Transactions: {transaction_count}")
-            logger.info(f"  - Support Tickets: {ticket_count}")
+            logger.info("Database Status:")
+            logger.info("  - Customers: %s", customer_count)
+            logger.info("  - Products: %s", product_count)
+            logger.info("  - Transactions: %s", transaction_count)
+            logger.info("  - Support Tickets: %s", ticket_count)
+        except Exception as e:
+            logger.warning("Could not fetch collection counts: %s", e)
+        
+        # Columnar analytics cache, loaded once per process
+        try:
+            render_sales_snapshot(get_columnar_store(collections))
         except Exception as e:
-            logger.warning(f"Could not fetch collection counts: {e}")
+            logger.warning("Columnar store unavailable: %s", e)
             
     except Exception as e:
-        logger.error(f"❌ Database connection error: {e}", exc_info=True)
+        logger.error("❌ Database connection error: %s", e, exc_info=True)
         st.error(f"Database connection error: {e}")
         st.info("Please configure MONGODB_URI in Streamlit secrets")
         return
     
+    # Persistent chat history - the session id lives in the URL so a reload
+    # resumes the conversation; only the newest page is kept in memory
+    if "session_id" not in st.session_state:
+        # streamlit 1.29 only ships the experimental query-param API
+        sid = st.experimental_get_query_params().get("sid", [None])[0]
+        st.session_state.session_id = sid or uuid.uuid4().hex
+        st.experimental_set_query_params(sid=st.session_state.session_id)
+    history_store = ChatHistoryStore(collections["chat_history"], st.session_state.session_id)
+    if "history_total" not in st.session_state:
+        try:
+            st.session_state.chat_history = history_store.page(0)
+            st.session_state.history_total = history_store.count()
+            logger.info(
+                "✓ Loaded %s of %s stored turns for session %s",
+                len(st.session_state.chat_history), st.session_state.history_total, st.session_state.session_id
+            )
+        except Exception as e:
+            logger.warning("Could not load stored chat history: %s", e)
+            st.session_state.history_total = len(st.session_state.chat_history)
+    
+    # Attach to the process-wide model set, or pick up a newer one published
+    # by another session. The old set stays usable until this swap happens.
+    shared_models = model_registry.current()
+    if shared_models is not None and st.session_state.get("model_set") is not shared_models:
+        previous = st.session_state.get("model_set")
+        st.session_state.model_set = shared_models
+        st.session_state.models_ready = True
+        logger.info(
+            "✓ Session attached to shared model set %s (previous: %s)",
+            shared_models.version, previous.version if previous else "none"
+        )
+    
+    # Per-session memory accounting; idle sessions are evicted beyond SESSION_MEMORY_BUDGET_MB
+    state_handle = session_state_handle()
+    if state_handle is not None:
+        session_tracker.touch(st.session_state.session_id, state_handle, evict_session_state)
+    session_tracker.register_shared("columnar_store", lambda: get_columnar_store(collections, load=False))
+    session_tracker.enforce_budget()
+    
     # Model initialization
-    if not st.session_state.get("models_ready", False):
+    if not st.session_state.get("models_ready", False) or st.session_state.get("show_upload", False):
         logger.info("Models not ready - showing upload interface")
         st.info("📊 Ready to upload sales data")
         
+        if st.session_state.get("models_ready", False):
+            if st.button("↩️ Back to Chat"):
+                st.session_state.show_upload = False
+                st.rerun()
+        
         # File upload options
         st.subheader("📁 Upload Configuration")
         
@@ -99,32 +245,35 @@ def main():
                 options=["New File (Clear Existing)", "Existing File (Append)"],
                 help="Choose whether to replace existing data or append to it"
             )
-            logger.debug(f"Upload mode selected: {upload_mode}")
+            logger.debug("Upload mode selected: %s", upload_mode)
         
+        max_documents = upload_limit()
+        limit_notice = (f"Only the first {max_documents} transactions will be processed" if max_documents
+                        else "Every transaction in the file will be processed")
         with col2:
             st.info(f"""
             **{upload_mode.split('(')[0].strip()}**
             
             {'🗑️ Will delete all existing data' if 'New' in upload_mode else '➕ Will keep existing data'}
             
-            📝 Only first 100 transactions will be processed
+            📝 {limit_notice}
             """)
         
         clear_existing = "New" in upload_mode
-        logger.info(f"Upload configuration: clear_existing={clear_existing}")
+        logger.info("Upload configuration: clear_existing=%s", clear_existing)
         
         json_file = st.file_uploader(
-            "Upload sales JSON data", 
-            type=["json"],
-            help="Upload your sales transaction data in JSON format"
+            "Upload sales data", 
+            type=["json", "ndjson", "jsonl", "csv", "gz", "zip"],
+            help="JSON array, NDJSON or CSV export, optionally gzip- or zip-compressed"
         )
         
         if json_file:
             logger.info("="*60)
             logger.info("FILE UPLOADED:")
-            logger.info(f"  - Name: {json_file.name}")
-            logger.info(f"  - Size: {json_file.size} bytes ({json_file.size / 1024:.2f} KB)")
-            logger.info(f"  - Type: {json_file.type}")
+            logger.info("  - Name: %s", json_file.name)
+            logger.info("  - Size: %s bytes (%.2f KB)", json_file.size, json_file.size / 1024)
+            logger.info("  - Type: %s", json_file.type)
             logger.info("="*60)
             
             # Show file info
@@ -134,7 +283,7 @@ def main():
             if clear_existing:
                 st.warning("⚠️ This will delete all existing data in the database!")
                 confirm = st.checkbox("I confirm I want to delete existing data")
-                logger.debug(f"Delete confirmation checkbox: {confirm}")
+                logger.debug("Delete confirmation checkbox: %s", confirm)
                 if not confirm:
                     logger.info("User did not confirm deletion - stopping")
                     st.stop()
@@ -142,35 +291,25 @@ def main():
             if st.button("🚀 Process File", type="primary"):
                 logger.info("="*80)
                 logger.info("FILE PROCESSING INITIATED")
-                logger.info(f"  - File: {json_file.name}")
-                logger.info(f"  - Mode: {'NEW (clear existing)' if clear_existing else 'APPEND (keep existing)'}")
+                logger.info("  - File: %s", json_file.name)
+                logger.info("  - Mode: %s", 'NEW (clear existing)' if clear_existing else 'APPEND (keep existing)')
                 logger.info("="*80)
                 
                 try:
                     with st.spinner("Uploading and processing data..."):
-                        # Save temporary file
-                        temp_file = "temp.json"
-                        logger.info(f"Creating temporary file: {temp_file}")
-                        
-                        with open(temp_file, "wb") as f:
-                            bytes_written = f.write(json_file.getbuffer())
-                        logger.info(f"✓ Temporary file created: {bytes_written} bytes written")
-                        
-                        # Upload to MongoDB
+                        # Stream straight from the upload buffer - no temporary file
                         logger.info("Starting MongoDB upload process...")
+                        json_file.seek(0)
                         uploaded_count = upload_json_to_mongodb(
-                            temp_file, 
+                            json_file, 
                             collections,
-                            clear_existing=clear_existing
+                            clear_existing=clear_existing,
+                            max_documents=max_documents
                         )
                         
-                        logger.info(f"✓ MongoDB upload completed: {uploaded_count} transactions")
-                        st.success(f"✅ Uploaded {uploaded_count} transactions (first 100 from file)")
-                        
-                        # Clean up
-                        if os.path.exists(temp_file):
-                            os.remove(temp_file)
-                            logger.info(f"✓ Temporary file deleted: {temp_file}")
+                        logger.info("✓ MongoDB upload completed: %s transactions", uploaded_count)
+                        limited = f" (first {max_documents} from file)" if max_documents else ""
+                        st.success(f"✅ Uploaded {uploaded_count} transactions{limited}")
                         
                         # Build RAG model
                         st.info("🤖 Building AI models...")
@@ -185,19 +324,21 @@ def main():
                             return
                         
                         logger.info("✓ Google API key found")
-                        logger.info(f"API key length: {len(api_key)} characters")
+                        logger.info("API key length: %s characters", len(api_key))
+                        
+                        data_version = compute_data_version(collections["transactions"])
+                        logger.info("Data version: %s", data_version)
                         
-                        qa_chain, llm, intent_classifier = build_rag_model(
-                            api_key, 
-                            collections["transactions"]
+                        model_set = model_registry.get_or_build(
+                            data_version,
+                            lambda: build_rag_model(api_key, collections["transactions"])
                         )
                         
                         st.session_state.models_ready = True
-                        st.session_state.qa_chain = qa_chain
-                        st.session_state.llm = llm
-                        st.session_state.intent_classifier = intent_classifier
+                        st.session_state.show_upload = False
+                        st.session_state.model_set = model_set
                         
-                        logger.info("✓ Models stored in session state")
+                        logger.info("✓ Session attached to model set %s", model_set.version)
                         logger.info("✓ System fully initialized and ready")
                         log_session_state()
                         
@@ -207,17 +348,18 @@ def main():
                 except Exception as e:
                     logger.error("="*80)
                     logger.error("FILE PROCESSING ERROR")
-                    logger.error(f"Error: {str(e)}")
+                    logger.error("Error: %s", str(e))
                     logger.error("="*80, exc_info=True)
                     st.error(f"Error processing file: {str(e)}")
                     return
     
     # Chatbot interface
-    if st.session_state.get("models_ready", False):
+    if st.session_state.get("models_ready", False) and not st.session_state.get("show_upload", False):
         logger.debug("Rendering chatbot interface (models ready)")
+        model_set = st.session_state.model_set
         st.divider()
         
-        col1, col2, col3 = st.columns([3, 1, 1])
+        col1, col2, col3, col4 = st.columns([3, 1, 1, 1])
         
         with col1:
             user_input = st.text_input(
@@ -228,30 +370,40 @@ def main():
         
         with col2:
             if st.button("🔄 Clear History"):
-                previous_count = len(st.session_state.chat_history)
+                previous_count = st.session_state.history_total
                 st.session_state.chat_history = []
-                logger.info(f"✓ Chat history cleared by user (removed {previous_count} messages)")
+                st.session_state.history_total = 0
+                st.session_state.history_page = 0
+                try:
+                    history_store.clear()
+                except Exception as e:
+                    logger.warning("Could not delete stored chat history: %s", e)
+                logger.info("✓ Chat history cleared by user (removed %s messages)", previous_count)
                 st.rerun()
         
         with col3:
             if st.button("📋 View Logs"):
                 st.session_state.show_logs = not st.session_state.get("show_logs", False)
-                logger.debug(f"Log viewer toggled: {st.session_state.show_logs}")
+                logger.debug("Log viewer toggled: %s", st.session_state.show_logs)
+        
+        with col4:
+            if st.button("📤 Upload Data"):
+                st.session_state.show_upload = True
+                logger.info("Upload interface requested while models are ready")
+                st.rerun()
         
         # Show logs if enabled
         if st.session_state.get("show_logs", False):
             with st.expander("📋 Application Logs", expanded=True):
                 try:
-                    with open("chatbot.log", "r", encoding='utf-8') as f:
-                        logs = f.readlines()
-                        # Show last 100 lines
-                        st.text_area(
-                            "Recent Logs (Last 100 lines)", 
-                            "".join(logs[-100:]), 
-                            height=400,
-                            disabled=True
-                        )
-                        st.caption(f"Total log lines: {len(logs)}")
+                    # Read backwards from the end so cost doesn't grow with the log
+                    st.text_area(
+                        "Recent Logs (Last 100 lines)", 
+                        tail_log(LOG_FILE, lines=100), 
+                        height=400,
+                        disabled=True
+                    )
+                    st.caption(f"Log file size: {os.path.getsize(LOG_FILE) / 1024:.1f} KB")
                 except FileNotFoundError:
                     logger.warning("Log file not found")
                     st.info("No logs available yet")
@@ -259,50 +411,63 @@ def main():
         if user_input:
             logger.info("="*80)
             logger.info("NEW USER QUERY")
-            logger.info(f"Query: '{user_input}'")
-            logger.info(f"Query length: {len(user_input)} characters")
-            logger.info(f"Timestamp: {datetime.now().isoformat()}")
+            logger.info("Query: '%s'", user_input)
+            logger.info("Query length: %s characters", len(user_input))
+            logger.info("Timestamp: %s", datetime.now().isoformat())
             logger.info("="*80)
             
+            turn_started = time.perf_counter()
+            set_trace_label(intent=None, session=st.session_state.session_id)
+            intent = None
+            
             try:
                 # Intent classification
+                # Retrieval runs alongside classification; most questions are SEARCH_DB
+                speculation = start_speculation(
+                    user_input, model_set.qa_chain, st.session_state.chat_history, collections
+                )
                 logger.info("Starting intent classification...")
-                intent, conf = st.session_state.intent_classifier.classify(user_input)
-                logger.info(f"✓ Intent classified: {intent}")
-                logger.info(f"✓ Confidence score: {conf:.4f}")
+                intent, conf = model_set.intent_classifier.classify(user_input)
+                set_trace_label(intent=intent)
+                if speculation is not None and intent != "SEARCH_DB":
+                    speculation.discard(intent)
+                logger.info("✓ Intent classified: %s", intent)
+                logger.info("✓ Confidence score: %.4f", conf)
                 
                 with st.expander(f"🎯 Intent: {intent} (Confidence: {conf:.2f})"):
                     st.write(f"The system identified this as a **{intent}** query")
                 
                 with st.spinner("Processing..."):
-                    logger.info(f"Handling intent: {intent}")
+                    logger.info("Handling intent: %s", intent)
                     
                     if intent == "SEARCH_DB":
                         logger.info("Route: SEARCH_DB (RAG-based database search)")
-                        logger.debug(f"Chat history length: {len(st.session_state.chat_history)}")
+                        logger.debug("Chat history length: %s", len(st.session_state.chat_history))
                         answer = handle_search_db(
                             user_input,
-                            st.session_state.qa_chain,
-                            st.session_state.chat_history
+                            model_set.qa_chain,
+                            st.session_state.chat_history,
+                            collections,
+                            speculation
                         )
-                        logger.info(f"✓ SEARCH_DB completed - response length: {len(str(answer))} chars")
+                        logger.info("✓ SEARCH_DB completed - response length: %s chars", len(str(answer)))
                         
                     elif intent == "CUSTOMER_HISTORY":
                         logger.info("Route: CUSTOMER_HISTORY (customer lookup)")
                         answer = handle_customer_history(
                             user_input,
-                            st.session_state.llm,
+                            model_set.llm,
                             collections
                         )
-                        logger.info(f"✓ CUSTOMER_HISTORY completed - response length: {len(str(answer))} chars")
+                        logger.info("✓ CUSTOMER_HISTORY completed - response length: %s chars", len(str(answer)))
                         
                     elif intent == "SUPPORT":
                         logger.info("Route: SUPPORT (ticket creation)")
-                        answer = handle_support_request()
-                        logger.info(f"✓ SUPPORT completed - response length: {len(str(answer))} chars")
+                        answer = handle_support_request(collections)
+                        logger.info("✓ SUPPORT completed - response length: %s chars", len(str(answer)))
                         
                     else:
-                        logger.warning(f"Unknown intent received: {intent}")
+                        logger.warning("Unknown intent received: %s", intent)
                         answer = "Sorry, I couldn't understand your request. Please try again."
                 
                 # Store in chat history
@@ -314,17 +479,25 @@ def main():
                     "timestamp": datetime.now().isoformat()
                 }
                 st.session_state.chat_history.append(chat_entry)
+                del st.session_state.chat_history[:-PAGE_SIZE]
+                st.session_state.history_total += 1
+                st.session_state.history_page = 0
+                try:
+                    history_store.append(chat_entry)
+                except Exception as e:
+                    logger.warning("Could not persist chat turn: %s", e)
                 
-                logger.info(f"✓ Added to chat history (total messages: {len(st.session_state.chat_history)})")
-                logger.debug(f"Chat entry: {chat_entry}")
+                logger.info("✓ Added to chat history (total messages: %s)", st.session_state.history_total)
+                logger.debug("Chat entry: intent=%s, answer length=%s chars", intent, len(str(answer)))
                 
                 # Display response
-                st.write(answer)
-                
-                # Token counting
-                tokens = token_counter.count_tokens(str(answer))
-                logger.info(f"Token count: {tokens}")
-                st.caption(f"📊 Tokens used: {tokens}")
+                with span("render"):
+                    st.write(answer)
+                    
+                    # Token counting
+                    tokens = token_counter.count_tokens(str(answer))
+                    logger.info("Token count: %s", tokens)
+                    st.caption(f"📊 Tokens used: {tokens}")
                 
                 logger.info("="*80)
                 logger.info("QUERY PROCESSING COMPLETED SUCCESSFULLY")
@@ -333,30 +506,65 @@ def main():
             except Exception as e:
                 logger.error("="*80)
                 logger.error("QUERY PROCESSING ERROR")
-                logger.error(f"User query: '{user_input}'")
-                logger.error(f"Error: {str(e)}")
+                logger.error("User query: '%s'", user_input)
+                logger.error("Error: %s", str(e))
                 logger.error("="*80, exc_info=True)
                 st.error(f"Error processing request: {str(e)}")
+            
+            tracer.observe("turn", time.perf_counter() - turn_started, intent)
+            try:
+                export_metrics()
+            except OSError as e:
+                logger.warning("Could not export latency metrics: %s", e)
     
-    # Display chat history
+    if admin_panel_enabled():
+        render_admin_panel()
+        render_memory_panel()
+    
+    # Display chat history, one page at a time so render cost stays constant
     if st.session_state.get("chat_history"):
-        logger.debug(f"Rendering chat history ({len(st.session_state.chat_history)} messages)")
+        total = st.session_state.history_total
+        page = st.session_state.get("history_page", 0)
+        if page == 0:
+            turns = st.session_state.chat_history
+        else:
+            try:
+                turns = history_store.page(page)
+            except Exception as e:
+                logger.warning("Could not load chat history page %s: %s", page, e)
+                turns = []
+        logger.debug("Rendering chat history page %s (%s of %s messages)", page, len(turns), total)
         st.divider()
         st.subheader("💬 Chat History")
         
-        for i, msg in enumerate(reversed(st.session_state.chat_history), 1):
-            idx = len(st.session_state.chat_history) - i + 1
+        newest_idx = total - page * PAGE_SIZE
+        for i, msg in enumerate(reversed(turns)):
+            idx = newest_idx - i
             with st.expander(f"Q{idx}: {msg['user'][:60]}{'...' if len(msg['user']) > 60 else ''}"):
                 st.write(f"**Question:** {msg['user']}")
                 st.write(f"**Answer:** {msg['bot']}")
                 st.caption(f"Intent: {msg['intent']} | Confidence: {msg.get('confidence', 0):.2f}")
                 if 'timestamp' in msg:
                     st.caption(f"Time: {msg['timestamp']}")
+        
+        pages = max(1, -(-total // PAGE_SIZE))
+        if pages > 1:
+            older_col, info_col, newer_col = st.columns([1, 2, 1])
+            with older_col:
+                if page + 1 < pages and st.button("⬅️ Older"):
+                    st.session_state.history_page = page + 1
+                    st.rerun()
+            with info_col:
+                st.caption(f"Page {page + 1} of {pages} ({total} messages)")
+            with newer_col:
+                if page > 0 and st.button("Newer ➡️"):
+                    st.session_state.history_page = page - 1
+                    st.rerun()
 
 if __name__ == "__main__":
     logger.info("\n" + "="*80)
     logger.info("E-COMMERCE CHATBOT APPLICATION")
-    logger.info(f"Session Start: {datetime.now().isoformat()}")
+    logger.info("Session Start: %s", datetime.now().isoformat())
     logger.info("="*80 + "\n")
     
     try:
@@ -364,10 +572,13 @@ if __name__ == "__main__":
     except Exception as e:
         logger.critical("="*80)
         logger.critical("CRITICAL APPLICATION ERROR")
-        logger.critical(f"Error: {str(e)}")
+        logger.critical("Error: %s", str(e))
         logger.critical("="*80, exc_info=True)
         st.error("A critical error occurred. Please check the logs.")
     
+    if startup.mark("first_render"):
+        startup.write_report()
+    
     logger.info("\n" + "="*80)
     logger.info("Application session ended")
     logger.info("="*80 + "\n")
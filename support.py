@@ -1,8 +1,11 @@
 import streamlit as st
-from datetime import datetime
 from db import init_collections
+from ticket_service import get_ticket_service
 
-def handle_support_request():
+# Seconds to wait for the background write before showing the ticket as pending
+CONFIRM_TIMEOUT = 3.0
+
+def handle_support_request(collections=None):
     """Handle support ticket creation with validation"""
     
     st.header("🆘 Create Support Ticket")
@@ -50,21 +53,21 @@ def handle_support_request():
                 return "Issue description is required"
             
             try:
-                collections = init_collections()
+                if collections is None:
+                    collections = init_collections()
                 
-                ticket = {
-                    "ticket_number": f"TKT-{int(datetime.now().timestamp())}",
-                    "customer_name": name.strip(),
-                    "customer_email": email.strip(),
-                    "category": category,
-                    "issue": issue.strip(),
-                    "priority": priority.lower(),
-                    "status": "open",
-                    "created_at": datetime.now(),
-                    "updated_at": datetime.now()
-                }
+                # Written in the background in batches; the number is allocated up front
+                queued = get_ticket_service(collections).submit_ticket(
+                    name, email, category, issue, priority
+                )
+                ticket = queued.ticket
                 
-                result = collections['support_tickets'].insert_one(ticket)
+                if not queued.wait(CONFIRM_TIMEOUT):
+                    # Still retrying in the background - don't claim it exists yet
+                    st.warning("⏳ Ticket submitted - saving is taking longer than usual")
+                    st.info(f"**Reference Number:** {ticket['ticket_number']}")
+                    st.info("**Status:** Pending - it will be saved automatically once the database responds")
+                    return f"Support ticket {ticket['ticket_number']} pending"
                 
                 st.success(f"✅ Ticket created successfully!")
                 st.info(f"**Ticket Number:** {ticket['ticket_number']}")
@@ -0,0 +1,47 @@
+"""CSV uploads: every value is a string, so numeric fields must be coerced
+
+    python -m pytest tests
+"""
+import io
+
+import pytest
+
+pytest.importorskip("streamlit")
+pytest.importorskip("pymongo")
+
+from upload import iter_records, parse_number, parse_record  # noqa: E402
+
+CSV = (
+    "Invoice Number,Customer ID,Customer name,ID_product,Product,Category,"
+    "Quantity_piece,Gross_Amount,Discount_Percentage,Total Amount,GST,COGS\r\n"
+    "INV-1,CUST001,Asha,P1,Kettle,Home,3.0,\"1,200\",5,\"1,140.50\",,80\r\n"
+    "INV-2,CUST002,Ravi,P2,Lamp,Home,2,450.00,,450,22.5,\r\n"
+).encode("utf-8")
+
+
+def test_parse_number():
+    assert parse_number("3.0", int) == 3
+    assert parse_number("1,200") == 1200.0
+    assert parse_number(" 7 ", int) == 7
+    assert parse_number("") == 0
+    assert parse_number(None, int) == 0
+    assert parse_number(12.5) == 12.5
+    with pytest.raises(ValueError):
+        parse_number("n/a")
+
+
+def test_csv_rows_keep_their_numbers():
+    records = list(iter_records(io.BytesIO(CSV)))
+    assert len(records) == 2
+
+    _, product, first = parse_record(records[0])
+    assert first["quantity"] == 3
+    assert first["gross_amount"] == 1200.0
+    assert first["total_amount"] == 1140.5
+    assert first["gst"] == 0
+    assert product["cogs"] == 80.0
+
+    _, product, second = parse_record(records[1])
+    assert second["quantity"] == 2
+    assert second["discount_percentage"] == 0
+    assert product["cogs"] == 0
@@ -0,0 +1,259 @@
+"""Support ticket numbering and write path
+
+Ticket numbers come from an atomic Mongo counter (`counters` collection),
+reserved in blocks so most tickets need no extra round trip:
+
+    TKT-00000001, TKT-00000002, ...
+
+They are unique across processes and sort in creation order. Tickets are
+written by a background thread in batches, so a burst of submissions doesn't
+block the UI; a ticket_number collision (e.g. a legacy timestamp-based
+number) is retried with a fresh number. Other write failures are retried with
+exponential backoff until they succeed - a submitted ticket is never dropped,
+and callers can wait on QueuedTicket.wait() to tell "created" from "pending".
+
+Each ticket gets its `_id` when it is built and keeps it across retries, so
+a retry after an insert that reached the server but reported an error (a
+timeout, a dropped connection) hits the `_id` index and is recognised as
+already written instead of creating a second copy.
+"""
+import atexit
+import heapq
+import itertools
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+COUNTER_ID = "support_ticket_number"
+DUPLICATE_KEY = 11000
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 30.0
+
+
+class TicketNumberAllocator:
+    """Hand out sequential ticket numbers, reserving `block_size` at a time from Mongo"""
+
+    def __init__(self, counters_collection, block_size: int = 20, prefix: str = "TKT"):
+        self.counters = counters_collection
+        self.block_size = block_size
+        self.prefix = prefix
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+
+    def _reserve_block(self):
+        doc = self.counters.find_one_and_update(
+            {"_id": COUNTER_ID},
+            {"$inc": {"seq": self.block_size}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        self._end = doc["seq"]
+        self._next = self._end - self.block_size + 1
+        logger.debug("Reserved ticket numbers %s-%s", self._next, self._end)
+
+    def next_number(self) -> str:
+        with self._lock:
+            if self._next == 0 or self._next > self._end:
+                self._reserve_block()
+            seq = self._next
+            self._next += 1
+        return f"{self.prefix}-{seq:08d}"
+
+
+class QueuedTicket:
+    """A ticket handed to the background writer, and whether it has been written"""
+
+    def __init__(self, ticket):
+        self.ticket = ticket
+        self.attempts = 0
+        self._written = threading.Event()
+
+    @property
+    def written(self) -> bool:
+        return self._written.is_set()
+
+    def wait(self, timeout: float = None) -> bool:
+        """Block until the ticket is in Mongo; False if still pending after `timeout`"""
+        return self._written.wait(timeout)
+
+
+class TicketService:
+    """Create support tickets with collision-free numbers and batched async writes"""
+
+    def __init__(self, tickets_collection, counters_collection, batch_size: int = 50,
+                 flush_interval: float = 0.5, block_size: int = 20):
+        self.tickets = tickets_collection
+        self.allocator = TicketNumberAllocator(counters_collection, block_size=block_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        # Failed writes wait here as (due time, seq, QueuedTicket); only the writer thread touches it
+        self._retries = []
+        self._retry_seq = itertools.count()
+        self._outstanding = set()
+        self._outstanding_lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, name="ticket-writer", daemon=True)
+        self._worker.start()
+        atexit.register(self.flush)
+
+    def build_ticket(self, name, email, category, issue, priority):
+        """Ticket document with a fixed _id and a freshly allocated number"""
+        now = datetime.now()
+        return {
+            "_id": ObjectId(),
+            "ticket_number": self.allocator.next_number(),
+            "customer_name": name.strip(),
+            "customer_email": email.strip(),
+            "category": category,
+            "issue": issue.strip(),
+            "priority": priority.lower(),
+            "status": "open",
+            "created_at": now,
+            "updated_at": now
+        }
+
+    def submit_ticket(self, name, email, category, issue, priority) -> QueuedTicket:
+        """Queue a ticket for the background writer and return it immediately
+
+        The insert normally happens within `flush_interval`; call wait() on
+        the result before telling the user the ticket exists. The number
+        only changes if it collides with an existing ticket.
+        """
+        queued = QueuedTicket(self.build_ticket(name, email, category, issue, priority))
+        with self._outstanding_lock:
+            self._outstanding.add(queued)
+        self._queue.put(queued)
+        return queued
+
+    def flush(self, timeout: float = 10.0):
+        """Block until every submitted ticket has been written (or timeout)"""
+        deadline = time.monotonic() + timeout
+        with self._outstanding_lock:
+            outstanding = list(self._outstanding)
+        for queued in outstanding:
+            if not queued.wait(max(0.0, deadline - time.monotonic())):
+                logger.warning("%s support tickets still unwritten", len([q for q in outstanding if not q.written]))
+                return False
+        return True
+
+    def _pop_due_retries(self):
+        now = time.monotonic()
+        due = []
+        while self._retries and self._retries[0][0] <= now and len(due) < self.batch_size:
+            due.append(heapq.heappop(self._retries)[2])
+        return due
+
+    def _until_next_retry(self):
+        """Seconds until the earliest backed-off ticket is due (None if there are none)"""
+        if not self._retries:
+            return None
+        return max(0.0, self._retries[0][0] - time.monotonic())
+
+    def _run(self):
+        while True:
+            batch = self._pop_due_retries()
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                if batch:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                else:
+                    timeout = self._until_next_retry()
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            if batch:
+                self._write_batch(batch)
+
+    def _retry_later(self, queued, delay):
+        heapq.heappush(self._retries, (time.monotonic() + delay, next(self._retry_seq), queued))
+
+    def _backoff(self, queued):
+        return min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (queued.attempts - 1))
+
+    def _mark_written(self, queued):
+        with self._outstanding_lock:
+            self._outstanding.discard(queued)
+        queued._written.set()
+
+    def _write_batch(self, batch):
+        tickets = [queued.ticket for queued in batch]
+        try:
+            with span("mongo.insert_tickets_batch"):
+                self.tickets.insert_many(tickets, ordered=False)
+            failed = {}
+        except BulkWriteError as e:
+            failed = {err["index"]: err for err in e.details.get("writeErrors", [])}
+        except Exception as e:
+            # The inserts may still have landed; the stable _id makes the retry safe
+            logger.error("Ticket batch write failed, retrying %s tickets with backoff: %s", len(batch), e)
+            failed = {idx: {"code": None} for idx in range(len(batch))}
+
+        retried = 0
+        for idx, queued in enumerate(batch):
+            err = failed.get(idx)
+            if err is None or _is_id_conflict(err):
+                # An id conflict means an earlier attempt was written after all
+                self._mark_written(queued)
+                continue
+            retried += 1
+            queued.attempts += 1
+            if err.get("code") != DUPLICATE_KEY:
+                delay = self._backoff(queued)
+                logger.warning(
+                    "Ticket %s not written (attempt %s), retrying in %.1fs: %s",
+                    queued.ticket["ticket_number"], queued.attempts, delay, err
+                )
+                self._retry_later(queued, delay)
+                continue
+            # ticket_number collision - not transient, a fresh number fixes it
+            old_number = queued.ticket["ticket_number"]
+            try:
+                queued.ticket["ticket_number"] = self.allocator.next_number()
+            except Exception as e:
+                delay = self._backoff(queued)
+                logger.error("Could not renumber ticket %s, retrying in %.1fs: %s", old_number, delay, e)
+                self._retry_later(queued, delay)
+                continue
+            logger.warning("Ticket number %s taken, renumbered to %s", old_number, queued.ticket["ticket_number"])
+            self._retry_later(queued, 0.0)
+        logger.info("✓ Wrote %s support tickets, %s retried", len(batch) - retried, retried)
+
+
+def _is_id_conflict(err):
+    """True for a duplicate-key write error on _id rather than ticket_number"""
+    if err.get("code") != DUPLICATE_KEY:
+        return False
+    key_pattern = err.get("keyPattern")
+    if key_pattern is not None:
+        return "_id" in key_pattern
+    return "index: _id_" in err.get("errmsg", "")
+
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def get_ticket_service(collections) -> TicketService:
+    """Process-wide TicketService for the given collections dict"""
+    key = collections["support_tickets"].full_name
+    with _services_lock:
+        service = _services.get(key)
+        if service is None:
+            tickets = collections["support_tickets"]
+            service = _services[key] = TicketService(tickets, tickets.database["counters"])
+        return service
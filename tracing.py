@@ -0,0 +1,251 @@
+"""Lightweight per-stage latency tracing for chat turns
+
+Usage:
+    with trace_context(intent="SEARCH_DB"):
+        with span("retrieval"):
+            ...
+
+    @traced("classify")
+    def classify(...): ...
+
+Durations are kept per (stage, intent) in bounded reservoirs so p50/p95/p99
+can be reported exactly over the most recent samples, and exported as
+Prometheus text or JSON with `export_metrics()`.
+"""
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+METRICS_FILE = os.getenv("METRICS_FILE", "latency_metrics.json")
+QUANTILES = (0.5, 0.95, 0.99)
+
+_labels = contextvars.ContextVar("trace_labels", default={})
+_collector = contextvars.ContextVar("trace_collector", default=None)
+
+
+class LatencyHistogram:
+    """Count, sum and a bounded sample reservoir for one (stage, intent) pair"""
+
+    def __init__(self, max_samples: int = 10000):
+        self.count = 0
+        self.total = 0.0
+        self.samples = deque(maxlen=max_samples)
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.samples.append(seconds)
+
+    def quantiles(self, quantiles=QUANTILES) -> dict:
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {q: 0.0 for q in quantiles}
+        return {
+            q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+            for q in quantiles
+        }
+
+
+class Tracer:
+    """Thread-safe registry of latency histograms keyed by (stage, intent)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def observe(self, stage: str, seconds: float, intent: str = None):
+        key = (stage, intent or "ALL")
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = LatencyHistogram()
+            histogram.observe(seconds)
+
+    def summary(self) -> list:
+        """Return one row per (stage, intent) with count, mean and p50/p95/p99 in ms"""
+        with self._lock:
+            items = [(key, h.count, h.total, h.quantiles()) for key, h in self._histograms.items()]
+        rows = []
+        for (stage, intent), count, total, quantiles in sorted(items):
+            rows.append({
+                "stage": stage,
+                "intent": intent,
+                "count": count,
+                "mean_ms": round(total / count * 1000, 2) if count else 0.0,
+                "p50_ms": round(quantiles[0.5] * 1000, 2),
+                "p95_ms": round(quantiles[0.95] * 1000, 2),
+                "p99_ms": round(quantiles[0.99] * 1000, 2),
+            })
+        return rows
+
+    def to_prometheus(self) -> str:
+        """Render histograms as a Prometheus text-format summary"""
+        with self._lock:
+            items = [(key, h.count, h.total, h.quantiles()) for key, h in self._histograms.items()]
+        lines = [
+            "# HELP chatbot_stage_latency_seconds Latency of each chat-turn stage",
+            "# TYPE chatbot_stage_latency_seconds summary",
+        ]
+        for (stage, intent), count, total, quantiles in sorted(items):
+            labels = f'stage="{stage}",intent="{intent}"'
+            for q, value in quantiles.items():
+                lines.append(f'chatbot_stage_latency_seconds{{{labels},quantile="{q}"}} {value:.6f}')
+            lines.append(f"chatbot_stage_latency_seconds_sum{{{labels}}} {total:.6f}")
+            lines.append(f"chatbot_stage_latency_seconds_count{{{labels}}} {count}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+
+tracer = Tracer()
+
+
+def record(stage: str, seconds: float):
+    """Record a duration in the global tracer and any active span collector"""
+    tracer.observe(stage, seconds, _labels.get().get("intent"))
+    spans = _collector.get()
+    if spans is not None:
+        spans[stage] = spans.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def trace_context(**labels):
+    """Attach labels (e.g. intent) to every span opened inside this block"""
+    token = _labels.set({**_labels.get(), **labels})
+    try:
+        yield
+    finally:
+        _labels.reset(token)
+
+
+def current_labels() -> dict:
+    """Labels of the current context (intent, session, ...)"""
+    return _labels.get()
+
+
+def set_trace_label(**labels):
+    """Update labels for the rest of the current context (e.g. once intent is known)"""
+    _labels.set({**_labels.get(), **labels})
+
+
+@contextmanager
+def span(stage: str):
+    """Time a block and record it under `stage` and the current intent label"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        record(stage, elapsed)
+        logger.debug("span %s (intent=%s): %.1f ms", stage, _labels.get().get("intent"), elapsed * 1000)
+
+
+@contextmanager
+def collect_spans():
+    """Collect {stage: seconds} for every span recorded in this context
+
+    Used for per-request latency breakdowns (e.g. batch_qa output rows).
+    """
+    spans = {}
+    token = _collector.set(spans)
+    try:
+        yield spans
+    finally:
+        _collector.reset(token)
+
+
+def traced(stage: str):
+    """Decorator form of `span`"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def export_metrics(path: str = None) -> str:
+    """Write latency metrics to `path` (.prom/.txt for Prometheus text, otherwise JSON)"""
+    path = path or METRICS_FILE
+    if path.endswith((".prom", ".txt")):
+        content = tracer.to_prometheus()
+    else:
+        content = json.dumps(
+            {"generated_at": datetime.now().isoformat(), "stages": tracer.summary()},
+            indent=2
+        )
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+    return path
+
+
+_callback_class = None
+
+
+def langchain_callback():
+    """Return a fresh LangChain callback handler that times retrieval and LLM calls
+
+    Pass it per invocation (`config={"callbacks": [langchain_callback()]}`) so
+    concurrent turns don't share state. In ConversationalRetrievalChain, LLM
+    calls made before retrieval are the condense-question step; calls after
+    retrieval are answer generation.
+    """
+    global _callback_class
+    if _callback_class is None:
+        from langchain_core.callbacks import BaseCallbackHandler
+
+        class StageTimingCallback(BaseCallbackHandler):
+            def __init__(self):
+                self._starts = {}
+                self._retrieved = False
+
+            def _start(self, run_id, stage):
+                self._starts[run_id] = (stage, time.perf_counter())
+
+            def _end(self, run_id):
+                entry = self._starts.pop(run_id, None)
+                if entry is not None:
+                    stage, started = entry
+                    record(stage, time.perf_counter() - started)
+
+            def _llm_stage(self):
+                return "llm_generation" if self._retrieved else "condense"
+
+            def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+                self._start(run_id, "retrieval")
+
+            def on_retriever_end(self, documents, *, run_id, **kwargs):
+                self._retrieved = True
+                self._end(run_id)
+
+            def on_retriever_error(self, error, *, run_id, **kwargs):
+                self._end(run_id)
+
+            def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+                self._start(run_id, self._llm_stage())
+
+            def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+                self._start(run_id, self._llm_stage())
+
+            def on_llm_end(self, response, *, run_id, **kwargs):
+                self._end(run_id)
+
+            def on_llm_error(self, error, *, run_id, **kwargs):
+                self._end(run_id)
+
+        _callback_class = StageTimingCallback
+    return _callback_class()
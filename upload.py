@@ -1,212 +1,387 @@
 from datetime import datetime
+from itertools import chain, islice
 from pathlib import Path
+from contextlib import ExitStack
+import csv
+import gzip
+import io
 import json
+import os
+import zipfile
 import streamlit as st
 import logging
+from pymongo import UpdateOne
 from pymongo.errors import BulkWriteError
+from tracing import span
+from columnar_store import ColumnarTransactionStore, get_columnar_store, publish_store, record_ingest
+from profiles import refresh_profiles
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('chatbot.log'),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
-def upload_json_to_mongodb(json_file_path: str, collections, clear_existing: bool = True) -> int:
-    """Upload and parse JSON file into MongoDB collections
+READ_CHUNK_CHARS = 64 * 1024
+INSERT_BATCH_SIZE = 1000
+_DETECT_BYTES = 1024
+
+
+def upload_limit():
+    """Records processed per upload from UPLOAD_MAX_DOCUMENTS (unset or 0 = all)"""
+    value = int(os.getenv("UPLOAD_MAX_DOCUMENTS", "0") or 0)
+    return value or None
+
+
+def parse_number(value, cast=float):
+    """Numeric field from a JSON or CSV record: "3.0" and "1,200" parse, empty is 0
+
+    CSV values are always strings, so integers go through float first.
+    Raises ValueError for anything else that isn't a number.
+    """
+    if isinstance(value, str):
+        value = value.replace(",", "").strip()
+    if value is None or value == "":
+        return cast(0)
+    return cast(float(value))
+
+
+def parse_record(doc):
+    """(customer, product, transaction) documents for one uploaded record"""
+    now = datetime.now()
+    cid = str(doc.get("Customer ID", "UNKNOWN")).strip()
+    pid = str(doc.get("ID_product", "UNKNOWN")).strip()
+    customer = {
+        "customer_id": cid,
+        "name": str(doc.get("Customer name", "Unknown")).strip(),
+        "email": str(doc.get("Email", "N/A")).strip(),
+        "phone": str(doc.get("Phone", "N/A")).strip(),
+        "city": str(doc.get("City", "N/A")).strip(),
+        "loyalty_tier": str(doc.get("Loyalty_Tier", "Regular")).strip(),
+        "created_at": now
+    }
+    product = {
+        "product_id": pid,
+        "name": str(doc.get("Product", "Unknown")).strip(),
+        "category": str(doc.get("Category", "N/A")).strip(),
+        "sku": str(doc.get("SKUs", "N/A")).strip(),
+        "cogs": parse_number(doc.get("COGS")),
+        "margin_percent": parse_number(doc.get("Margin_per_piece_percent")),
+        "created_at": now
+    }
+    transaction = {
+        "invoice_number": str(doc.get("Invoice Number", "N/A")).strip(),
+        "txn_number": str(doc.get("Txn_No", "N/A")).strip(),
+        "customer_id": cid,
+        "customer_name": customer["name"],
+        "product_id": pid,
+        "product_name": product["name"],
+        "category": product["category"],
+        "quantity": parse_number(doc.get("Quantity_piece"), int),
+        "gross_amount": parse_number(doc.get("Gross_Amount")),
+        "discount_percentage": parse_number(doc.get("Discount_Percentage")),
+        "total_amount": parse_number(doc.get("Total Amount")),
+        "gst": parse_number(doc.get("GST")),
+        "payment_mode": str(doc.get("Payment_mode", "N/A")).strip(),
+        "date_of_purchase": str(doc.get("Date_of_purchase", now.isoformat())).strip(),
+        "channel": str(doc.get("Channel", "N/A")).strip(),
+        "store_location": str(doc.get("Store_location", "N/A")).strip(),
+        "mode": str(doc.get("Mode", "N/A")).strip(),
+        "status": "completed",
+        "created_at": now
+    }
+    return customer, product, transaction
+
+
+def _iter_json_values(text, array: bool):
+    """Incrementally decode a JSON array's elements, or whitespace-separated JSON values (NDJSON)"""
+    decoder = json.JSONDecoder()
+    buf, pos, eof = "", 0, False
+    if array:
+        buf = text.read(READ_CHUNK_CHARS).lstrip()
+        if not buf.startswith("["):
+            raise json.JSONDecodeError("Expected '['", buf, 0)
+        pos = 1
+    while True:
+        while pos < len(buf) and (buf[pos].isspace() or (array and buf[pos] == ",")):
+            pos += 1
+        if pos >= len(buf):
+            if eof:
+                if array:
+                    raise json.JSONDecodeError("Unterminated array", buf, pos)
+                return
+            buf, pos = text.read(READ_CHUNK_CHARS), 0
+            eof = not buf
+            continue
+        if array and buf[pos] == "]":
+            return
+        try:
+            value, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            # Value straddles the chunk boundary - read more and retry
+            more = "" if eof else text.read(READ_CHUNK_CHARS)
+            if not more:
+                raise
+            buf, pos = buf[pos:] + more, 0
+            continue
+        yield value
+        pos = end
+        if pos > READ_CHUNK_CHARS:
+            buf, pos = buf[pos:], 0
+
+
+def _peek(stream, size=_DETECT_BYTES):
+    return stream.peek(size)[:size]
+
+
+def _open_stream(source, stack):
+    if isinstance(source, (str, Path)):
+        return stack.enter_context(open(source, "rb"))
+    if hasattr(source, "peek"):
+        return source
+    # Buffer a plain stream (BytesIO, UploadedFile) for peeking; detach so the caller's object stays open
+    stream = io.BufferedReader(source)
+    stack.callback(stream.detach)
+    return stream
+
+
+def iter_records(source):
+    """Stream records from a path or binary file-like object
+
+    Detects gzip and zip compression from magic bytes, then JSON arrays,
+    JSON objects / NDJSON and CSV (header row) from the content.
+    """
+    with ExitStack() as stack:
+        yield from _iter_records(_open_stream(source, stack), stack)
+
+
+def _iter_records(stream, stack):
+    head = _peek(stream)
+    if head.startswith(b"\x1f\x8b"):
+        logger.info("Detected gzip compression")
+        stream = stack.enter_context(gzip.GzipFile(fileobj=stream))
+        head = _peek(stream)
+    elif head.startswith(b"PK\x03\x04"):
+        archive = stack.enter_context(zipfile.ZipFile(stream))
+        members = [info for info in archive.infolist()
+                   if not info.is_dir() and not info.filename.startswith("__MACOSX/")]
+        if not members:
+            raise ValueError("Zip archive contains no files")
+        logger.info("Detected zip archive, reading %s", members[0].filename)
+        stream = stack.enter_context(archive.open(members[0]))
+        head = _peek(stream)
+
+    first = head.lstrip(b"\xef\xbb\xbf \t\r\n")[:1]
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    stack.callback(text.detach)
+    if first == b"[":
+        logger.info("Detected JSON array")
+        return _iter_json_values(text, array=True)
+    if first == b"{":
+        logger.info("Detected JSON object / NDJSON")
+        return _iter_json_values(text, array=False)
+    logger.info("Detected CSV")
+    return csv.DictReader(text)
+
+
+STAGED_COLLECTIONS = ("customers", "products", "transactions")
+STAGING_SUFFIX = "_upload_staging"
+
+
+def _staging_collections(collections):
+    """Empty scratch collections beside the live ones, carrying the same indexes"""
+    staged = dict(collections)
+    for key in STAGED_COLLECTIONS:
+        live = collections[key]
+        live.database.drop_collection(live.name + STAGING_SUFFIX)
+        # Created up front so the rename succeeds even if nothing is written
+        staging = live.database.create_collection(live.name + STAGING_SUFFIX)
+        for name, info in live.index_information().items():
+            if name != "_id_":
+                staging.create_index(info["key"], name=name, unique=info.get("unique", False))
+        staged[key] = staging
+    return staged
+
+
+def _swap_in(staged, collections):
+    """Rename each staging collection over its live counterpart"""
+    for key in STAGED_COLLECTIONS:
+        staged[key].rename(collections[key].name, dropTarget=True)
+        logger.info("✓ Swapped in %s", collections[key].name)
+
+
+def _drop_staging(staged, collections):
+    for key in STAGED_COLLECTIONS:
+        if staged[key] is not collections[key]:
+            try:
+                staged[key].drop()
+            except Exception as e:
+                logger.warning("Could not drop %s: %s", staged[key].name, e)
+
+
+def _upsert(collection, key, documents):
+    """Upsert documents by `key`; returns (inserted, updated)"""
+    if not documents:
+        return 0, 0
+    requests = [UpdateOne({key: doc[key]}, {"$set": doc}, upsert=True) for doc in documents]
+    try:
+        result = collection.bulk_write(requests, ordered=False)
+        return result.upserted_count, result.modified_count
+    except BulkWriteError as e:
+        logger.warning("Partial %s upsert: %s failed", collection.name, len(e.details.get('writeErrors', [])))
+        return e.details.get("nUpserted", 0), e.details.get("nModified", 0)
+
+
+def upload_json_to_mongodb(source, collections, clear_existing: bool = True,
+                           max_documents: int = None) -> int:
+    """Upload and parse a sales export into MongoDB collections
+    
+    With clear_existing, records are written to staging collections that
+    replace the live ones only once the whole upload has been read, so a
+    malformed or truncated file leaves the existing data untouched.
+    Customers and products are upserted batch by batch together with
+    their transactions.
     
     Args:
-        json_file_path: Path to JSON file
+        source: Path or binary file-like object (e.g. the Streamlit upload buffer)
+            holding a JSON array, NDJSON or CSV, optionally gzip- or zip-compressed
         collections: MongoDB collections dict
-        clear_existing: If True, delete existing data before upload
+        clear_existing: If True, replace existing data with the upload
+        max_documents: Only process this many documents (None for all; the
+            app passes upload_limit())
     
     Returns:
         Number of transactions uploaded
     """
     
-    logger.info(f"Starting upload process for file: {json_file_path}")
-    logger.info(f"Clear existing data: {clear_existing}")
+    name = source if isinstance(source, (str, Path)) else getattr(source, "name", "<stream>")
+    logger.info("Starting upload process for: %s", name)
+    logger.info("Clear existing data: %s", clear_existing)
     
-    if not Path(json_file_path).exists():
-        logger.error(f"File not found: {json_file_path}")
-        raise FileNotFoundError(f"JSON file not found: {json_file_path}")
+    if isinstance(source, (str, Path)) and not Path(source).exists():
+        logger.error("File not found: %s", source)
+        raise FileNotFoundError(f"Upload file not found: {source}")
     
+    target = collections
+    staged_store = None
+    customer_ids = set()
+    product_ids = set()
+    swapped = False
     try:
-        # Read JSON file
-        logger.info("Reading JSON file...")
-        with open(json_file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        # Handle both list and dict formats
-        documents = data if isinstance(data, list) else [data]
-        logger.info(f"Total documents in file: {len(documents)}")
+        # Records are parsed as they are read - nothing is staged on disk
+        records = iter_records(source)
+        if max_documents is not None:
+            records = islice(records, max_documents)
+            logger.info("Processing at most %s documents", max_documents)
         
-        # Limit to first 100 documents
-        documents = documents[:100]
-        logger.info(f"Processing first 100 documents (actual: {len(documents)})")
+        first = next(records, None)
+        if first is None:
+            logger.error("No documents found in upload")
+            raise ValueError("No documents found in upload")
         
-        if not documents:
-            logger.error("No documents found in JSON file")
-            raise ValueError("No documents found in JSON file")
-        
-        # Clear existing data if requested
         if clear_existing:
-            logger.info("Clearing existing data from collections...")
-            customers_deleted = collections["customers"].delete_many({}).deleted_count
-            products_deleted = collections["products"].delete_many({}).deleted_count
-            transactions_deleted = collections["transactions"].delete_many({}).deleted_count
-            logger.info(f"Deleted: {customers_deleted} customers, {products_deleted} products, {transactions_deleted} transactions")
+            logger.info("Staging upload; existing data is replaced once it completes")
+            target = _staging_collections(collections)
+            if get_columnar_store(collections, load=False) is not None:
+                staged_store = ColumnarTransactionStore()
         else:
             logger.info("Keeping existing data (append mode)")
         
-        # Initialize storage dicts
-        customers_dict = {}
-        products_dict = {}
+        customers = []
+        products = []
         transactions = []
+        counts = {"customers": 0, "products": 0, "transactions": 0, "updated": 0}
+        
+        def flush():
+            """Write one batch of customers, products and their transactions"""
+            for key, field, docs in (("customers", "customer_id", customers),
+                                     ("products", "product_id", products)):
+                inserted, updated = _upsert(target[key], field, docs)
+                counts[key] += inserted
+                counts["updated"] += updated
+            
+            batch = list(transactions)
+            customers.clear()
+            products.clear()
+            transactions.clear()
+            if not batch:
+                return
+            logger.info("Inserting %s transactions...", len(batch))
+            try:
+                with span("mongo.insert_transactions"):
+                    result = target["transactions"].insert_many(batch, ordered=False)
+                counts["transactions"] += len(result.inserted_ids)
+            except BulkWriteError as e:
+                # Some transactions may have been inserted before error
+                inserted = e.details.get('nInserted', 0)
+                counts["transactions"] += inserted
+                logger.warning("Partial transaction insert: %s succeeded", inserted)
+                logger.error("BulkWriteError: %s", e.details)
+                failed = {err["index"] for err in e.details.get("writeErrors", [])}
+                batch = [txn for idx, txn in enumerate(batch) if idx not in failed]
+            # Keep the in-memory analytics columns in step with the collection
+            if staged_store is not None:
+                staged_store.append(batch)
+            elif not clear_existing:
+                record_ingest(collections, batch)
         
         # Process each document
         logger.info("Processing documents...")
         processed_count = 0
         error_count = 0
         
-        for idx, doc in enumerate(documents, 1):
+        for idx, doc in enumerate(chain([first], records), 1):
             try:
-                # Extract customer data
-                cid = str(doc.get("Customer ID", "UNKNOWN")).strip()
-                if cid and cid not in customers_dict:
-                    customers_dict[cid] = {
-                        "customer_id": cid,
-                        "name": str(doc.get("Customer name", "Unknown")).strip(),
-                        "email": str(doc.get("Email", "N/A")).strip(),
-                        "phone": str(doc.get("Phone", "N/A")).strip(),
-                        "city": str(doc.get("City", "N/A")).strip(),
-                        "loyalty_tier": str(doc.get("Loyalty_Tier", "Regular")).strip(),
-                        "created_at": datetime.now()
-                    }
-                    logger.debug(f"Added new customer: {cid}")
-                
-                # Extract product data
-                pid = str(doc.get("ID_product", "UNKNOWN")).strip()
-                if pid and pid not in products_dict:
-                    products_dict[pid] = {
-                        "product_id": pid,
-                        "name": str(doc.get("Product", "Unknown")).strip(),
-                        "category": str(doc.get("Category", "N/A")).strip(),
-                        "sku": str(doc.get("SKUs", "N/A")).strip(),
-                        "cogs": float(doc.get("COGS", 0)) if doc.get("COGS") else 0,
-                        "margin_percent": float(doc.get("Margin_per_piece_percent", 0)) 
-                                        if doc.get("Margin_per_piece_percent") else 0,
-                        "created_at": datetime.now()
-                    }
-                    logger.debug(f"Added new product: {pid}")
-                
-                # Extract transaction data
-                transactions.append({
-                    "invoice_number": str(doc.get("Invoice Number", "N/A")).strip(),
-                    "txn_number": str(doc.get("Txn_No", "N/A")).strip(),
-                    "customer_id": cid,
-                    "customer_name": str(doc.get("Customer name", "Unknown")).strip(),
-                    "product_id": pid,
-                    "product_name": str(doc.get("Product", "Unknown")).strip(),
-                    "category": str(doc.get("Category", "N/A")).strip(),
-                    "quantity": int(doc.get("Quantity_piece", 0)) if doc.get("Quantity_piece") else 0,
-                    "gross_amount": float(doc.get("Gross_Amount", 0)) if doc.get("Gross_Amount") else 0,
-                    "discount_percentage": float(doc.get("Discount_Percentage", 0)) 
-                                          if doc.get("Discount_Percentage") else 0,
-                    "total_amount": float(doc.get("Total Amount", 0)) if doc.get("Total Amount") else 0,
-                    "gst": float(doc.get("GST", 0)) if doc.get("GST") else 0,
-                    "payment_mode": str(doc.get("Payment_mode", "N/A")).strip(),
-                    "date_of_purchase": str(doc.get("Date_of_purchase", datetime.now().isoformat())).strip(),
-                    "channel": str(doc.get("Channel", "N/A")).strip(),
-                    "store_location": str(doc.get("Store_location", "N/A")).strip(),
-                    "mode": str(doc.get("Mode", "N/A")).strip(),
-                    "status": "completed",
-                    "created_at": datetime.now()
-                })
+                customer, product, transaction = parse_record(doc)
+                cid, pid = customer["customer_id"], product["product_id"]
+                if cid and cid not in customer_ids:
+                    customers.append(customer)
+                    customer_ids.add(cid)
+                    logger.debug("Added new customer: %s", cid)
+                if pid and pid not in product_ids:
+                    products.append(product)
+                    product_ids.add(pid)
+                    logger.debug("Added new product: %s", pid)
+                transactions.append(transaction)
                 processed_count += 1
                 
-                if idx % 25 == 0:
-                    logger.info(f"Processed {idx}/{len(documents)} documents...")
+                if len(transactions) >= INSERT_BATCH_SIZE:
+                    flush()
+                    logger.info("Processed %s documents...", idx)
             
             except Exception as e:
                 error_count += 1
-                logger.warning(f"Error processing document {idx}: {str(e)}")
+                logger.warning("Error processing document %s: %s", idx, e)
                 continue
         
-        logger.info(f"Document processing complete. Success: {processed_count}, Errors: {error_count}")
-        
-        # Insert data into MongoDB with upsert for customers and products
-        inserted_counts = {"customers": 0, "products": 0, "transactions": 0}
-        
-        # UPSERT customers (update if exists, insert if new)
-        if customers_dict:
-            logger.info(f"Upserting {len(customers_dict)} customers...")
-            upserted_count = 0
-            updated_count = 0
-            
-            for customer in customers_dict.values():
-                try:
-                    result = collections["customers"].update_one(
-                        {"customer_id": customer["customer_id"]},
-                        {"$set": customer},
-                        upsert=True
-                    )
-                    if result.upserted_id:
-                        upserted_count += 1
-                    elif result.modified_count > 0:
-                        updated_count += 1
-                except Exception as e:
-                    logger.warning(f"Error upserting customer {customer['customer_id']}: {e}")
-            
-            inserted_counts["customers"] = upserted_count
-            logger.info(f"✓ Customers - Inserted: {upserted_count}, Updated: {updated_count}")
-        
-        # UPSERT products (update if exists, insert if new)
-        if products_dict:
-            logger.info(f"Upserting {len(products_dict)} products...")
-            upserted_count = 0
-            updated_count = 0
-            
-            for product in products_dict.values():
-                try:
-                    result = collections["products"].update_one(
-                        {"product_id": product["product_id"]},
-                        {"$set": product},
-                        upsert=True
-                    )
-                    if result.upserted_id:
-                        upserted_count += 1
-                    elif result.modified_count > 0:
-                        updated_count += 1
-                except Exception as e:
-                    logger.warning(f"Error upserting product {product['product_id']}: {e}")
-            
-            inserted_counts["products"] = upserted_count
-            logger.info(f"✓ Products - Inserted: {upserted_count}, Updated: {updated_count}")
+        flush()
+        logger.info("Document processing complete. Success: %s, Errors: %s", processed_count, error_count)
+        logger.info("✓ Customers - Inserted: %s, Products - Inserted: %s, Updated: %s",
+                    counts['customers'], counts['products'], counts['updated'])
+        logger.info("✓ Inserted %s transactions", counts['transactions'])
         
-        # INSERT transactions (always insert new transactions)
-        if transactions:
-            logger.info(f"Inserting {len(transactions)} transactions...")
-            try:
-                result = collections["transactions"].insert_many(transactions, ordered=False)
-                inserted_counts["transactions"] = len(result.inserted_ids)
-                logger.info(f"✓ Inserted {inserted_counts['transactions']} transactions")
-            except BulkWriteError as e:
-                # Some transactions may have been inserted before error
-                inserted_counts["transactions"] = e.details.get('nInserted', 0)
-                logger.warning(f"Partial transaction insert: {inserted_counts['transactions']} succeeded")
-                logger.error(f"BulkWriteError: {e.details}")
+        if clear_existing:
+            _swap_in(target, collections)
+            swapped = True
+            if staged_store is not None:
+                publish_store(collections, staged_store)
         
-        logger.info(f"Upload complete! Total transactions: {inserted_counts['transactions']}")
-        return inserted_counts["transactions"]
+        logger.info("Upload complete! Total transactions: %s", counts['transactions'])
+        return counts["transactions"]
     
     except json.JSONDecodeError as e:
-        logger.error(f"Invalid JSON format: {str(e)}")
+        logger.error("Invalid JSON format: %s", e)
         raise ValueError(f"Invalid JSON format: {str(e)}")
+    except (csv.Error, UnicodeDecodeError, EOFError, zipfile.BadZipFile, gzip.BadGzipFile) as e:
+        logger.error("Unreadable upload: %s", e)
+        raise ValueError(f"Unreadable upload: {str(e)}")
     except Exception as e:
-        logger.error(f"Error uploading data: {str(e)}", exc_info=True)
+        logger.error("Error uploading data: %s", e, exc_info=True)
         raise Exception(f"Error uploading data: {str(e)}")
+    finally:
+        if target is not collections and not swapped:
+            logger.info("Upload failed; discarding staged data, existing data kept")
+            _drop_staging(target, collections)
+        elif swapped or customer_ids or product_ids:
+            # Recompute profiles for what landed in the live collections -
+            # after a partial append too, so profiles match the transactions
+            try:
+                refresh_profiles(collections, customer_ids, product_ids, cleared=swapped)
+            except Exception as e:
+                logger.warning("Profile refresh failed: %s", e)
@@ -1,21 +1,38 @@
-import tiktoken
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 import logging
+import threading
+from tracing import span
 
 logger = logging.getLogger(__name__)
 
 class TokenCounter:
-    """Count tokens using tiktoken for accurate token usage"""
+    """Count tokens using tiktoken for accurate token usage
+
+    The encoding is loaded on first use (or by the startup warm-up thread)
+    so importing this module stays cheap.
+    """
     
     def __init__(self):
-        logger.debug("Initializing TokenCounter...")
-        try:
-            self.encoding = tiktoken.get_encoding("cl100k_base")
-            logger.info("✓ TokenCounter initialized with cl100k_base encoding")
-        except Exception as e:
-            logger.warning(f"Failed to load tiktoken encoding: {e}")
-            logger.warning("Falling back to estimation method")
-            self.encoding = None
+        self._encoding = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def encoding(self):
+        """Load the cl100k_base encoding once, on first access"""
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    logger.debug("Initializing TokenCounter...")
+                    try:
+                        import tiktoken
+                        self._encoding = tiktoken.get_encoding("cl100k_base")
+                        logger.info("✓ TokenCounter initialized with cl100k_base encoding")
+                    except Exception as e:
+                        logger.warning("Failed to load tiktoken encoding: %s", e)
+                        logger.warning("Falling back to estimation method")
+                        self._encoding = None
+                    self._loaded = True
+        return self._encoding
 
     def count_tokens(self, text: str) -> int:
         """Count tokens in text"""
@@ -36,27 +53,9 @@ class TokenCounter:
 
 token_counter = TokenCounter()
 
-def mongodb_to_searchable_text(transactions_collection):
-    """Convert MongoDB transactions to searchable text chunks"""
-    
-    logger.info("Converting MongoDB transactions to searchable text...")
-    
-    try:
-        logger.debug("Fetching transactions from MongoDB (limit: 200)...")
-        transactions = list(transactions_collection.find().limit(200))
-        
-        if not transactions:
-            logger.error("No transactions found in MongoDB")
-            raise ValueError("No transactions found in MongoDB")
-        
-        logger.info(f"✓ Retrieved {len(transactions)} transactions")
-        
-        # Create searchable text from transactions
-        texts = []
-        logger.debug("Converting transactions to text format...")
-        
-        for idx, txn in enumerate(transactions, 1):
-            text = f"""
+def transaction_to_text(txn):
+    """Render one transaction document as the text that gets embedded"""
+    return f"""
 Transaction Details:
 Invoice Number: {txn.get("invoice_number", "N/A")}
 Transaction Number: {txn.get("txn_number", "N/A")}
@@ -75,30 +74,192 @@ Channel: {txn.get("channel", "N/A")}
 Store Location: {txn.get("store_location", "N/A")}
 Status: {txn.get("status", "N/A")}
 """
-            texts.append(text)
-            
-            if idx % 50 == 0:
-                logger.debug(f"Processed {idx}/{len(transactions)} transactions...")
-        
-        logger.info(f"✓ Converted {len(texts)} transactions to text")
-        
-        # Split text into chunks for better retrieval
-        logger.info("Splitting text into chunks...")
-        splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            separators=["\n\n", "\n", " ", ""]
-        )
-        
-        logger.debug("Performing text splitting...")
-        combined_text = "\n".join(texts)
-        logger.debug(f"Combined text length: {len(combined_text)} characters")
-        
-        chunks = splitter.split_text(combined_text)
+
+def transaction_metadata(txn):
+    """Filterable fields stored alongside each embedded transaction"""
+    return {
+        "invoice_number": txn.get("invoice_number", "N/A"),
+        "customer_id": txn.get("customer_id", "N/A"),
+        "product_id": txn.get("product_id", "N/A"),
+        "category": txn.get("category", "N/A"),
+        "store_location": txn.get("store_location", "N/A"),
+        "channel": txn.get("channel", "N/A"),
+        "date_of_purchase": str(txn.get("date_of_purchase", "N/A")),
+    }
+
+# Only the fields transaction_to_text/transaction_metadata read are fetched
+RENDERED_FIELDS = (
+    "invoice_number", "txn_number", "customer_id", "customer_name", "customer_email",
+    "product_id", "product_name", "category", "quantity", "gross_amount",
+    "discount_percentage", "total_amount", "gst", "payment_mode", "date_of_purchase",
+    "channel", "store_location", "status",
+)
+TRANSACTION_PROJECTION = {field: 1 for field in RENDERED_FIELDS}
+
+# Documents per server round trip; large enough to amortise latency,
+# small enough that a batch of rendered fields stays well under 16MB
+CURSOR_BATCH_SIZE = 2000
+
+def iter_transactions(transactions_collection, limit: int = 0, id_range=None,
+                      batch_size: int = CURSOR_BATCH_SIZE):
+    """Stream projected transaction documents from a server-side cursor
+    
+    Args:
+        transactions_collection: MongoDB collection
+        limit: Stop after this many documents (0 for all)
+        id_range: Optional (lower, upper) `_id` bounds, lower inclusive,
+            upper exclusive; None on either side means unbounded
+        batch_size: Cursor batch size
+    """
+    query = {}
+    if id_range is not None:
+        lower, upper = id_range
+        bounds = {}
+        if lower is not None:
+            bounds["$gte"] = lower
+        if upper is not None:
+            bounds["$lt"] = upper
+        if bounds:
+            query["_id"] = bounds
+    
+    cursor = transactions_collection.find(query, dict(TRANSACTION_PROJECTION), batch_size=batch_size)
+    if id_range is not None:
+        cursor = cursor.sort("_id", 1)
+    if limit:
+        cursor = cursor.limit(limit)
+    try:
+        yield from cursor
+    finally:
+        cursor.close()
+
+def split_id_ranges(transactions_collection, parts: int):
+    """Split the collection into `parts` contiguous `_id` ranges of similar size
+    
+    Uses $bucketAuto on the `_id` index; returns [(lower, upper), ...] for
+    iter_transactions, the first and last ranges open-ended.
+    """
+    if parts <= 1:
+        return [(None, None)]
+    with span("mongo.split_id_ranges"):
+        buckets = list(transactions_collection.aggregate([
+            {"$project": {"_id": 1}},
+            {"$bucketAuto": {"groupBy": "$_id", "buckets": parts}}
+        ]))
+    if len(buckets) <= 1:
+        return [(None, None)]
+    boundaries = [bucket["_id"]["min"] for bucket in buckets[1:]]
+    lowers = [None] + boundaries
+    uppers = boundaries + [None]
+    return list(zip(lowers, uppers))
+
+def _document_batches(transactions, batch_size):
+    texts, metadatas = [], []
+    for txn in transactions:
+        texts.append(transaction_to_text(txn))
+        metadatas.append(transaction_metadata(txn))
+        if len(texts) >= batch_size:
+            yield texts, metadatas
+            texts, metadatas = [], []
+    if texts:
+        yield texts, metadatas
+
+def iter_document_batches(transactions_collection, batch_size: int = 256, limit: int = 0,
+                          workers: int = 1):
+    """Lazily yield (texts, metadatas) batches, one document per transaction
+    
+    With `workers` > 1 the collection is split into `_id` ranges that are read
+    concurrently; batches then arrive in completion order, not `_id` order.
+    A bounded queue keeps readers from running far ahead of the consumer.
+    """
+    if workers <= 1:
+        yield from _document_batches(iter_transactions(transactions_collection, limit), batch_size)
+        return
+    
+    import queue
+    from concurrent.futures import ThreadPoolExecutor
+    
+    ranges = split_id_ranges(transactions_collection, workers)
+    batches = queue.Queue(maxsize=workers * 2)
+    stop = threading.Event()
+    done = object()
+    
+    def read_range(id_range):
+        try:
+            for batch in _document_batches(iter_transactions(transactions_collection, id_range=id_range), batch_size):
+                while not stop.is_set():
+                    try:
+                        batches.put(batch, timeout=0.5)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+        finally:
+            batches.put(done)
+    
+    yielded = 0
+    with ThreadPoolExecutor(max_workers=len(ranges), thread_name_prefix="mongo-export") as pool:
+        futures = [pool.submit(read_range, id_range) for id_range in ranges]
+        try:
+            remaining = len(ranges)
+            while remaining:
+                batch = batches.get()
+                if batch is done:
+                    remaining -= 1
+                    continue
+                if limit:
+                    texts, metadatas = batch
+                    batch = texts[:limit - yielded], metadatas[:limit - yielded]
+                yielded += len(batch[0])
+                yield batch
+                if limit and yielded >= limit:
+                    break
+        finally:
+            stop.set()
+            # Unblock readers waiting on a full queue
+            while any(not f.done() for f in futures):
+                try:
+                    batches.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+        for future in futures:
+            future.result()
+
+def chunk_texts(text_batches, chunk_size: int = 1000, chunk_overlap: int = 200):
+    """Yield chunks of each batch of rendered transactions, joined and split as one text"""
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        separators=["\n\n", "\n", " ", ""]
+    )
+    
+    for texts in text_batches:
+        yield from splitter.split_text("\n".join(texts))
+
+def iter_searchable_chunks(transactions_collection, limit: int = 0, batch_size: int = 500,
+                           chunk_size: int = 1000, chunk_overlap: int = 200):
+    """Yield text chunks for the transactions, splitting `batch_size` transactions at a time"""
+    batches = iter_document_batches(transactions_collection, batch_size=batch_size, limit=limit)
+    yield from chunk_texts((texts for texts, _ in batches), chunk_size, chunk_overlap)
+
+def mongodb_to_searchable_text(transactions_collection, limit: int = 200):
+    """Convert MongoDB transactions to searchable text chunks (first `limit`, 0 for all)
+    
+    Transactions are streamed with a projection and split batch by batch, so
+    only one batch of rendered text is held at a time besides the chunks.
+    """
+    
+    logger.info("Converting MongoDB transactions to searchable text...")
+    
+    try:
+        logger.debug("Streaming transactions from MongoDB (limit: %s)...", limit)
+        with span("mongo.export_transactions"):
+            chunks = list(iter_searchable_chunks(transactions_collection, limit=limit))
         
         if not chunks:
-            logger.error("No chunks created from transactions")
-            raise ValueError("No chunks created from transactions")
+            logger.error("No transactions found in MongoDB")
+            raise ValueError("No transactions found in MongoDB")
         
         logger.info(f"✓ Created {len(chunks)} text chunks")
         logger.debug(f"Chunk size range: {min(len(c) for c in chunks)} - {max(len(c) for c in chunks)} chars")
@@ -0,0 +1,390 @@
+"""Configurable FAISS index construction for the retrieval vector store
+
+Index types:
+    flat      exact search (IndexFlatL2, what FAISS.from_texts builds)
+    ivf_flat  inverted lists over k-means cells, full vectors
+    ivf_pq    inverted lists with product-quantized vectors (smallest memory)
+    hnsw      graph-based search, no training
+
+Vector storage can be made compact independently of the index type:
+float16 or int8 scalar quantization (VECTOR_STORAGE) and/or a PCA projection
+to fewer dimensions (VECTOR_PCA_DIMS). The compact index then only produces
+candidates: the float32 vectors are written to a memory-mapped .npy file
+(VECTOR_FULL_PRECISION_DIR), shared by every process serving the same
+corpus, and the top `rescore_factor * k` candidates are rescored exactly
+from it (RescoringIndex).
+
+The result is a regular LangChain FAISS vector store, so `as_retriever()` and
+the retrieval chain work unchanged. Configure with environment variables
+(VECTOR_INDEX_TYPE, VECTOR_INDEX_NLIST, VECTOR_INDEX_NPROBE, VECTOR_INDEX_PQ_M,
+VECTOR_INDEX_HNSW_M, VECTOR_INDEX_EF_SEARCH, VECTOR_INDEX_TRAIN_SAMPLE,
+VECTOR_STORAGE, VECTOR_PCA_DIMS, VECTOR_RESCORE_FACTOR) or pass an
+IndexConfig. See benchmarks/index_report.py for recall vs. latency and
+benchmarks/compact_report.py for memory saved vs. recall lost.
+"""
+import glob
+import hashlib
+import logging
+import math
+import os
+from typing import NamedTuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+STORAGE_TYPES = ("float32", "float16", "int8")
+
+# Below this many vectors approximate indexes aren't worth training
+MIN_APPROXIMATE_VECTORS = 1000
+
+
+class IndexConfig(NamedTuple):
+    """Index type and its build/search parameters (None = choose from corpus size)"""
+    index_type: str = "flat"
+    nlist: int = None
+    nprobe: int = 8
+    pq_m: int = 16
+    pq_bits: int = 8
+    hnsw_m: int = 32
+    ef_construction: int = 80
+    ef_search: int = 64
+    train_sample: int = 50000
+    storage: str = "float32"
+    pca_dims: int = None
+    rescore_factor: int = 4
+
+    @property
+    def compact(self):
+        """True if stored vectors are lossy (quantized or PCA-reduced)"""
+        return self.storage != "float32" or bool(self.pca_dims)
+
+    @classmethod
+    def from_env(cls):
+        def _int(name, default):
+            value = os.getenv(name)
+            return int(value) if value else default
+
+        default = cls()
+        return cls(
+            index_type=os.getenv("VECTOR_INDEX_TYPE", default.index_type).lower(),
+            nlist=_int("VECTOR_INDEX_NLIST", default.nlist),
+            nprobe=_int("VECTOR_INDEX_NPROBE", default.nprobe),
+            pq_m=_int("VECTOR_INDEX_PQ_M", default.pq_m),
+            hnsw_m=_int("VECTOR_INDEX_HNSW_M", default.hnsw_m),
+            ef_search=_int("VECTOR_INDEX_EF_SEARCH", default.ef_search),
+            train_sample=_int("VECTOR_INDEX_TRAIN_SAMPLE", default.train_sample),
+            storage=os.getenv("VECTOR_STORAGE", default.storage).lower(),
+            pca_dims=_int("VECTOR_PCA_DIMS", default.pca_dims),
+            rescore_factor=_int("VECTOR_RESCORE_FACTOR", default.rescore_factor),
+        )
+
+
+# Fields that change what an index stores; nprobe, ef_search and rescore_factor are search-time only
+_BUILD_FIELDS = ("index_type", "nlist", "pq_m", "pq_bits", "hnsw_m", "ef_construction",
+                 "train_sample", "storage", "pca_dims")
+
+
+def build_signature(config: IndexConfig = None) -> dict:
+    """The IndexConfig fields a persisted index depends on (default: IndexConfig.from_env())"""
+    config = config or IndexConfig.from_env()
+    return {name: getattr(config, name) for name in _BUILD_FIELDS}
+
+
+def embedding_model_id(embeddings) -> str:
+    """Identity of an embedding model (class, model name, dimensions), past wrappers
+
+    Vectors from two models with different ids must never be compared.
+    """
+    inner = embeddings
+    while getattr(inner, "inner", None) is not None:
+        inner = inner.inner
+    parts = [type(inner).__name__]
+    for attr in ("model", "model_name", "dimensions"):
+        value = getattr(inner, attr, None)
+        if value is not None:
+            parts.append(f"{attr}={value}")
+    return ":".join(parts)
+
+
+def _pq_subquantizers(dimensions, requested):
+    """Largest m <= requested that divides the vector dimension"""
+    for m in range(min(requested, dimensions), 0, -1):
+        if dimensions % m == 0:
+            return m
+    return 1
+
+
+def create_index(vectors: np.ndarray, config: IndexConfig):
+    """Create and train (if needed) an empty FAISS index for `vectors`"""
+    import faiss
+
+    if config.index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{config.index_type}' (expected one of {INDEX_TYPES})")
+    if config.storage not in STORAGE_TYPES:
+        raise ValueError(f"Unknown vector storage '{config.storage}' (expected one of {STORAGE_TYPES})")
+
+    count, dimensions = vectors.shape
+    index_type = config.index_type
+    if index_type != "flat" and count < MIN_APPROXIMATE_VECTORS:
+        logger.info("Only %s vectors - using flat index instead of %s", count, index_type)
+        index_type = "flat"
+
+    # Vectors are stored (and searched) after the optional PCA projection
+    dims = config.pca_dims if config.pca_dims and config.pca_dims < dimensions else dimensions
+    qtype = {"float16": faiss.ScalarQuantizer.QT_fp16, "int8": faiss.ScalarQuantizer.QT_8bit}.get(config.storage)
+    min_sample = 0
+
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(dims) if qtype is None else faiss.IndexScalarQuantizer(dims, qtype)
+    elif index_type == "hnsw":
+        if qtype is None:
+            index = faiss.IndexHNSWFlat(dims, config.hnsw_m)
+        else:
+            index = faiss.IndexHNSWSQ(dims, qtype, config.hnsw_m)
+        index.hnsw.efConstruction = config.ef_construction
+        index.hnsw.efSearch = config.ef_search
+    else:
+        # IVF: ~sqrt(N) cells, with at least ~39 training points per cell
+        nlist = config.nlist or max(1, int(4 * math.sqrt(count)))
+        nlist = min(nlist, max(1, count // 39))
+        min_sample = nlist * 39
+        quantizer = faiss.IndexFlatL2(dims)
+        if index_type == "ivf_flat" and qtype is None:
+            index = faiss.IndexIVFFlat(quantizer, dims, nlist)
+        elif index_type == "ivf_flat":
+            index = faiss.IndexIVFScalarQuantizer(quantizer, dims, nlist, qtype)
+        else:
+            m = _pq_subquantizers(dims, config.pq_m)
+            index = faiss.IndexIVFPQ(quantizer, dims, nlist, m, config.pq_bits)
+        index.nprobe = config.nprobe
+        # Allows reconstruct() so filtered searches can score small candidate sets exactly
+        index.set_direct_map_type(faiss.DirectMap.Array)
+
+    if dims < dimensions:
+        index = faiss.IndexPreTransform(faiss.PCAMatrix(dimensions, dims), index)
+
+    if not index.is_trained:
+        sample_size = min(count, max(config.train_sample, min_sample))
+        if sample_size < count:
+            rng = np.random.default_rng(0)
+            sample = vectors[rng.choice(count, sample_size, replace=False)]
+        else:
+            sample = vectors
+        logger.info("Training %s index (%s, %s dims) on %s vectors...", index_type, config.storage, dims, len(sample))
+        index.train(sample)
+    return index
+
+
+def _base_index(index):
+    """The FAISS index holding the vectors, past RescoringIndex / PCA wrappers"""
+    import faiss
+
+    index = getattr(index, "compact", index)
+    if isinstance(index, faiss.IndexPreTransform):
+        index = faiss.downcast_index(index.index)
+    return index
+
+
+def set_search_params(index, nprobe: int = None, ef_search: int = None):
+    """Tune search breadth on a built index (IVF nprobe / HNSW efSearch)"""
+    import faiss
+
+    index = _base_index(index)
+    if nprobe is not None:
+        try:
+            faiss.extract_index_ivf(index).nprobe = nprobe
+        except RuntimeError:
+            pass
+    if ef_search is not None and hasattr(index, "hnsw"):
+        index.hnsw.efSearch = ef_search
+
+
+def selector_search_params(index, selector, k: int, min_nprobe: int = 32):
+    """SearchParameters restricting `index` (as built by create_index) to `selector`
+
+    Each index type needs its own parameter class - IndexHNSW and IndexIVF
+    reject plain SearchParameters - and IndexPreTransform (PCA) only accepts
+    its own wrapper around the inner index's parameters. IVF probes at least
+    `min_nprobe` lists and HNSW explores at least 4*k neighbours so that
+    selective filters still fill k results.
+    """
+    import faiss
+
+    base = _base_index(index)
+    try:
+        ivf = faiss.extract_index_ivf(base)
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=max(ivf.nprobe, min_nprobe))
+    except RuntimeError:
+        if isinstance(base, faiss.IndexHNSW):
+            params = faiss.SearchParametersHNSW(sel=selector, efSearch=max(base.hnsw.efSearch, 4 * k))
+        else:
+            params = faiss.SearchParameters(sel=selector)
+    if isinstance(getattr(index, "compact", index), faiss.IndexPreTransform):
+        params = faiss.SearchParametersPreTransform(index_params=params)
+    return params
+
+
+def embed_document_batches(batches, embeddings):
+    """Embed (texts, metadatas) batches as they arrive from the export stream
+
+    Returns:
+        (texts, metadatas, vectors) with vectors as a float32 matrix
+    """
+    texts, metadatas, blocks = [], [], []
+    for batch_texts, batch_metadatas in batches:
+        blocks.append(np.asarray(embeddings.embed_documents(batch_texts), dtype=np.float32))
+        texts.extend(batch_texts)
+        metadatas.extend(batch_metadatas)
+        logger.debug("Embedded %s documents...", len(texts))
+    if not blocks:
+        return texts, metadatas, np.empty((0, 0), dtype=np.float32)
+    return texts, metadatas, np.vstack(blocks)
+
+
+class RescoringIndex:
+    """Compact FAISS index whose top candidates are rescored at full precision
+
+    The float32 vectors are a read-only memory map, so processes serving the
+    same corpus share one copy through the page cache and only candidate
+    rows are paged in. Exposes the parts of the faiss.Index interface the
+    vector store and retrievers use (search, reconstruct, ntotal, d).
+    """
+
+    def __init__(self, compact, full_vectors, rescore_factor: int = 4):
+        self.compact = compact
+        self.full_vectors = full_vectors
+        self.rescore_factor = max(1, rescore_factor)
+
+    @property
+    def ntotal(self):
+        return self.compact.ntotal
+
+    @property
+    def d(self):
+        return self.full_vectors.shape[1]
+
+    def search(self, x, k, params=None):
+        x = np.asarray(x, dtype=np.float32)
+        fetch = min(k * self.rescore_factor, self.ntotal)
+        if params is None:
+            _, candidates = self.compact.search(x, fetch)
+        else:
+            _, candidates = self.compact.search(x, fetch, params=params)
+
+        distances = np.full((len(x), k), np.inf, dtype=np.float32)
+        ids = np.full((len(x), k), -1, dtype=np.int64)
+        for row, query in enumerate(x):
+            found = np.sort(candidates[row][candidates[row] >= 0])
+            if not len(found):
+                continue
+            exact = ((np.asarray(self.full_vectors[found], dtype=np.float32) - query) ** 2).sum(axis=1)
+            order = np.argsort(exact)[:k]
+            distances[row, :len(order)] = exact[order]
+            ids[row, :len(order)] = found[order]
+        return distances, ids
+
+    def reconstruct(self, i):
+        return np.array(self.full_vectors[int(i)], dtype=np.float32)
+
+    def reconstruct_batch(self, ids):
+        return np.asarray(self.full_vectors[np.asarray(ids, dtype=np.int64)], dtype=np.float32)
+
+
+def save_full_precision(matrix, directory):
+    """Write `matrix` to `directory` (once per distinct corpus) and memory-map it read-only
+
+    Files are named by content hash, so processes embedding the same corpus
+    share one file; files of older corpora are removed (processes still
+    mapping one keep their view on POSIX systems).
+    """
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    digest = hashlib.sha1(matrix.data).hexdigest()[:16]
+    path = os.path.join(directory, f"vectors-{digest}.npy")
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, matrix)
+        os.replace(tmp, path)
+        for stale in glob.glob(os.path.join(directory, "vectors-*.npy")):
+            if stale != path:
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+        logger.info("✓ Wrote full-precision vectors to %s (%.1f MB)", path, matrix.nbytes / 1024 / 1024)
+    return np.load(path, mmap_mode="r")
+
+
+def build_vectorstore(texts, embeddings, config: IndexConfig = None, metadatas=None, vectors=None,
+                      rescore: bool = True):
+    """Embed `texts` and build a LangChain FAISS store on the configured index
+
+    Args:
+        texts: Chunks to index
+        embeddings: LangChain embeddings model (also used for queries)
+        config: IndexConfig (default: IndexConfig.from_env())
+        metadatas: Optional metadata dict per text
+        vectors: Pre-computed embeddings for `texts` (skips embed_documents)
+        rescore: With compact storage, wrap the index in a RescoringIndex over
+            memory-mapped float32 vectors (False keeps a plain, saveable index)
+    """
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.vectorstores import FAISS
+
+    config = config or IndexConfig.from_env()
+    if vectors is None:
+        vectors = embeddings.embed_documents(list(texts))
+    matrix = np.asarray(vectors, dtype=np.float32)
+
+    index = create_index(matrix, config)
+    vectorstore = FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=InMemoryDocstore(),
+        index_to_docstore_id={}
+    )
+    vectorstore.add_embeddings(list(zip(texts, matrix.tolist())), metadatas=metadatas)
+    logger.info("✓ Built %s with %s vectors", type(index).__name__, index.ntotal)
+
+    if config.compact and rescore and config.rescore_factor:
+        directory = os.getenv("VECTOR_FULL_PRECISION_DIR", "vector_store")
+        vectorstore.index = RescoringIndex(index, save_full_precision(matrix, directory), config.rescore_factor)
+    return vectorstore
+
+
+def index_memory_bytes(index) -> int:
+    """Serialized size of a FAISS index, a close proxy for its resident memory
+
+    For a RescoringIndex this is the compact index only; the full-precision
+    vectors are a shared memory map.
+    """
+    import faiss
+
+    return int(faiss.serialize_index(getattr(index, "compact", index)).nbytes)
+
+
+def resident_index_bytes(index) -> int:
+    """Approximate in-memory size of a FAISS index without serializing it
+
+    Cheap enough to call periodically (see session_memory). Counts stored
+    codes, ids and graph links; falls back to index_memory_bytes for index
+    types it doesn't know. Memory-mapped full-precision vectors of a
+    RescoringIndex are not counted.
+    """
+    import faiss
+
+    index = faiss.downcast_index(getattr(index, "compact", index))
+    if isinstance(index, faiss.IndexPreTransform):
+        return resident_index_bytes(index.index)
+    if isinstance(index, faiss.IndexHNSW):
+        hnsw = index.hnsw
+        links = hnsw.neighbors.size() * 4 + hnsw.levels.size() * 4 + hnsw.offsets.size() * 8
+        return resident_index_bytes(index.storage) + links
+    if isinstance(index, faiss.IndexIVF):
+        return resident_index_bytes(index.quantizer) + index.ntotal * (index.code_size + 8)
+    if hasattr(index, "codes"):
+        return index.codes.size()
+    return index_memory_bytes(index)